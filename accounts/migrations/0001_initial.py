@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('kindergartens', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('name', models.CharField(max_length=100, verbose_name='名前')),
+                ('display_name', models.CharField(blank=True, max_length=50, null=True, verbose_name='表示名')),
+                ('email', models.EmailField(max_length=254, unique=True, verbose_name='メールアドレス')),
+                ('is_staff', models.BooleanField(default=False, verbose_name='スタッフ権限')),
+                ('is_active', models.BooleanField(default=True, verbose_name='アクティブ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('groups', models.ManyToManyField(blank=True, related_name='user_custom_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('kindergarten', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='users', to='kindergartens.kindergarten', verbose_name='所属園')),
+                ('user_permissions', models.ManyToManyField(blank=True, related_name='user_custom_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'ユーザー',
+                'verbose_name_plural': 'ユーザー',
+                'db_table': 'users',
+            },
+        ),
+    ]
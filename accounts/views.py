@@ -8,6 +8,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import PasswordChangeView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from products.models import Product, ProductImage
+from products.cards import ProductCard, parse_status_filter
+from products.pagination import HISTORY_PER_PAGE, CursorPaginator
 
 
 
@@ -131,29 +133,34 @@ def mypage(request):
     return render(request, 'accounts/mypage.html', context)
 
 
+def my_listings_paginator(user_id, status_filter=None):
+    """
+    出品した商品一覧のページネーション (check_query_plans でも同じクエリの実行計画を確認する)
+    商品カードの表示に必要なカラムだけを取得する (メイン画像は JOIN で一緒に取得)
+    ステータスバッジの CSS クラス (status_class) も同じクエリで求める
+    (user, -created_at) のインデックスを使ったカーソルページネーションで1ページ分だけ取得する
+    """
+    # Productモデルの user フィールドでフィルター (status で絞り込み可)
+    queryset = Product.objects.filter(user_id=user_id)
+    if status_filter is not None:
+        queryset = queryset.filter(status=status_filter)
+    return CursorPaginator(
+        ProductCard.values(queryset.annotate(**ProductCard.status_annotations()), 'status_class'),
+        HISTORY_PER_PAGE,
+        row_factory=ProductCard.from_row,
+    )
+
 @login_required
 def my_listings(request):
     """出品した商品一覧ビュー"""
-    # ログイン中のユーザーが出品した商品を取得
-    # Productモデルの user フィールドでフィルター
-    # main_product_image を参照するので select_related でJoinした結果を取得しておく (N+1対策)
-    user_products = Product.objects.filter(user=request.user).select_related(
-        'main_product_image' # メイン画像の情報を一緒に取得
-    ).order_by('-created_at')
-
-    # 商品のステータスに応じてステータスクラスを追加し、テンプレートに渡す
-    for product in user_products:
-        if product.status == Product.Status.FOR_SALE:
-            product.status_class = "status-for-sale"
-        elif product.status == Product.Status.IN_TRANSACTION:
-            product.status_class = "status-in-transaction"
-        elif product.status == Product.Status.SOLD:
-            product.status_class = "status-sold"
-        else:
-            product.status_class = ""
+    # ログイン中のユーザーが出品した商品を取得 (status で絞り込み可)
+    status_filter = parse_status_filter(request.GET.get('status'))
+    user_products = my_listings_paginator(request.user.pk, status_filter).page(request.GET.get('cursor'))
 
     context = {
         'products': user_products,
+        'status_filter': status_filter,
+        'status_choices': Product.Status.choices,
         'active_mypage_menu': 'my_listings',
     }
     return render(request, 'accounts/my_listings.html', context)
@@ -0,0 +1,285 @@
+# core/query_budget.py
+"""
+各ビューのクエリ数・SQL 時間・描画時間を計測し、記録済みの予算 (query_budgets.json) と比較する
+テンプレートの変更などで N+1 が入り込んだ場合に core.tests.QueryBudgetTests が失敗する
+(通常のテストで比較するのはクエリ数のみ。時間は環境によってばらつくので、明示した場合だけ比較する)
+
+予算の記録・更新 (ビューを意図して変更した場合):
+    UPDATE_QUERY_BUDGETS=1 python manage.py test core
+時間も比較する場合:
+    CHECK_QUERY_BUDGET_TIMINGS=1 python manage.py test core
+"""
+import json
+import time
+from importlib import import_module
+from pathlib import Path
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.urls import reverse
+
+from accounts.models import User
+from interactions.counters import reconcile_product_counters
+from interactions.models import Comment, Favorite, PurchaseIntent
+from kindergartens.models import Kindergarten
+from products.models import Product, ProductCategory, ProductImage
+from products.normalizers import build_search_key
+from products.renditions import RENDITION_FORMATS, RENDITION_WIDTHS, rendition_name
+from products.search import rebuild_index
+
+# 予算 (計測値の記録) のファイル
+BASELINE_PATH = Path(__file__).with_name('query_budgets.json')
+# 計測対象の URL 設定 (ここに含まれる URL はすべて計測ケースが必要)
+URLCONFS = ('products.urls', 'interactions.urls', 'accounts.urls')
+# 時間は環境によってばらつくので、記録値の TIME_TOLERANCE 倍 + TIME_SLACK_MS までは許容する (クエリ数は記録値と一致すること)
+TIME_TOLERANCE = 3.0
+TIME_SLACK_MS = 50.0
+# 時間は REPEAT 回計測した最小値を使う (初回のテンプレート読み込みなどの影響を除く)
+REPEAT = 3
+
+# 計測用データの件数
+PRODUCT_COUNT = 60 # 出品者の商品数 (一覧・マイページのページサイズより多く)
+POPULAR_INTENT_COUNT = 60 # 人気の商品1件あたりの購入意思表示数
+COMMENT_COUNT = 20 # 人気の商品のコメント数
+
+
+class Rollback(Exception):
+    """計測したリクエストによる変更を破棄するための例外"""
+
+
+# --- 計測用データ ---
+def _renditions(source_name, width=800, height=600):
+    """作成済みのレンディションの情報 (products.renditions.build_renditions と同じ形式。ファイルは作らない)"""
+    renditions = {'source': source_name}
+    for preset, preset_width in RENDITION_WIDTHS.items():
+        scaled = min(width, preset_width)
+        entry = {'width': scaled, 'height': round(height * scaled / width)}
+        for fmt, (extension, _options) in RENDITION_FORMATS.items():
+            entry[fmt] = rendition_name(source_name, preset, extension)
+        renditions[preset] = entry
+    return renditions
+
+
+def seed_dataset():
+    """
+    計測用のデータを作成し、計測ケースで使うオブジェクトの辞書を返す
+    出品者1人・閲覧者 (購入希望者) 多数、画像付きの商品、お気に入り・購入意思表示・コメント
+    """
+    kindergarten = Kindergarten.objects.create(
+        name='予算計測園', auth_code='query-budget', zip_code='100-0001', prefecture='tokyo', address='千代田区',
+    )
+    seller = User.objects.create_user(
+        email='budget-seller@example.com', password=None, name='出品者', kindergarten=kindergarten,
+    )
+    buyers = User.objects.bulk_create([
+        User(email=f'budget-buyer{i}@example.com', name=f'購入希望者{i}', display_name=f'購入希望者{i}', kindergarten=kindergarten)
+        for i in range(POPULAR_INTENT_COUNT)
+    ])
+    buyer = buyers[0]
+    categories = ProductCategory.objects.bulk_create([ProductCategory(name=name) for name in ('制服', '体操服', '帽子')])
+
+    products = Product.objects.bulk_create([
+        Product(
+            user=seller, kindergarten=kindergarten, product_category=categories[i % len(categories)],
+            name=f'スモック {i}', price=100 + i * 10, description='名前の記入なし。' * 10,
+            size=Product.Size.values[i % len(Product.Size.values)],
+            condition=Product.Condition.values[i % len(Product.Condition.values)],
+            search_key=build_search_key(f'スモック {i}', '名前の記入なし。' * 10),
+        )
+        for i in range(PRODUCT_COUNT)
+    ])
+    # 閲覧者の出品 (出品者が商品一覧で見るため)
+    products += Product.objects.bulk_create([
+        Product(
+            user=buyer, kindergarten=kindergarten, product_category=categories[0], name=f'帽子 {i}', price=300,
+            search_key=build_search_key(f'帽子 {i}', ''),
+        )
+        for i in range(10)
+    ])
+
+    # 画像 (メイン + サブ2枚。ファイル名だけを登録し、ファイルは作らない)
+    images = ProductImage.objects.bulk_create([
+        ProductImage(
+            product=product, image=f'product_images/budget/{product.pk}-{order}.jpg', display_order=order,
+            width=800, height=600, renditions=_renditions(f'product_images/budget/{product.pk}-{order}.jpg'),
+        )
+        for product in products for order in range(3)
+    ])
+    for product in products:
+        product.main_product_image = next(image for image in images if image.product_id == product.pk and image.display_order == 0)
+    Product.objects.bulk_update(products, ['main_product_image'])
+
+    popular, in_transaction = products[0], products[1]
+    # 人気の商品には全員が購入意思表示し、閲覧者はそのほかの商品の半分をお気に入り・購入意思表示する
+    PurchaseIntent.objects.bulk_create(
+        [PurchaseIntent(user=user, product=popular, seller=seller) for user in buyers]
+        + [PurchaseIntent(user=buyer, product=product, seller=seller) for product in products[1:PRODUCT_COUNT:2]]
+    )
+    Favorite.objects.bulk_create([Favorite(user=buyer, product=product) for product in products[:PRODUCT_COUNT:2]])
+    Comment.objects.bulk_create([
+        Comment(user=buyers[i % 5] if i % 2 else seller, product=popular, content=f'コメント {i}')
+        for i in range(COMMENT_COUNT)
+    ])
+    Product.objects.start_transaction(in_transaction.pk, buyer.pk)
+
+    # bulk_create ではシグナルが送られないので、全文検索のインデックスと集計用カウンターを作り直す
+    rebuild_index()
+    reconcile_product_counters()
+
+    return {
+        'seller': seller,
+        'buyer': buyer,
+        'product': popular,
+        'buyer_product': products[-1],
+        'intent': PurchaseIntent.objects.get(user=buyer, product=popular),
+        'negotiating_intent': PurchaseIntent.objects.get(user=buyer, product=in_transaction),
+    }
+
+
+# --- 計測ケース ---
+def budget_cases(data):
+    """
+    計測ケースの一覧 [(ケース名, URL 名, URL 引数, メソッド, ログインユーザー, パラメータ)]
+    ケース名が予算ファイルのキーになる。URL 名が同じでもパラメータ違いのケースを追加できる
+    """
+    product_pk = {'pk': data['product'].pk}
+    seller, buyer = data['seller'], data['buyer']
+    return [
+        # products
+        ('products:top', 'products:top', {}, 'get', seller, {}),
+        ('products:top?keyword', 'products:top', {}, 'get', buyer, {'keyword': 'スモック'}),
+        ('products:top?category', 'products:top', {}, 'get', buyer, {'category': data['product'].product_category_id}),
+        ('products:sell', 'products:sell', {}, 'get', seller, {}),
+        ('products:product_detail', 'products:product_detail', product_pk, 'get', buyer, {}),
+        ('products:product_detail (seller)', 'products:product_detail', product_pk, 'get', seller, {}),
+        ('products:product_edit', 'products:product_edit', product_pk, 'get', seller, {}),
+        ('products:product_delete', 'products:product_delete', product_pk, 'get', seller, {}),
+        # interactions
+        ('interactions:favorite_list', 'interactions:favorite_list', {}, 'get', buyer, {}),
+        ('interactions:favorite_toggle', 'interactions:favorite_toggle', {'product_pk': data['product'].pk}, 'post', buyer, {}),
+        ('interactions:add_purchase_intent', 'interactions:add_purchase_intent', {'product_pk': data['buyer_product'].pk}, 'post', seller, {}),
+        ('interactions:delete_purchase_intent', 'interactions:delete_purchase_intent', {'product_pk': data['product'].pk}, 'post', buyer, {}),
+        ('interactions:received_purchase_intents_list', 'interactions:received_purchase_intents_list', {}, 'get', seller, {}),
+        ('interactions:received_purchase_intents_list?group', 'interactions:received_purchase_intents_list', {}, 'get', seller, {'group': 'product'}),
+        ('interactions:sent_purchase_intents_list', 'interactions:sent_purchase_intents_list', {}, 'get', buyer, {}),
+        ('interactions:start_transaction', 'interactions:start_transaction', {'intent_pk': data['intent'].pk}, 'post', seller, {}),
+        ('interactions:complete_transaction', 'interactions:complete_transaction', {'intent_pk': data['negotiating_intent'].pk}, 'post', seller, {}),
+        # accounts
+        ('accounts:login', 'accounts:login', {}, 'get', buyer, {}),
+        ('accounts:logout', 'accounts:logout', {}, 'post', buyer, {}),
+        ('accounts:signup', 'accounts:signup', {}, 'get', buyer, {}),
+        ('accounts:mypage', 'accounts:mypage', {}, 'get', buyer, {}),
+        ('accounts:my_listings', 'accounts:my_listings', {}, 'get', seller, {}),
+        ('accounts:profile_name_edit', 'accounts:profile_name_edit', {}, 'get', buyer, {}),
+        ('accounts:profile_display_name_edit', 'accounts:profile_display_name_edit', {}, 'get', buyer, {}),
+        ('accounts:profile_email_edit', 'accounts:profile_email_edit', {}, 'get', buyer, {}),
+        ('accounts:profile_password_edit', 'accounts:profile_password_edit', {}, 'get', buyer, {}),
+    ]
+
+
+def url_names():
+    """URLCONFS に含まれる URL 名の一覧 ('app_name:name')"""
+    names = []
+    for urlconf in URLCONFS:
+        module = import_module(urlconf)
+        names += [f'{module.app_name}:{pattern.name}' for pattern in module.urlpatterns if pattern.name]
+    return names
+
+
+def uncovered_url_names(cases):
+    """計測ケースがない URL 名の一覧 (URL を追加した場合は budget_cases にケースを追加する)"""
+    covered = {url_name for _, url_name, *_ in cases}
+    return [name for name in url_names() if name not in covered]
+
+
+# --- 計測 ---
+class QueryTimer:
+    """connection.execute_wrapper に渡し、実行したクエリの数と合計時間を記録する"""
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.count += 1
+
+
+def measure(client, method, path, params):
+    """
+    1リクエストを計測し、(レスポンス, クエリ数, SQL 時間 ms, 描画時間 ms) を返す
+    キャッシュを空にした状態で実行し、リクエストによる変更はロールバックする
+    描画時間はリクエスト全体の時間から SQL の時間を除いたもの (ビューの処理 + テンプレートの描画)
+    """
+    timer = QueryTimer()
+    try:
+        with transaction.atomic():
+            cache.clear()
+            with connection.execute_wrapper(timer):
+                start = time.perf_counter()
+                response = getattr(client, method)(path, params)
+                elapsed = time.perf_counter() - start
+            raise Rollback
+    except Rollback:
+        pass
+    return response, timer.count, timer.elapsed * 1000, max(elapsed - timer.elapsed, 0.0) * 1000
+
+
+def run_cases(client, cases, repeat=REPEAT):
+    """
+    全ケースを計測し、{ケース名: {'status', 'queries', 'sql_ms', 'render_ms'}} を返す
+    時間は repeat 回の最小値
+    """
+    results = {}
+    for name, url_name, kwargs, method, user, params in cases:
+        path = reverse(url_name, kwargs=kwargs)
+        samples = []
+        for _ in range(repeat):
+            client.force_login(user) # ログアウトのケースの後もログイン状態から計測する
+            samples.append(measure(client, method, path, params))
+        response, queries, _, _ = samples[-1]
+        results[name] = {
+            'status': response.status_code,
+            'queries': queries,
+            'sql_ms': round(min(sample[2] for sample in samples), 2),
+            'render_ms': round(min(sample[3] for sample in samples), 2),
+        }
+    return results
+
+
+# --- 予算ファイル ---
+def load_baseline(path=BASELINE_PATH):
+    """予算ファイルを読み込む (ない場合は空の辞書)"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    """計測結果を予算ファイルに書き込む"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def over_budget(result, budget, check_times=False):
+    """
+    予算と合わない項目の説明のリスト (問題なければ空)
+    クエリ数は記録値と一致すること (減った場合も予算を記録し直す)。時間は check_times の場合だけ比較する
+    """
+    problems = []
+    if result['queries'] != budget['queries']:
+        problems.append(f"クエリ数 {result['queries']} != 予算 {budget['queries']}")
+    if not check_times:
+        return problems
+    for key, label in (('sql_ms', 'SQL 時間'), ('render_ms', '描画時間')):
+        limit = budget[key] * TIME_TOLERANCE + TIME_SLACK_MS
+        if result[key] > limit:
+            problems.append(f'{label} {result[key]:.1f}ms > 許容 {limit:.1f}ms (記録 {budget[key]:.1f}ms)')
+    return problems
@@ -0,0 +1,32 @@
+# core/test_runner.py
+import os
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    テスト中はキャッシュをプロセス内のメモリに置く
+    (settings のファイルキャッシュは実行をまたいで残るため、前回のテストや開発サーバーのキャッシュを読んでしまう)
+    """
+
+    def setup_databases(self, **kwargs):
+        # テスト用 DB ファイルの置き場 (var/) はリポジトリに含めないので、なければ作成する
+        for database in settings.DATABASES.values():
+            test_name = database.get('TEST', {}).get('NAME')
+            if test_name:
+                os.makedirs(os.path.dirname(test_name), exist_ok=True)
+        return super().setup_databases(**kwargs)
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_settings = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        })
+        self._cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
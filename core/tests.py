@@ -1,3 +1,44 @@
+import os
+
 from django.test import TestCase
 
-# Create your tests here.
+from . import query_budget
+
+
+class QueryBudgetTests(TestCase):
+    """
+    各ビューのクエリ数が予算 (core/query_budgets.json) と一致すること
+    予算の記録・更新: UPDATE_QUERY_BUDGETS=1 python manage.py test core
+    SQL 時間・描画時間も比較する: CHECK_QUERY_BUDGET_TIMINGS=1 python manage.py test core
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = query_budget.seed_dataset()
+
+    def setUp(self):
+        self.cases = query_budget.budget_cases(self.data)
+
+    def assertWithinBudget(self, results, check_times=False):
+        baseline = query_budget.load_baseline()
+        for name, result in results.items():
+            with self.subTest(name):
+                self.assertLess(result['status'], 500)
+                self.assertIn(name, baseline, '予算が記録されていません (UPDATE_QUERY_BUDGETS=1 で記録する)')
+                self.assertEqual(query_budget.over_budget(result, baseline[name], check_times), [])
+
+    def test_every_url_has_a_case(self):
+        self.assertEqual(query_budget.uncovered_url_names(self.cases), [])
+
+    def test_views_within_budget(self):
+        if os.environ.get('UPDATE_QUERY_BUDGETS'):
+            query_budget.save_baseline(query_budget.run_cases(self.client, self.cases))
+            self.skipTest(f'予算を記録しました: {query_budget.BASELINE_PATH}')
+        # クエリ数は毎回同じなので1回ずつ計測する
+        self.assertWithinBudget(query_budget.run_cases(self.client, self.cases, repeat=1))
+
+    def test_view_timings_within_budget(self):
+        # 時間は環境 (CI のマシンの負荷など) によってばらつくので、明示した場合だけ比較する
+        if not os.environ.get('CHECK_QUERY_BUDGET_TIMINGS'):
+            self.skipTest('時間の比較は CHECK_QUERY_BUDGET_TIMINGS=1 の場合のみ')
+        self.assertWithinBudget(query_budget.run_cases(self.client, self.cases), check_times=True)
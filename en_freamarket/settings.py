@@ -89,10 +89,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # 書き込むトランザクションは開始時に書き込みロックを取る (読み込みから書き込みに切り替える時点で
+            # 他の書き込みとぶつかると待たずに "database is locked" になるため)。ロック待ちは最大20秒
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # テストもファイルの DB で動かす (メモリ上の DB は接続間で共有キャッシュになり、同時に書き込むと
+        # ロックを待たずに "database table is locked" になるため、同時実行のテストが本番と同じ動きにならない)
+        'TEST': {
+            'NAME': BASE_DIR / 'var' / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 商品一覧・件数のキャッシュは園ごとのバージョンで無効化する。既定の locmem はプロセスごとに別のため、
+# 複数のワーカープロセスで動かすとバージョンの更新が他のプロセスに届かない。全プロセスで共有できるファイルに置く
+# (複数のサーバーで動かす場合は Redis / Memcached に切り替える)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'cache',
+    }
+}
+
+# テスト中はキャッシュをメモリに置き換える (core.test_runner)
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,6 +167,13 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 商品画像のレンディション (縮小画像) を作成するプロセス数 (0 の場合はリクエスト内で作成する)
+PRODUCT_RENDITION_WORKERS = 2
+
+# オンデマンドのリサイズ画像 (/media/r/<width>/<path>) のキャッシュ置き場と容量の上限 (超えると古いものから削除)
+RESIZE_CACHE_ROOT = BASE_DIR / 'var' / 'resized'
+RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -158,6 +193,10 @@ DEFAULT_FROM_EMAIL = f'"園フリマ運営" <{EMAIL_HOST_USER}>'
 
 LOGIN_URL = 'accounts:login'
 
+# ログファイルの出力先 (リポジトリには含めないので、なければ作成する)
+LOG_DIR = BASE_DIR / 'logs'
+os.makedirs(LOG_DIR, exist_ok=True)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -176,7 +215,7 @@ LOGGING = {
         'file': {
             'level': 'ERROR', # ERROR以上のログを出力
             'class': 'logging.handlers.TimedRotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs/django.log'),
+            'filename': os.path.join(LOG_DIR, 'django.log'),
             'when': 'midnight',
             'backupCount': 21, # 21日分保存
             'formatter': 'development',
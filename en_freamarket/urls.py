@@ -21,6 +21,7 @@ from django.conf.urls.static import static
 from django.conf import settings
 
 from core.views import portfolio_view
+from products.views import resized_image
 
 # 園フリマアプリケーション用
 enfreamarket_patterns = [
@@ -33,6 +34,7 @@ enfreamarket_patterns = [
 urlpatterns = [
     path('', portfolio_view, name='portfolio'),
     path('admin/', admin.site.urls),
+    path('media/r/<int:width>/<path:path>', resized_image, name='resized_image'), # リサイズ画像 (MEDIA_URL より先に判定する)
     path('enfreamarket/', include(enfreamarket_patterns)), # 園フリマアプリ全体にプレフィックスを適用
 ]
 
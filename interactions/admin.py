@@ -1,3 +1,20 @@
 from django.contrib import admin
+from django.utils import timezone
 
-# Register your models here.
+from .models import OutboundEmail
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('recipient', 'subject')
+    actions = ['requeue']
+
+    @admin.action(description='選択したメールを再送する')
+    def requeue(self, request, queryset):
+        # 送信失敗 (デッドレター) になったメールを送信待ちに戻す
+        updated = queryset.exclude(status=OutboundEmail.Status.SENT).update(
+            status=OutboundEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
+        self.message_user(request, f'{updated} 件のメールを送信待ちに戻しました。')
@@ -0,0 +1,53 @@
+# interactions/counters.py
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_subquery(model):
+    """商品ごとの件数を返す相関サブクエリ"""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(product=OuterRef('pk'))
+            .order_by().values('product')
+            .annotate(count=Count('pk')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def product_counter_expressions(favorite_model, purchase_intent_model, comment_model):
+    """
+    Product の集計用カウンターを実データから再計算する式
+    (マイグレーションからも使えるようにモデルは引数で受け取る)
+    """
+    return {
+        'favorite_count': _count_subquery(favorite_model),
+        'purchase_intent_count': _count_subquery(purchase_intent_model),
+        'comment_count': _count_subquery(comment_model),
+    }
+
+
+def reconcile_product_counters(product_queryset=None, batch_size=1000):
+    """
+    商品の集計用カウンターを pk 順のバッチごとに UPDATE 1回で再集計する
+    更新した商品数を返す
+    """
+    from products.models import Product
+    from .models import Comment, Favorite, PurchaseIntent
+
+    if product_queryset is None:
+        product_queryset = Product.objects.all()
+    expressions = product_counter_expressions(Favorite, PurchaseIntent, Comment)
+
+    updated = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            product_queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            break
+        last_pk = pks[-1]
+        updated += Product.objects.filter(pk__in=pks).update(**expressions)
+    return updated
@@ -0,0 +1,15 @@
+# interactions/management/commands/reconcile_product_counters.py
+from django.core.management.base import BaseCommand
+
+from interactions.counters import reconcile_product_counters
+
+
+class Command(BaseCommand):
+    help = '商品のお気に入り数・購入意思表示数・コメント数 (非正規化カウンター) を実データから再集計する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の UPDATE でまとめる商品数')
+
+    def handle(self, *args, **options):
+        updated = reconcile_product_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{updated} 件の商品のカウンターを再集計しました。'))
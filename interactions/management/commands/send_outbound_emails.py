@@ -0,0 +1,36 @@
+# interactions/management/commands/send_outbound_emails.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from interactions.outbox import MAX_ATTEMPTS, send_due_emails
+
+
+class Command(BaseCommand):
+    help = '送信待ちの通知メール (アウトボックス) を送信する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='1つの SMTP 接続で送信する最大件数')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help='送信失敗 (デッドレター) にするまでの試行回数')
+        parser.add_argument('--loop', action='store_true', help='終了せずに送信待ちメールを監視し続ける')
+        parser.add_argument('--interval', type=float, default=10, help='--loop 時、送信待ちがない場合の待機秒数')
+
+    def handle(self, *args, **options):
+        total_sent = total_retried = total_dead = 0
+        while True:
+            sent, retried, dead = send_due_emails(
+                batch_size=options['batch_size'], max_attempts=options['max_attempts'],
+            )
+            total_sent += sent
+            total_retried += retried
+            total_dead += dead
+
+            if sent or retried or dead:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'送信: {total_sent} 件, 再送予定: {total_retried} 件, 送信失敗: {total_dead} 件'
+        ))
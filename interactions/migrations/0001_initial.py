@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('products', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField(verbose_name='コメント本文')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='投稿日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='products.product', verbose_name='商品')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to=settings.AUTH_USER_MODEL, verbose_name='コメント投稿者')),
+            ],
+            options={
+                'verbose_name': 'コメント',
+                'verbose_name_plural': 'コメント',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Favorite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favorited_by', to='products.product', verbose_name='商品')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+            options={
+                'verbose_name': 'お気に入り',
+                'verbose_name_plural': 'お気に入り',
+                'indexes': [models.Index(fields=['user', '-created_at', '-id'], name='favorite_user_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'product'), name='unique_favorite')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PurchaseIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='意思表示日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchase_intended_by', to='products.product', verbose_name='商品')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchase_intents', to=settings.AUTH_USER_MODEL, verbose_name='購入意思表示者')),
+            ],
+            options={
+                'verbose_name': '購入意思表示',
+                'verbose_name_plural': '購入意思表示',
+                'indexes': [models.Index(fields=['user', '-created_at', '-id'], name='intent_user_created_idx'), models.Index(fields=['product', '-created_at', '-id'], name='intent_product_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'product'), name='unique_purchase_intent')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_seller(apps, schema_editor):
+    """既存の購入意思表示に商品の出品者を設定する"""
+    PurchaseIntent = apps.get_model('interactions', 'PurchaseIntent')
+    Product = apps.get_model('products', 'Product')
+    PurchaseIntent.objects.update(
+        seller_id=models.Subquery(Product.objects.filter(pk=models.OuterRef('product_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interactions', '0002_outboundemail'),
+        ('products', '0008_filetombstone'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseintent',
+            name='seller',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='received_purchase_intents', to=settings.AUTH_USER_MODEL, verbose_name='出品者'),
+        ),
+        migrations.RunPython(backfill_seller, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='purchaseintent',
+            name='seller',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='received_purchase_intents', to=settings.AUTH_USER_MODEL, verbose_name='出品者'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseintent',
+            index=models.Index(fields=['seller', '-created_at', '-id'], name='intent_seller_created_idx'),
+        ),
+    ]
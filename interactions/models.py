@@ -1,8 +1,59 @@
 # interactions/models.py
 from django.db import models
+from django.db.models import Case, F, Value, When, Window
+from django.db.models.functions import RowNumber
 from django.conf import settings # settings.AUTH_USER_MODEL を参照するため
+from django.utils import timezone
+from products.cards import ProductCard
 from products.models import Product
 
+
+class UserProductQuerySet(models.QuerySet):
+    """ユーザーと商品の組み合わせを持つモデル (お気に入り・購入意思表示) 共通のクエリセット"""
+
+    def product_ids_for(self, user, product_ids):
+        """
+        指定した商品IDのうち、ユーザーが登録済みのものを set で返す
+        表示中のページの商品IDだけを IN で問い合わせるので、ユーザーの登録件数に関係なくページサイズ分のコストで済む
+        """
+        product_ids = list(product_ids)
+        if not product_ids or not getattr(user, 'is_authenticated', False):
+            return set()
+        return set(
+            self.filter(user=user, product_id__in=product_ids).values_list('product_id', flat=True)
+        )
+
+    def with_status_info(self, party, messages):
+        """
+        商品のステータス表示 (status_class, status_message_info) を Case/When の注釈として追加する
+        行ごとに Python で判定・ユーザーを取得せず、一覧の取得クエリ1回で求める
+        party, messages: ProductCard.status_annotations を参照
+        """
+        return self.annotate(**ProductCard.status_annotations('product__', party, messages))
+
+
+class PurchaseIntentQuerySet(UserProductQuerySet):
+    """購入意思表示のクエリセット"""
+
+    def first_per_product(self, product_ids, limit):
+        """
+        指定した商品ごとに、先頭の limit 件の購入意思表示を返す (ウィンドウ関数 ROW_NUMBER で商品ごとに順位付け)
+        取引相手 (negotiating_user) の意思表示を先頭にし、残りは意思表示の古い順 (先着順)
+        表示中のページの商品IDだけを IN で問い合わせるので、1商品あたりの意思表示数が多くてもクエリは1回で済む
+        """
+        return self.filter(product_id__in=list(product_ids)).annotate(
+            product_rank=Window(
+                RowNumber(),
+                partition_by=F('product_id'),
+                order_by=[
+                    Case(When(user_id=F('product__negotiating_user_id'), then=Value(0)), default=Value(1)),
+                    F('created_at').asc(),
+                    F('id').asc(),
+                ],
+            ),
+        ).filter(product_rank__lte=limit)
+
+
 class Favorite(models.Model):
     """お気に入りモデル"""
     user = models.ForeignKey(
@@ -20,6 +71,8 @@ class Favorite(models.Model):
     created_at = models.DateTimeField('登録日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
+    objects = UserProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'お気に入り'
         verbose_name_plural = 'お気に入り'
@@ -28,6 +81,10 @@ class Favorite(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'product'], name='unique_favorite')
         ]
+        indexes = [
+            # お気に入り一覧: ユーザーで絞り込み、新しい順 (id はカーソルページネーションのタイブレーク)
+            models.Index(fields=['user', '-created_at', '-id'], name='favorite_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.display_name} : {self.product.name} をお気に入りに追加 ({self.created_at})'
@@ -47,10 +104,20 @@ class PurchaseIntent(models.Model):
         related_name='purchase_intended_by',
         verbose_name='商品'
     )
+    # 商品の出品者 (非正規化)。受けた購入意思表示の一覧を、商品を JOIN せずにインデックスで新しい順に取得するため
+    seller = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='received_purchase_intents',
+        verbose_name='出品者',
+        editable=False,
+    )
     
     created_at = models.DateTimeField('意思表示日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
+    objects = PurchaseIntentQuerySet.as_manager()
+
     class Meta:
         verbose_name = '購入意思表示'
         verbose_name_plural = '購入意思表示'
@@ -58,10 +125,24 @@ class PurchaseIntent(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'product'], name='unique_purchase_intent')
         ]
+        indexes = [
+            # 購入意思表示した商品一覧: ユーザーで絞り込み、新しい順
+            models.Index(fields=['user', '-created_at', '-id'], name='intent_user_created_idx'),
+            # 購入意思表示を受けた商品一覧: 商品ごとに新しい順
+            models.Index(fields=['product', '-created_at', '-id'], name='intent_product_created_idx'),
+            # 受けた購入意思表示の一覧: 出品者で絞り込み、新しい順
+            models.Index(fields=['seller', '-created_at', '-id'], name='intent_seller_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.display_name} : {self.product.name} の購入意思表示 ({self.created_at})'
 
+    def save(self, *args, **kwargs):
+        # 出品者は商品から設定する (bulk_create する場合は呼び出し側で seller を指定すること)
+        if self.seller_id is None and self.product_id is not None:
+            self.seller_id = self.product.user_id
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     """商品コメントモデル"""
@@ -91,4 +172,36 @@ class Comment(models.Model):
         ordering = ['created_at'] # 古いコメントから順に表示 (昇順)
 
     def __str__(self):
-        return f'{self.product.name} - {self.user.display_name}: {self.text[:30]}...'
\ No newline at end of file
+        return f'{self.product.name} - {self.user.display_name}: {self.text[:30]}...'
+
+class OutboundEmail(models.Model):
+    """
+    送信待ちの通知メール (トランザクショナル・アウトボックス)
+    業務データの変更と同じトランザクションで登録し、send_outbound_emails コマンドが送信する
+    """
+    class Status(models.IntegerChoices):
+        PENDING = 0, '送信待ち'
+        SENT = 1, '送信済'
+        DEAD = 2, '送信失敗 (再送上限)'
+
+    recipient = models.EmailField('送信先')
+    subject = models.CharField('件名', max_length=255)
+    body = models.TextField('本文')
+    status = models.IntegerField('ステータス', choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField('送信試行回数', default=0)
+    next_attempt_at = models.DateTimeField('次回送信日時', default=timezone.now)
+    last_error = models.TextField('最後のエラー', blank=True, default='')
+    sent_at = models.DateTimeField('送信日時', null=True, blank=True)
+    created_at = models.DateTimeField('登録日時', auto_now_add=True)
+    updated_at = models.DateTimeField('更新日時', auto_now=True)
+
+    class Meta:
+        verbose_name = '送信待ちメール'
+        verbose_name_plural = '送信待ちメール'
+        indexes = [
+            # ワーカーの取得: 送信待ちのうち送信時刻を過ぎたものを古い順
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipient} : {self.subject} ({self.get_status_display()})'
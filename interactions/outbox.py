@@ -0,0 +1,139 @@
+# interactions/outbox.py
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# 送信失敗時の再送間隔 (秒): 1分, 2分, 4分 ... と倍にしていき、最大6時間
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 60 * 60
+# この回数失敗したら再送をやめて送信失敗 (デッドレター) にする
+MAX_ATTEMPTS = 8
+# ワーカーが取得したメールを他のワーカーに渡さないための予約時間
+LEASE_SECONDS = 5 * 60
+
+
+def enqueue_email(subject, template_name, context, recipient_list):
+    """
+    通知メールを送信待ちとして登録する (送信は send_outbound_emails コマンドが行う)
+    業務データの変更と同じ transaction.atomic() の中で呼ぶと、ロールバック時にメールも登録されない
+    """
+    body = render_to_string(template_name, context)
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(recipient=recipient, subject=subject, body=body)
+        for recipient in recipient_list if recipient
+    ])
+
+
+def retry_delay(attempts):
+    """attempts 回目の失敗後、次に送信するまでの待ち時間 (指数バックオフ + ゆらぎ)"""
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay + random.uniform(0, delay * 0.1))
+
+
+def _claim_due_emails(batch_size):
+    """送信時刻を過ぎた送信待ちメールを予約して返す (複数ワーカーでの二重送信を防ぐ)"""
+    now = timezone.now()
+    pks = list(
+        OutboundEmail.objects.filter(status=OutboundEmail.Status.PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size]
+    )
+    if not pks:
+        return []
+
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    # 条件付き UPDATE で予約し、予約できたものだけを送信する
+    OutboundEmail.objects.filter(
+        pk__in=pks, status=OutboundEmail.Status.PENDING, next_attempt_at__lte=now,
+    ).update(next_attempt_at=lease_until)
+    return list(
+        OutboundEmail.objects.filter(
+            pk__in=pks, status=OutboundEmail.Status.PENDING, next_attempt_at=lease_until,
+        ).order_by('pk')
+    )
+
+
+def _record_failure(email, error, max_attempts):
+    """送信失敗を記録し、再送予定か送信失敗 (デッドレター) にする"""
+    attempts = email.attempts + 1
+    if attempts >= max_attempts:
+        status, next_attempt_at = OutboundEmail.Status.DEAD, timezone.now()
+        logger.error(
+            f"[[MAIL ERROR]] Gave up sending email after {attempts} attempts. "
+            f"ID: {email.pk}, Send to: {email.recipient}, Subject: {email.subject}, Error: {error}"
+        )
+    else:
+        status, next_attempt_at = OutboundEmail.Status.PENDING, timezone.now() + retry_delay(attempts)
+        logger.warning(
+            f"Failed to send email (attempt {attempts}), will retry at {next_attempt_at}. "
+            f"ID: {email.pk}, Send to: {email.recipient}, Error: {error}"
+        )
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        status=status, attempts=attempts, next_attempt_at=next_attempt_at, last_error=str(error),
+    )
+    return status
+
+
+def send_due_emails(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    """
+    送信時刻を過ぎた送信待ちメールを最大 batch_size 件送信する
+    バッチ内では SMTP 接続を1本だけ開いて使い回す
+    戻り値: (送信数, 再送予定数, 送信失敗数)
+    """
+    emails = _claim_due_emails(batch_size)
+    if not emails:
+        return 0, 0, 0
+
+    sent_pks, retried, dead = [], 0, 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # SMTP サーバーに接続できない場合はバッチ全体を失敗として再送に回す
+        for email in emails:
+            if _record_failure(email, e, max_attempts) == OutboundEmail.Status.DEAD:
+                dead += 1
+            else:
+                retried += 1
+        return 0, retried, dead
+
+    try:
+        for email in emails:
+            message = EmailMessage(
+                email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.recipient],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as e:
+                if _record_failure(email, e, max_attempts) == OutboundEmail.Status.DEAD:
+                    dead += 1
+                else:
+                    retried += 1
+                # 接続が切れている可能性があるので開き直す (失敗しても次の送信で再接続を試みる)
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+            else:
+                sent_pks.append(email.pk)
+                logger.info(f"Successfully sent email. ID: {email.pk}, Send to: {email.recipient}, Subject: {email.subject}")
+    finally:
+        connection.close()
+        if sent_pks:
+            OutboundEmail.objects.filter(pk__in=sent_pks).update(
+                status=OutboundEmail.Status.SENT, attempts=F('attempts') + 1,
+                sent_at=timezone.now(), last_error='',
+            )
+
+    return len(sent_pks), retried, dead
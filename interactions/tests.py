@@ -1,3 +1,519 @@
-from django.test import TestCase
+import io
+import threading
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from kindergartens.models import Kindergarten
+from products.models import Product, ProductCategory
+
+from . import outbox
+from .counters import reconcile_product_counters
+from .models import Favorite, OutboundEmail, PurchaseIntent
+from .outbox import enqueue_email, send_due_emails
+
+
+class TransactionFixtureMixin:
+    """出品者・購入希望者・商品のテスト用データ"""
+    buyer_count = 2
+
+    def create_fixtures(self):
+        self.kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        self.seller = User.objects.create_user(
+            email='seller@example.com', name='出品者', kindergarten=self.kindergarten,
+        )
+        self.category = ProductCategory.objects.create(name='制服')
+        self.product = Product.objects.create(
+            user=self.seller, kindergarten=self.kindergarten, product_category=self.category, name='スモック', price=500,
+        )
+        self.buyers = [
+            User.objects.create_user(
+                email=f'buyer{i}@example.com', name=f'購入者{i}', kindergarten=self.kindergarten,
+            )
+            for i in range(self.buyer_count)
+        ]
+        self.intents = [PurchaseIntent.objects.create(user=buyer, product=self.product) for buyer in self.buyers]
+
+
+class TransactionStateMachineTests(TransactionFixtureMixin, TestCase):
+    """取引ステータスの遷移 (販売中 → 取引中 → 売却済)"""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.client.force_login(self.seller)
+
+    def post(self, name, intent):
+        return self.client.post(reverse(f'interactions:{name}', kwargs={'intent_pk': intent.pk}))
+
+    def test_start_then_complete(self):
+        self.post('start_transaction', self.intents[0])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, Product.Status.IN_TRANSACTION)
+        self.assertEqual(self.product.negotiating_user, self.buyers[0])
+
+        self.post('complete_transaction', self.intents[0])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, Product.Status.SOLD)
+        self.assertEqual(self.product.negotiating_user, self.buyers[0])
+
+    def test_second_start_is_rejected(self):
+        self.post('start_transaction', self.intents[0])
+        self.post('start_transaction', self.intents[1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.negotiating_user, self.buyers[0])
+
+    def test_complete_requires_negotiating_buyer(self):
+        self.post('start_transaction', self.intents[0])
+        self.post('complete_transaction', self.intents[1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, Product.Status.IN_TRANSACTION)
+
+    def test_start_requires_purchase_intent(self):
+        self.assertEqual(Product.objects.start_transaction(self.product.pk, self.seller.pk), 0)
+
+    def test_edit_does_not_overwrite_status(self):
+        # 編集画面を開いた後に取引が開始されても、編集の保存でステータスが戻らない
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.start_transaction(self.product.pk, self.buyers[0].pk)
+        self.client.post(reverse('products:product_edit', kwargs={'pk': stale.pk}), {
+            'name': 'スモック (110)', 'price': 400, 'product_category': self.category.pk,
+            'size': Product.Size.SIZE_110, 'condition': Product.Condition.NEW, 'description': '',
+        })
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'スモック (110)')
+        self.assertEqual(self.product.status, Product.Status.IN_TRANSACTION)
+        self.assertEqual(self.product.negotiating_user, self.buyers[0])
+
+
+class FavoriteToggleTests(TransactionFixtureMixin, TestCase):
+    """お気に入り登録/解除"""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.client.force_login(self.buyers[0])
+        self.url = reverse('interactions:favorite_toggle', kwargs={'product_pk': self.product.pk})
+
+    def test_json_mode_returns_state_and_count(self):
+        response = self.client.post(self.url, headers={'Accept': 'application/json'})
+        self.assertEqual(response.json(), {'favorited': True, 'favorite_count': 1})
+        response = self.client.post(self.url, headers={'Accept': 'application/json'})
+        self.assertEqual(response.json(), {'favorited': False, 'favorite_count': 0})
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_html_mode_redirects(self):
+        response = self.client.post(self.url, {'next': '/enfreamarket/product/'})
+        self.assertRedirects(response, '/enfreamarket/product/', fetch_redirect_response=False)
+        self.assertTrue(Favorite.objects.filter(user=self.buyers[0], product=self.product).exists())
+
+    def test_missing_product_returns_404(self):
+        url = reverse('interactions:favorite_toggle', kwargs={'product_pk': self.product.pk + 100})
+        self.assertEqual(self.client.post(url, headers={'Accept': 'application/json'}).status_code, 404)
+        self.assertFalse(Favorite.objects.exists())
+
+
+class FavoriteStateLookupTests(TransactionFixtureMixin, TestCase):
+    """表示中のページの商品だけを対象にしたお気に入り状態の取得"""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.others = [
+            Product.objects.create(
+                user=self.seller, kindergarten=self.kindergarten, product_category=self.category,
+                name=f'商品{i}', price=100,
+            )
+            for i in range(12)
+        ]
+        self.buyer = self.buyers[0]
+        Favorite.objects.bulk_create(Favorite(user=self.buyer, product=product) for product in self.others[:10])
+
+    def test_returns_only_requested_ids(self):
+        page_ids = [self.product.pk, self.others[0].pk, self.others[11].pk]
+        with CaptureQueriesContext(connection) as queries:
+            favorited = Favorite.objects.product_ids_for(self.buyer, iter(page_ids))
+        self.assertEqual(favorited, {self.others[0].pk})
+        # お気に入りの総数ではなく、ページの商品IDだけを IN で問い合わせる
+        self.assertEqual(len(queries), 1)
+        self.assertIn('IN', queries[0]['sql'])
+
+    def test_no_query_for_empty_page_or_anonymous_user(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(Favorite.objects.product_ids_for(self.buyer, []), set())
+            self.assertEqual(Favorite.objects.product_ids_for(AnonymousUser(), [self.product.pk]), set())
+
+    def test_purchase_intents(self):
+        self.assertEqual(
+            PurchaseIntent.objects.product_ids_for(self.buyer, [self.product.pk, self.others[0].pk]),
+            {self.product.pk},
+        )
+
+    def test_product_list_marks_favorites(self):
+        cache.clear()
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('products:top'))
+        favorited = {product.pk for product in response.context['products'] if product.is_favorited_by_current_user}
+        self.assertEqual(favorited, {product.pk for product in self.others[:10]} & {
+            product.pk for product in response.context['products']
+        })
+        self.assertTrue(favorited)
+
+
+class ProductCounterTests(TransactionFixtureMixin, TestCase):
+    """商品のお気に入り数・購入意思表示数・コメント数 (非正規化カウンター)"""
+    buyer_count = 1
+
+    def setUp(self):
+        self.create_fixtures()
+        PurchaseIntent.objects.all().delete()
+        self.buyer = self.buyers[0]
+        self.client.force_login(self.buyer)
+
+    def counters(self):
+        self.product.refresh_from_db()
+        return self.product.favorite_count, self.product.purchase_intent_count, self.product.comment_count
+
+    def test_views_keep_counters_in_sync(self):
+        self.client.post(reverse('interactions:favorite_toggle', kwargs={'product_pk': self.product.pk}))
+        add_intent = reverse('interactions:add_purchase_intent', kwargs={'product_pk': self.product.pk})
+        self.client.post(add_intent)
+        self.client.post(add_intent) # 登録済みなので数は変わらない
+        self.client.post(
+            reverse('products:product_detail', kwargs={'pk': self.product.pk}), {'content': 'サイズは？'},
+        )
+        self.assertEqual(self.counters(), (1, 1, 1))
+
+        self.client.post(reverse('interactions:favorite_toggle', kwargs={'product_pk': self.product.pk}))
+        self.assertEqual(self.counters(), (0, 1, 1))
+
+    def test_adjust_counter_does_not_go_negative(self):
+        self.assertEqual(Product.objects.adjust_counter(self.product.pk, 'favorite_count', -1), 0)
+        self.assertEqual(Product.objects.adjust_counter(self.product.pk, 'favorite_count', 2), 1)
+        self.assertEqual(Product.objects.adjust_counter(self.product.pk, 'favorite_count', -3), 0)
+        self.assertEqual(self.counters()[0], 2)
+
+    def test_reconcile_fixes_drift(self):
+        Favorite.objects.create(user=self.buyer, product=self.product)
+        PurchaseIntent.objects.create(user=self.buyer, product=self.product)
+        Product.objects.filter(pk=self.product.pk).update(favorite_count=5, purchase_intent_count=0, comment_count=3)
+        other = Product.objects.create(
+            user=self.seller, kindergarten=self.kindergarten, product_category=self.category, name='水筒', price=100,
+        )
+        out = io.StringIO()
+        call_command('reconcile_product_counters', batch_size=1, stdout=out)
+        self.assertIn('2 件', out.getvalue())
+        self.assertEqual(self.counters(), (1, 1, 0))
+        other.refresh_from_db()
+        self.assertEqual((other.favorite_count, other.purchase_intent_count, other.comment_count), (0, 0, 0))
+
+    def test_reconcile_selected_products(self):
+        Product.objects.filter(pk=self.product.pk).update(favorite_count=5)
+        self.assertEqual(reconcile_product_counters(Product.objects.exclude(pk=self.product.pk)), 0)
+        self.assertEqual(self.counters()[0], 5)
+
+
+@override_settings(DEFAULT_FROM_EMAIL='noreply@example.com')
+class OutboxTests(TransactionFixtureMixin, TestCase):
+    """通知メールのアウトボックス (送信待ちの登録・予約・再送・デッドレター)"""
+    buyer_count = 1
+
+    def setUp(self):
+        self.create_fixtures()
+        PurchaseIntent.objects.all().delete()
+
+    def enqueue(self, count=1):
+        return enqueue_email(
+            '件名', 'emails/purchase_intent_notification_email.txt', {'product_name': 'スモック'},
+            [f'to{i}@example.com' for i in range(count)] + [''], # 空の宛先は登録しない
+        )
+
+    def make_due(self):
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+
+    def test_intent_enqueues_email_in_same_transaction(self):
+        self.client.force_login(self.buyers[0])
+        self.client.post(reverse('interactions:add_purchase_intent', kwargs={'product_pk': self.product.pk}))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.recipient, email.status), ('seller@example.com', OutboundEmail.Status.PENDING))
+        self.assertEqual(mail.outbox, [])
+
+        # 業務データの変更がロールバックされると、メールも登録されない
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.enqueue()
+            raise RuntimeError
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_send_due_emails(self):
+        self.enqueue(3)
+        self.assertEqual(send_due_emails(batch_size=2), (2, 0, 0))
+        self.assertEqual(send_due_emails(batch_size=2), (1, 0, 0))
+        self.assertEqual(send_due_emails(), (0, 0, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['to0@example.com', 'to1@example.com', 'to2@example.com'])
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.Status.SENT).exists())
+        self.assertFalse(OutboundEmail.objects.exclude(attempts=1).exists())
+
+    def test_leased_emails_are_not_claimed_again(self):
+        self.enqueue(2)
+        claimed = outbox._claim_due_emails(batch_size=1)
+        self.assertEqual(len(claimed), 1)
+        # 予約中のメールは他のワーカーが取得しない
+        self.assertEqual([e.pk for e in outbox._claim_due_emails(batch_size=10)], [
+            pk for pk in OutboundEmail.objects.values_list('pk', flat=True) if pk != claimed[0].pk
+        ])
+        self.assertEqual(outbox._claim_due_emails(batch_size=10), [])
+
+    def test_failure_backs_off_then_goes_dead(self):
+        self.enqueue()
+        with mock.patch('interactions.outbox.EmailMessage.send', side_effect=SMTPException('rejected')), \
+                self.assertLogs('interactions.outbox', level='WARNING') as logs:
+            self.assertEqual(send_due_emails(max_attempts=2), (0, 1, 0))
+            email = OutboundEmail.objects.get()
+            self.assertEqual((email.status, email.attempts, email.last_error), (OutboundEmail.Status.PENDING, 1, 'rejected'))
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=outbox.RETRY_BASE_SECONDS - 1))
+            # 再送時刻までは送信しない
+            self.assertEqual(send_due_emails(max_attempts=2), (0, 0, 0))
+
+            self.make_due()
+            self.assertEqual(send_due_emails(max_attempts=2), (0, 0, 1))
+        self.assertEqual([record.levelname for record in logs.records], ['WARNING', 'ERROR'])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.Status.DEAD, 2))
+        self.make_due()
+        self.assertEqual(send_due_emails(), (0, 0, 0))
+
+    def test_connection_failure_retries_whole_batch(self):
+        self.enqueue(2)
+        connection = mock.Mock()
+        connection.open.side_effect = OSError('connection refused')
+        with mock.patch('interactions.outbox.get_connection', return_value=connection), \
+                self.assertLogs('interactions.outbox', level='WARNING'):
+            self.assertEqual(send_due_emails(), (0, 2, 0))
+        self.assertEqual(set(OutboundEmail.objects.values_list('attempts', flat=True)), {1})
+
+    def test_retry_delay_is_exponential_and_capped(self):
+        with mock.patch('interactions.outbox.random.uniform', return_value=0):
+            self.assertEqual(
+                [outbox.retry_delay(n).total_seconds() for n in (1, 2, 3)],
+                [outbox.RETRY_BASE_SECONDS, outbox.RETRY_BASE_SECONDS * 2, outbox.RETRY_BASE_SECONDS * 4],
+            )
+            self.assertEqual(outbox.retry_delay(30).total_seconds(), outbox.RETRY_MAX_SECONDS)
+
+    def test_command(self):
+        self.enqueue(3)
+        out = io.StringIO()
+        call_command('send_outbound_emails', batch_size=2, stdout=out)
+        self.assertIn('送信: 3 件, 再送予定: 0 件, 送信失敗: 0 件', out.getvalue())
+
+
+class DeletePurchaseIntentTests(TransactionFixtureMixin, TestCase):
+    """購入意思表示の取り消し"""
+
+    def setUp(self):
+        self.create_fixtures()
+        Product.objects.filter(pk=self.product.pk).update(purchase_intent_count=len(self.intents))
+        self.client.force_login(self.buyers[0])
+        self.url = reverse('interactions:delete_purchase_intent', kwargs={'product_pk': self.product.pk})
+
+    def test_double_delete_decrements_once(self):
+        self.client.post(self.url)
+        self.client.post(self.url) # 2回目は削除するものがないので数を減らさない
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.purchase_intent_count, 1)
+        self.assertEqual(list(PurchaseIntent.objects.values_list('user', flat=True)), [self.buyers[1].pk])
+
+
+class TransactionConcurrencyTests(TransactionFixtureMixin, TransactionTestCase):
+    """多数のスレッドから同時に取引を開始・完了しても、成功するのは1件だけであること"""
+    buyer_count = 8
+
+    def setUp(self):
+        self.create_fixtures()
+
+    def hammer(self, transition):
+        """全員で同時に transition を呼び、結果を返す。どれかのスレッドで例外が起きた場合はテストを失敗させる"""
+        barrier = threading.Barrier(len(self.buyers))
+        results = []
+        errors = []
+
+        def worker(buyer):
+            try:
+                barrier.wait()
+                results.append(transition(self.product.pk, buyer.pk))
+            except Exception as e: # スレッド内の例外はそのままでは握りつぶされるので記録する
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(buyer,)) for buyer in self.buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), len(self.buyers))
+        return results
+
+    def test_concurrent_start_transaction(self):
+        results = self.hammer(Product.objects.start_transaction)
+        self.assertEqual(sorted(results), [0] * (len(self.buyers) - 1) + [1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, Product.Status.IN_TRANSACTION)
+        self.assertIn(self.product.negotiating_user, self.buyers)
+
+    def test_concurrent_delete_purchase_intent(self):
+        # 同じ購入者の取り消しが同時に届いても、数は1だけ減る
+        Product.objects.filter(pk=self.product.pk).update(purchase_intent_count=len(self.intents))
+        url = reverse('interactions:delete_purchase_intent', kwargs={'product_pk': self.product.pk})
+        clients = {buyer.pk: Client() for buyer in self.buyers} # スレッドごとのクライアント (全員 buyers[0] でログイン)
+        for client in clients.values():
+            client.force_login(self.buyers[0])
+        responses = self.hammer(lambda product_pk, buyer_pk: clients[buyer_pk].post(url))
+        # 1件だけが取り消しに成功し、残りは「見つかりません」で商品詳細へ戻る (どちらもリダイレクト)
+        self.assertEqual([response.status_code for response in responses], [302] * len(self.buyers))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.purchase_intent_count, len(self.buyers) - 1)
+        self.assertFalse(PurchaseIntent.objects.filter(user=self.buyers[0]).exists())
+
+    def test_concurrent_complete_transaction(self):
+        Product.objects.start_transaction(self.product.pk, self.buyers[3].pk)
+        results = self.hammer(Product.objects.complete_transaction)
+        self.assertEqual(sorted(results), [0] * (len(self.buyers) - 1) + [1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.status, Product.Status.SOLD)
+        self.assertEqual(self.product.negotiating_user, self.buyers[3])
+
+
+class StatusListQueryCountTests(TransactionFixtureMixin, TestCase):
+    """お気に入り・購入意思表示の一覧は、件数に関係なく一定のクエリ数で表示されること"""
+
+    def setUp(self):
+        self.create_fixtures()
+        self.buyer = self.buyers[0]
+
+    def add_rows(self, count):
+        """出品者の商品を count 件追加し、購入者がお気に入り・購入意思表示する (半分は購入者と取引中)"""
+        products = Product.objects.bulk_create([
+            Product(
+                user=self.seller, kindergarten=self.kindergarten, product_category=self.category,
+                name=f'商品{i}', price=100,
+                status=Product.Status.IN_TRANSACTION if i % 2 else Product.Status.FOR_SALE,
+                negotiating_user=self.buyer if i % 2 else None,
+            )
+            for i in range(count)
+        ])
+        Favorite.objects.bulk_create([Favorite(user=self.buyer, product=product) for product in products])
+        PurchaseIntent.objects.bulk_create([
+            PurchaseIntent(user=self.buyer, product=product, seller=self.seller) for product in products
+        ])
+
+    def count_queries(self, user, url_name):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def assert_constant_queries(self, user, url_name):
+        self.add_rows(1)
+        few, _ = self.count_queries(user, url_name)
+        self.add_rows(499)
+        many, response = self.count_queries(user, url_name)
+        self.assertEqual(few, many)
+        return response
+
+    def test_favorite_list(self):
+        response = self.assert_constant_queries(self.buyer, 'interactions:favorite_list')
+        self.assertContains(response, 'あなたが取引中です')
+
+    def test_sent_purchase_intents_list(self):
+        response = self.assert_constant_queries(self.buyer, 'interactions:sent_purchase_intents_list')
+        self.assertContains(response, 'あなたが取引中です')
+
+    def test_received_purchase_intents_list(self):
+        response = self.assert_constant_queries(self.seller, 'interactions:received_purchase_intents_list')
+        self.assertContains(response, '購入者0 と取引中です')
+        self.assertContains(response, 'status-in-transaction')
+
+    def test_pagination_and_status_filter(self):
+        self.add_rows(30) # 販売中 15件 + 取引中 15件 (+ setUp の販売中の商品1件)
+        self.client.force_login(self.buyer)
+        url = reverse('interactions:sent_purchase_intents_list')
+
+        first = self.client.get(url).context['sent_intents']
+        second = self.client.get(url, {'cursor': first.next_cursor}).context['sent_intents']
+        self.assertEqual((len(first), len(second)), (20, 11))
+        self.assertFalse(second.has_next())
+        self.assertFalse({intent['pk'] for intent in first} & {intent['pk'] for intent in second})
+
+        in_transaction = self.client.get(url, {'status': Product.Status.IN_TRANSACTION}).context['sent_intents']
+        self.assertEqual(len(in_transaction), 15)
+        self.assertTrue(all(intent['product'].status == Product.Status.IN_TRANSACTION for intent in in_transaction))
+
+
+class ReceivedIntentsByProductTests(TransactionFixtureMixin, TestCase):
+    """受けた購入意思表示の商品ごとの表示 (?group=product)"""
+    buyer_count = 60
+
+    def setUp(self):
+        self.create_fixtures()
+        self.client.force_login(self.seller)
+        self.url = reverse('interactions:received_purchase_intents_list')
+
+    def get_groups(self, **params):
+        response = self.client.get(self.url, {'group': 'product', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.context['groups']
+
+    def test_one_row_per_product(self):
+        Product.objects.start_transaction(self.product.pk, self.buyers[30].pk)
+        groups = self.get_groups()
+        self.assertEqual(len(groups), 1)
+        group = groups[0]
+        self.assertEqual(group['intent_count'], 60)
+        self.assertEqual(group['latest_intent_at'], self.intents[-1].created_at)
+        # 取引相手を先頭に、残りは先着順
+        self.assertEqual(
+            [requester['user_id'] for requester in group['requesters']],
+            [self.buyers[30].pk] + [buyer.pk for buyer in self.buyers[:4]],
+        )
+        self.assertEqual(group['hidden_requester_count'], 55)
+        self.assertEqual(group['product'].status_message_info, '購入者30 と取引中です')
+
+    def test_query_count_does_not_depend_on_intents(self):
+        # 意思表示のない商品は表示しない
+        Product.objects.create(
+            user=self.seller, kindergarten=self.kindergarten, product_category=self.category, name='帽子', price=300,
+        )
+        # セッション, ユーザー, 商品ごとの集計, 意思表示者
+        with self.assertNumQueries(4):
+            groups = self.get_groups()
+        self.assertEqual([group['product'].pk for group in groups], [self.product.pk])
+
+    def test_status_filter(self):
+        self.assertEqual(len(self.get_groups(status=Product.Status.SOLD)), 0)
+        self.assertEqual(len(self.get_groups(status=Product.Status.FOR_SALE)), 1)
+
+    def test_pagination(self):
+        products = Product.objects.bulk_create([
+            Product(user=self.seller, kindergarten=self.kindergarten, product_category=self.category, name=f'商品{i}', price=100)
+            for i in range(25)
+        ])
+        PurchaseIntent.objects.bulk_create([
+            PurchaseIntent(user=self.buyers[0], product=product, seller=self.seller) for product in products
+        ])
+        first = self.get_groups()
+        second = self.get_groups(cursor=first.next_cursor)
+        self.assertEqual((len(first), len(second)), (20, 6))
+        self.assertFalse({group['product'].pk for group in first} & {group['product'].pk for group in second})
+        self.assertTrue(all(len(group['requesters']) == 1 for group in second if group['product'].pk != self.product.pk))
@@ -5,29 +5,192 @@ from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.urls import reverse
 from products.models import Product
+from products.cards import ProductCard, parse_status_filter
+from products.pagination import HISTORY_PER_PAGE, CursorPaginator
+from products.cache import bump_kindergarten_version_on_commit
 from .models import Comment, Favorite, PurchaseIntent
 from .forms import CommentForm
-from django.db import transaction
-from django.template.loader import render_to_string
-from django.conf import settings
-from django.core.mail import send_mail
+from .outbox import enqueue_email
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Value
+from django.db.models.functions import Coalesce, Concat, NullIf
+from django.http import Http404, JsonResponse
 
 import logging
 logger = logging.getLogger(__name__)
 
+# 一覧に表示するステータスの補助メッセージ {ステータス: (自分が取引相手の場合, 他のユーザーが取引相手の場合)}
+FAVORITE_STATUS_MESSAGES = {
+    Product.Status.IN_TRANSACTION: ("あなたが取引中です", "他のユーザーと取引中のため、購入意思表示は出来ません"),
+    Product.Status.SOLD: ("あなたが購入しました", "他のユーザーに売却されました"),
+}
+SENT_INTENT_STATUS_MESSAGES = {
+    Product.Status.IN_TRANSACTION: ("あなたが取引中です", "他のユーザーと取引中"),
+    Product.Status.SOLD: ("あなたが購入しました", "他のユーザーに売却されました"),
+}
+# 受けた購入意思表示の商品ごとの表示で、1商品あたりに表示する意思表示者の人数
+RECEIVED_REQUESTERS_PER_PRODUCT = 5
+
+
+def filter_product_status(queryset, status):
+    """お気に入り・購入意思表示を商品のステータスで絞り込む (status が None の場合はそのまま)"""
+    if status is None:
+        return queryset
+    return queryset.filter(product__status=status)
+
+
+# --- 一覧のページネーション (check_query_plans でも同じクエリの実行計画を確認する) ---
+def favorite_paginator(user_id, status_filter=None):
+    """
+    お気に入りした商品の一覧
+    Favorite ごとに商品カードの表示に必要なカラムだけを取得する (ProductCard)
+    ステータス表示 (status_class, status_message_info) も同じクエリで求める
+    新しくお気に入りしたものが上にくるよう、(user, -created_at) のインデックスでページ単位に取得する
+    """
+    favorite_rows = ProductCard.values(
+        filter_product_status(Favorite.objects.filter(user_id=user_id), status_filter)
+        .with_status_info(user_id, FAVORITE_STATUS_MESSAGES),
+        'id', 'created_at', 'status_class', 'status_message_info',
+        prefix='product__',
+    )
+    return CursorPaginator(
+        favorite_rows, HISTORY_PER_PAGE,
+        row_factory=lambda row: {'pk': row['id'], 'product': ProductCard.from_row(row, prefix='product__')},
+    )
+
+
+def sent_intents_paginator(user_id, status_filter=None):
+    """
+    自分が行った購入意思表示の一覧
+    商品カードの表示に必要なカラムだけを取得する (ProductCard)
+    ステータス表示 (status_class, status_message_info) も同じクエリで求める
+    新しい意思表示が上にくるように、(user, -created_at) のインデックスでページ単位に取得する
+    """
+    sent_intent_rows = ProductCard.values(
+        filter_product_status(
+            PurchaseIntent.objects.filter(user_id=user_id), # PurchaseIntent の user がログインユーザー
+            status_filter,
+        ).with_status_info(user_id, SENT_INTENT_STATUS_MESSAGES),
+        'id', 'created_at', 'user_id', 'product__user__display_name', 'product__user__name',
+        'status_class', 'status_message_info',
+        prefix='product__',
+    )
+    return CursorPaginator(
+        sent_intent_rows, HISTORY_PER_PAGE,
+        row_factory=lambda row: {
+            'pk': row['id'],
+            'created_at': row['created_at'],
+            'user_id': row['user_id'],
+            'seller_display_name': row['product__user__display_name'] or row['product__user__name'], # 出品者の表示名
+            'product': ProductCard.from_row(row, prefix='product__'),
+        },
+    )
+
+
+def received_intents_paginator(user_id, status_filter=None):
+    """
+    購入意思表示を受けた商品の一覧
+    出品者 (seller) は PurchaseIntent に非正規化してあるので、商品を JOIN せずに絞り込める
+    ステータス表示は、各意思表示者 (PurchaseIntent.user) が取引相手かどうかで SQL 側で求める
+    新しい意思表示が上にくるように、(seller, -created_at) のインデックスでページ単位に取得する
+    """
+    intended_user_display = Coalesce(NullIf('user__display_name', Value('')), 'user__name') # 意思表示者の表示名
+    received_intent_rows = ProductCard.values(
+        filter_product_status(PurchaseIntent.objects.filter(seller_id=user_id), status_filter)
+        .with_status_info(F('user_id'), {
+            Product.Status.IN_TRANSACTION: (Concat(intended_user_display, Value(' と取引中です')), '他のユーザーと取引中'),
+            Product.Status.SOLD: (Concat(intended_user_display, Value('に売却しました')), '他のユーザーに売却済'),
+        }),
+        'id', 'created_at', 'user_id', 'user__display_name', 'user__name',
+        'status_class', 'status_message_info',
+        prefix='product__',
+    )
+    return CursorPaginator(
+        received_intent_rows, HISTORY_PER_PAGE,
+        row_factory=lambda row: {
+            'pk': row['id'],
+            'created_at': row['created_at'],
+            'user_id': row['user_id'],
+            'user_display_name': row['user__display_name'] or row['user__name'], # 意思表示者の表示名
+            'product': ProductCard.from_row(row, prefix='product__'),
+        },
+    )
+
+
+def received_groups_paginator(user_id, status_filter=None):
+    """
+    購入意思表示を受けた商品の一覧 (商品ごと)
+    出品した商品ごとに、意思表示数と最新の意思表示日時を集計する
+    ステータス表示は取引相手 (negotiating_user) の表示名で SQL 側で求める
+    最新の意思表示がある商品が上にくるように、(最新の意思表示日時, 商品ID) をキーにしてページ単位に取得する
+    商品カードは商品ごとに1回だけ作成する
+    """
+    negotiating_user_display = Coalesce(NullIf('negotiating_user__display_name', Value('')), 'negotiating_user__name')
+    products = Product.objects.filter(user_id=user_id)
+    if status_filter is not None:
+        products = products.filter(status=status_filter)
+    product_rows = ProductCard.values(
+        products.annotate(
+            intent_count=Count('purchase_intended_by'),
+            latest_intent_at=Max('purchase_intended_by__created_at'),
+            # 取引中・売却済の商品の取引相手は、いずれかの意思表示者 (party は常に取引相手自身)
+            **ProductCard.status_annotations('', F('negotiating_user_id'), {
+                Product.Status.IN_TRANSACTION: (Concat(negotiating_user_display, Value(' と取引中です')), ''),
+                Product.Status.SOLD: (Concat(negotiating_user_display, Value('に売却しました')), ''),
+            }),
+        ).filter(intent_count__gt=0),
+        'intent_count', 'latest_intent_at', 'status_class', 'status_message_info',
+    )
+    return CursorPaginator(
+        product_rows, HISTORY_PER_PAGE, field='latest_intent_at',
+        row_factory=lambda row: {
+            'product': ProductCard.from_row(row),
+            'intent_count': row['intent_count'],
+            'latest_intent_at': row['latest_intent_at'],
+            'requesters': [],
+        },
+    )
+
 @login_required
 @require_POST # POSTリクエストのみを受け付ける
 def favorite_toggle(request, product_pk):
-    """お気に入り登録/解除"""
-    product = get_object_or_404(Product, pk=product_pk)
-    favorite, created = Favorite.objects.get_or_create(user=request.user, product=product) # created は新規作成時はTrue、既存のオブジェクトを取得時はFalse
+    """
+    お気に入り登録/解除
+    Accept: application/json で呼ばれた場合はリダイレクトせず、新しい状態とお気に入り数を JSON で返す
+    """
+    with transaction.atomic():
+        # 登録済みなら削除する (商品を読み込まず、DELETE の件数で登録済みかを判定)
+        deleted, _ = Favorite.objects.filter(user=request.user, product_id=product_pk).delete()
+        if deleted:
+            favorited = False
+            # お気に入り数を減算 (F() 式で UPDATE)
+            Product.objects.adjust_counter(product_pk, 'favorite_count', -1)
+        else:
+            favorited = True
+            try:
+                with transaction.atomic(): # 一意制約違反でも外側のトランザクションを続けられるようにセーブポイントを作る
+                    Favorite.objects.create(user=request.user, product_id=product_pk)
+            except IntegrityError:
+                # ダブルクリックなどで同時に届いた別のリクエストがすでに登録した (unique_favorite)
+                # 数はそちらで加算済みなので、登録済みとして扱う
+                pass
+            else:
+                # お気に入り数を加算 (F() 式で UPDATE)。更新件数 0 = 商品が存在しないので登録を取り消す
+                if not Product.objects.adjust_counter(product_pk, 'favorite_count', 1):
+                    raise Http404('商品が見つかりません。')
 
-    if created:
-        messages.success(request, f'「{product.name}」をお気に入りに追加しました。')
+        # 更新後の商品名とお気に入り数 (メッセージ・JSON 用)
+        product = Product.objects.filter(pk=product_pk).values('name', 'favorite_count').first()
+        if product is None:
+            raise Http404('商品が見つかりません。')
+
+    if request.get_preferred_type(['text/html', 'application/json']) == 'application/json':
+        return JsonResponse({'favorited': favorited, 'favorite_count': product['favorite_count']})
+
+    if favorited:
+        messages.success(request, f'「{product["name"]}」をお気に入りに追加しました。')
     else:
-        # レコードがすでに存在する　＝　お気に入り登録ずみでハートが押された　ので削除
-        favorite.delete()
-        messages.success(request, f'「{product.name}」をお気に入りから削除しました。')
+        messages.success(request, f'「{product["name"]}」をお気に入りから削除しました。')
 
     # リダイレクト先の決定
     # 各画面でnextパラメータを送るので基本的にはそれに準ずる
@@ -45,46 +208,27 @@ def favorite_toggle(request, product_pk):
 @login_required
 def favorite_list(request):
     """お気に入りした商品の一覧を表示する"""
-    # Favorite オブジェクトのリストを取得
-    favorites = Favorite.objects.filter(user=request.user).select_related(
-        'product__main_product_image', # Productからメイン画像を参照する
-    ).order_by('-created_at') # 新しくお気に入りしたものが上にくるよう
+    status_filter = parse_status_filter(request.GET.get('status'))
+    favorites = favorite_paginator(request.user.pk, status_filter).page(request.GET.get('cursor'))
 
     # 表示する各お気に入り商品に対して、購入意思表示状態を付与
     if request.user.is_authenticated: # ログインしている前提のページだが念のため
-        # ログインユーザーが購入意思表示している商品IDのセットを取得
-        purchase_intended_product_ids = set(
-            PurchaseIntent.objects.filter(user=request.user).values_list('product_id', flat=True)
+        # 表示するお気に入り商品のうち、ログインユーザーが購入意思表示している商品IDのセットを取得
+        purchase_intended_product_ids = PurchaseIntent.objects.product_ids_for(
+            request.user, [fav_item['product'].pk for fav_item in favorites]
         )
         for fav_item in favorites:
-            if fav_item.product: # productが存在することを確認
-                product = fav_item.product
-
-                # 購入意思表示状態を追加
-                product.is_purchase_intended_by_current_user = product.pk in purchase_intended_product_ids
-
-                # ステータスクラスとメッセージの設定
-                product.status_message_info = ""
-                if product.status == Product.Status.FOR_SALE:
-                    product.status_class = "status-for-sale"
-                elif product.status == Product.Status.IN_TRANSACTION:
-                    product.status_class = "status-in-transaction"
-                    if product.negotiating_user == request.user:
-                        product.status_message_info = "あなたが取引中です"
-                    elif product.negotiating_user:
-                        product.status_message_info = "他のユーザーと取引中のため、購入意思表示は出来ません"
-                elif product.status == Product.Status.SOLD:
-                    product.status_class = "status-sold"
-                    if product.negotiating_user == request.user:
-                        product.status_message_info = "あなたが購入しました"
-                    elif product.negotiating_user:
-                        product.status_message_info = "他のユーザーに売却されました"
-                else:
-                    product.status_class = ""
-                    product.status_message_display = ""
+            product = fav_item['product']
+
+            # お気に入り一覧なので常に True
+            product.is_favorited_by_current_user = True
+            # 購入意思表示状態を追加
+            product.is_purchase_intended_by_current_user = product.pk in purchase_intended_product_ids
 
     context = {
         'favorites': favorites,
+        'status_filter': status_filter,
+        'status_choices': Product.Status.choices,
         'active_mypage_menu': 'favorites',
     }
     return render(request, 'interactions/favorite_list.html', context)
@@ -108,17 +252,17 @@ def add_purchase_intent(request, product_pk):
 
     # PurchaseIntentオブジェクトを作成 (get_or_create を使う)
     # 既に意思表示済みの場合、created は False になる
-    intent, created = PurchaseIntent.objects.get_or_create(
-        user=request.user,
-        product=product
-    )
+    with transaction.atomic():
+        intent, created = PurchaseIntent.objects.get_or_create(
+            user=request.user,
+            product=product,
+            defaults={'seller_id': product.user_id}, # 出品者 (非正規化)
+        )
+        if created:
+            # 購入意思表示数を加算 (F() 式で UPDATE)
+            Product.objects.adjust_counter(product.pk, 'purchase_intent_count', 1)
 
-    if created:
-        messages.success(request, f'「{product.name}」への購入意思を伝えました。')
-        # 出品者へのメール通知処理
-        try:
-            subject = f'【園フリマ】「{product.name}」に購入意思表示がありました'
-            # メール本文をテンプレートから生成
+            # 出品者への通知メールを送信待ちに登録 (送信は send_outbound_emails コマンドが行う)
             mail_context = {
                 'user_display_name': request.user.display_name or request.user.get_username(), # 表示名がなければユーザー名
                 'product_name': product.name,
@@ -126,37 +270,15 @@ def add_purchase_intent(request, product_pk):
                     reverse('interactions:received_purchase_intents_list')
                 ),
             }
-            message_body = render_to_string('emails/purchase_intent_notification_email.txt', mail_context)
-            recipient_list = [product.user.email] # 出品者のメールアドレス
-
-            send_mail(
-                subject,
-                message_body,
-                settings.DEFAULT_FROM_EMAIL,
-                recipient_list,
-                fail_silently=False # 送信失敗時にエラーを発生させる (開発中はTrueでも良い)
+            enqueue_email(
+                f'【園フリマ】「{product.name}」に購入意思表示がありました',
+                'emails/purchase_intent_notification_email.txt',
+                mail_context,
+                [product.user.email], # 出品者のメールアドレス
             )
 
-            logger.info(
-                f"Successfully sent purchase intent notification email. "
-                f"Product: {product.name} (ID: {product.pk}), "
-                f"Send to: {product.user.email},"
-                # 出品者情報
-                f"Product Owner: {product.user.display_name} ({product.user.email}), "
-                # 意思表示者情報
-                f"Intent by: {request.user.display_name} ({request.user.email}), "
-            )
-        except Exception as e:
-            logger.error(
-                f"[[MAIL ERROR]] Failed to send purchase intent notification email. "
-                f"Product: {product.name} (ID: {product.pk}), "
-                f"Send to: {product.user.email},"
-                f"Product Owner: {product.user.display_name} ({product.user.email}), "
-                f"Intent by: {request.user.display_name}) ({request.user.email}), "
-                f"Error: {e}",
-                exc_info=True # スタックトレースをログに出力
-            )
-            messages.warning(request, "購入意思は伝えましたが、出品者への通知メールの送信に失敗しました。")
+    if created:
+        messages.success(request, f'「{product.name}」への購入意思を伝えました。')
 
     else:
         # 既に意思表示済みの場合　（通らないはずだが）
@@ -180,16 +302,20 @@ def delete_purchase_intent(request, product_pk):
     """商品に対する購入意思表示を取り消す"""
     product = get_object_or_404(Product, pk=product_pk)
 
-    # ログインユーザーがこの商品に対して行った PurchaseIntent を取得
-    try:
-        intent = PurchaseIntent.objects.get(user=request.user, product=product)
-    except PurchaseIntent.DoesNotExist:
+    with transaction.atomic():
+        # ログインユーザーがこの商品に対して行った PurchaseIntent を削除する
+        # 読み込んでから削除すると、同時に届いた取り消しが両方とも数を減らしてしまうので、DELETE の件数で判定する
+        deleted, _ = PurchaseIntent.objects.filter(user=request.user, product=product).delete()
+        if deleted:
+            # 購入意思表示数を減算 (F() 式で UPDATE)。削除した件数だけ減らす
+            Product.objects.adjust_counter(product.pk, 'purchase_intent_count', -deleted)
+
+    if not deleted:
+        # 見つからない (取り消し済み・同時に届いた別のリクエストが先に削除した)
         messages.error(request, "この商品に対するあなたの購入意思表示が見つかりません。")
         return redirect('products:product_detail', pk=product_pk)
 
-    intent_product_name = intent.product.name # メッセージ用の商品名
-    intent.delete()
-
+    intent_product_name = product.name # メッセージ用の商品名
     messages.success(request, f'「{intent_product_name}」への購入意思表示を取り消しました。')
 
     # リダイレクト先の決定
@@ -207,40 +333,14 @@ def delete_purchase_intent(request, product_pk):
 @login_required
 def sent_purchase_intents_list(request):
     """自分が行った購入意思表示の一覧を表示する"""
-    # ログインユーザーが行った PurchaseIntent を取得
-    sent_intents = PurchaseIntent.objects.filter(
-        user=request.user # PurchaseIntent の user がログインユーザー
-    ).select_related(
-        'product',                     # PurchaseIntent -> Product
-        'product__main_product_image'  # PurchaseIntent -> Product -> ProductImage
-    ).order_by('-created_at')          # 新しい意思表示が上にくるように
-
-    # ビューでステータスに応じてメッセージを表示する
-    for intent in sent_intents:
-        if intent.product:
-            product = intent.product
-            product.status_message_info = "" # ステータスに応じた補助メッセージ
-
-            if product.status == Product.Status.FOR_SALE:
-                product.status_class = "status-for-sale"
-            elif product.status == Product.Status.IN_TRANSACTION:
-                product.status_class = "status-in-transaction"
-                if product.negotiating_user == request.user:
-                    product.status_message_info = "あなたが取引中です"
-                else:
-                    product.status_message_info = "他のユーザーと取引中"
-            elif product.status == Product.Status.SOLD:
-                product.status_class = "status-sold"
-                if product.negotiating_user == request.user:
-                    product.status_message_info = "あなたが購入しました"
-                else:
-                    product.status_message_info = "他のユーザーに売却されました"
-            else:
-                product.status_class = ""
-                product.status_message_display = ""
+    # ログインユーザーが行った PurchaseIntent を取得 (詳細は sent_intents_paginator)
+    status_filter = parse_status_filter(request.GET.get('status'))
+    sent_intents = sent_intents_paginator(request.user.pk, status_filter).page(request.GET.get('cursor'))
 
     context = {
         'sent_intents': sent_intents,
+        'status_filter': status_filter,
+        'status_choices': Product.Status.choices,
         'active_mypage_menu': 'sent_intents',
     }
     return render(request, 'interactions/sent_purchase_intents_list.html', context)
@@ -249,120 +349,96 @@ def sent_purchase_intents_list(request):
 @login_required
 def received_purchase_intents_list(request):
     """購入意思表示を受けた商品の一覧"""
-    # ログインユーザーが出品した商品に対する PurchaseIntent を取得
-    # Product の user フィールドがログインユーザーである PurchaseIntent を絞り込む
-    received_intents = PurchaseIntent.objects.filter(
-        product__user=request.user
-    ).select_related(
-        'product',
-        'user',
-        'product__main_product_image'
-    ).order_by('product__name', '-created_at')
-
-    for intent in received_intents:
-        if intent.product:
-            product = intent.product
-            # 意思表示者の表示名
-            intended_user_display = intent.user.display_name or intent.user.name
-            
-            product.status_message_info = "" # ステータスに応じた補助メッセージ
-            if product.status == Product.Status.FOR_SALE:
-                product.status_class = "status-for-sale"
-            elif product.status == Product.Status.IN_TRANSACTION:
-                product.status_class = "status-in-transaction"
-                if product.negotiating_user == intent.user: # この意思表示者と取引中か
-                    product.status_message_info = intended_user_display + " と取引中です"
-                elif product.negotiating_user: # 他の誰かと取引中か
-                    product.status_message_info = "他のユーザーと取引中"
-                else: # negotiating_userがいないが取引中 (通常はありえないが念のため)
-                    pass 
-            elif product.status == Product.Status.SOLD:
-                product.status_class = "status-sold"
-                if product.negotiating_user == intent.user: # この意思表示者に売却済か
-                    product.status_message_info = intended_user_display + "に売却しました"
-                elif product.negotiating_user:
-                    product.status_message_info = "他のユーザーに売却済"
-                else: # negotiating_userがいないが売却済
-                    product.status_message_info = ""
-            else:
-                product.status_class = ""
-                product.status_message_display = ""
+    # ログインユーザーが出品した商品に対する PurchaseIntent を取得 (詳細は received_intents_paginator)
+    status_filter = parse_status_filter(request.GET.get('status'))
+    if request.GET.get('group') == 'product':
+        return received_purchase_intents_by_product(request, status_filter)
+
+    received_intents = received_intents_paginator(request.user.pk, status_filter).page(request.GET.get('cursor'))
 
     context = {
         'received_intents': received_intents,
+        'status_filter': status_filter,
+        'status_choices': Product.Status.choices,
         'active_mypage_menu': 'received_intents',
     }
     return render(request, 'interactions/received_purchase_intents_list.html', context)
 
 
+def received_purchase_intents_by_product(request, status_filter):
+    """
+    購入意思表示を受けた商品の一覧 (商品ごとにまとめて表示する。?group=product)
+    1商品1行で、意思表示数・最新の意思表示日時・先頭の意思表示者 (RECEIVED_REQUESTERS_PER_PRODUCT 人) を表示する
+    クエリは 商品ごとの集計 (1ページ分) + 意思表示者 (ウィンドウ関数で商品ごとに上位 N 件) の2回で、意思表示の件数によらない
+    """
+    # 1. ログインユーザーが出品した商品ごとに、意思表示数と最新の意思表示日時を集計する (1ページ分)
+    groups = received_groups_paginator(request.user.pk, status_filter).page(request.GET.get('cursor'))
+
+    # 2. 表示中の商品の意思表示者を、商品ごとに先頭の N 人だけまとめて取得する
+    groups_by_product = {group['product'].pk: group for group in groups}
+    requester_rows = (
+        PurchaseIntent.objects.first_per_product(groups_by_product, RECEIVED_REQUESTERS_PER_PRODUCT)
+        .values('id', 'product_id', 'user_id', 'user__display_name', 'user__name', 'created_at', 'product_rank')
+        .order_by('product_id', 'product_rank')
+    )
+    for row in requester_rows:
+        groups_by_product[row['product_id']]['requesters'].append({
+            'pk': row['id'],
+            'user_id': row['user_id'],
+            'user_display_name': row['user__display_name'] or row['user__name'], # 意思表示者の表示名
+            'created_at': row['created_at'],
+        })
+    for group in groups:
+        # 表示しきれなかった意思表示者の数
+        group['hidden_requester_count'] = group['intent_count'] - len(group['requesters'])
+
+    context = {
+        'groups': groups,
+        'status_filter': status_filter,
+        'status_choices': Product.Status.choices,
+        'active_mypage_menu': 'received_intents',
+    }
+    return render(request, 'interactions/received_purchase_intents_by_product.html', context)
+
+
 @login_required
 @require_POST
 def start_transaction(request, intent_pk):
     """購入意思表示に基づいて取引を開始ー"""
     # 対象の PurchaseIntent を取得
-    intent = get_object_or_404(PurchaseIntent, pk=intent_pk)
+    intent = get_object_or_404(PurchaseIntent.objects.select_related('product', 'user'), pk=intent_pk)
     product = intent.product
     buyer = intent.user # 購入意思表示をしたユーザー
 
     # 権限チェック: ログインユーザーが商品の出品者であるか確認
-    if product.user != request.user:
-        messages.error(request, "この取引を開始する権限がありません。再度ログインしてください。")
+    if product.user_id != request.user.pk:
+        messages.error(request, "この取引を開始する権限がありません。再度ログインしてください。")
         return redirect('accounts:login')
 
-    # ステータスチェック: 商品が販売中であるか確認
-    if product.status != Product.Status.FOR_SALE:
-        messages.error(request, "この商品は既に取引中または売却済です。")
-        return redirect('interactions:received_purchase_intents_list')
-
     try:
         with transaction.atomic(): # 複数のDB操作をまとめて実行
-            # 1. 商品のステータスを「取引中」に更新
-            product.status = Product.Status.IN_TRANSACTION
-            # 2. 商品の取引相手 (negotiating_user) を設定
-            product.negotiating_user = buyer
-            product.save()
-
-            # 3. 購入者にメールで通知
-            try:
-                subject = f'【園フリマ】「{product.name}」の取引が開始されました'
-                mail_context = {
-                    'buyer_display_name': buyer.display_name or buyer.get_username(),
-                    'product_name': product.name,
-                    'product_detail_url': request.build_absolute_uri(
-                        reverse('products:product_detail', kwargs={'pk': product.pk})
-                    ),
-                }
-                message_body = render_to_string('emails/transaction_started_email.txt', mail_context)
-                recipient_list = [buyer.email] # 購入者のメールアドレス
-
-                send_mail(
-                    subject,
-                    message_body,
-                    settings.DEFAULT_FROM_EMAIL,
-                    recipient_list,
-                    fail_silently=False
-                )
-
-                logger.info(
-                    f"Successfully sent purchase intent notification email. "
-                    f"Product: {product.name} (ID: {product.pk}), "
-                    f"Send to: {buyer.email},"
-                    # 出品者情報
-                    f"Product Owner: {product.user.display_name} ({product.user.email}), "
-                    # 取引者情報
-                    f"Negotiating User: {buyer.display_name} ({buyer.email}), "
-                )
-            except Exception as e:
-                logger.error(
-                    f"[[MAIL ERROR]] Failed to send transaction started email. "
-                    f"Product: {product.name} (ID: {product.pk}), "
-                    f"Send to: {buyer.email},"
-                    f"Product Owner: {product.user.display_name} ({product.user.email}), "
-                    f"Negotiating User: {buyer.display_name} ({buyer.email}), "
-                    f"Error: {e}",
-                    exc_info=True
-                )
-                messages.warning(request, "取引は開始しましたが、購入者への通知メールの送信に失敗しました。")
+            # 1. 商品のステータスを「取引中」に更新し、取引相手 (negotiating_user) を設定
+            #    販売中であることを条件にした UPDATE で行う (同時に押されても1人との取引だけが開始される)
+            if not Product.objects.start_transaction(product.pk, buyer.pk):
+                messages.error(request, "この商品は既に取引中または売却済です。")
+                return redirect('interactions:received_purchase_intents_list')
+            # 商品一覧のキャッシュを無効化 (取引中の商品は一覧に表示しない。update は post_save を送らないので明示的に行う)
+            bump_kindergarten_version_on_commit(product.kindergarten_id)
+
+            # 2. 購入者への通知メールを送信待ちに登録 (送信は send_outbound_emails コマンドが行う)
+            mail_context = {
+                'buyer_display_name': buyer.display_name or buyer.get_username(),
+                'product_name': product.name,
+                'product_detail_url': request.build_absolute_uri(
+                    reverse('products:product_detail', kwargs={'pk': product.pk})
+                ),
+            }
+            enqueue_email(
+                f'【園フリマ】「{product.name}」の取引が開始されました',
+                'emails/transaction_started_email.txt',
+                mail_context,
+                [buyer.email], # 購入者のメールアドレス
+            )
 
             messages.success(request, f"「{product.name}」について、{buyer.display_name}さんとの取引を開始しました。")
 
@@ -378,26 +454,25 @@ def start_transaction(request, intent_pk):
 def complete_transaction(request, intent_pk):
     """購入意思表示に基づいて取引を完了"""
     # 対象の PurchaseIntent を取得
-    intent = get_object_or_404(PurchaseIntent, pk=intent_pk)
+    intent = get_object_or_404(PurchaseIntent.objects.select_related('product', 'user'), pk=intent_pk)
     product = intent.product
     buyer = intent.user
 
     # 権限チェック: ログインユーザーが商品の出品者であるか確認
-    if product.user != request.user:
-        messages.error(request, "この取引を完了する権限がありません。再度ログインしてください。")
+    if product.user_id != request.user.pk:
+        messages.error(request, "この取引を完了する権限がありません。再度ログインしてください。")
         return redirect('accounts:login')
 
-    # ステータスチェック: 商品が「取引中」であり、かつ取引相手が正しいか確認
-    if not (product.status == Product.Status.IN_TRANSACTION and product.negotiating_user == buyer):
-        messages.error(request, "この取引は現在完了できる状態ではありません。")
-        return redirect('interactions:received_purchase_intents_list')
-
     try:
         with transaction.atomic():
             # 1. 商品のステータスを「売却済」に更新
-            product.status = Product.Status.SOLD
-            # product.negotiating_user はそのまま (誰と取引したかの記録)
-            product.save()
+            #    「取引中」かつ取引相手が正しいことを条件にした UPDATE で行う
+            #    (product.negotiating_user はそのまま。誰と取引したかの記録)
+            if not Product.objects.complete_transaction(product.pk, buyer.pk):
+                messages.error(request, "この取引は現在完了できる状態ではありません。")
+                return redirect('interactions:received_purchase_intents_list')
+            # 商品一覧のキャッシュを無効化
+            bump_kindergarten_version_on_commit(product.kindergarten_id)
 
             # TODO: 2. 購入者と出品者にメールで通知 (次のステップで実装)
 
@@ -405,6 +480,6 @@ def complete_transaction(request, intent_pk):
 
     except Exception as e:
         messages.error(request, f"取引完了処理中にエラーが発生しました: {e}")
-        print(f"Error during complete_transaction: {e}")
+        logger.error(f"Error during complete_transaction: {e}", exc_info=True)
 
-    return redirect('interactions:received_purchase_intents_list')
\ No newline at end of file
+    return redirect('interactions:received_purchase_intents_list')
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ProductCategory, Product, ProductImage
+from .models import ProductCategory, Product, ProductImage, FileTombstone
 
 
 @admin.register(ProductCategory)
@@ -18,6 +18,15 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'product', 'image', 'created_at', 'updated_at')
+    list_display = ('id', 'product', 'image', 'rendition_attempts', 'created_at', 'updated_at')
+    list_filter = ('rendition_attempts',) # レンディションの作成に失敗している画像の確認用
+    readonly_fields = ('rendition_attempts', 'rendition_error')
+    list_select_related = ('product__product_category',) # 商品の表示 (Product.__str__) にカテゴリも使う
     search_fields = ('product',)
-    list_editable = ('image',)
\ No newline at end of file
+    list_editable = ('image',)
+
+@admin.register(FileTombstone)
+class FileTombstoneAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'source', 'attempts', 'created_at')
+    search_fields = ('name', 'source')
+    readonly_fields = ('name', 'source', 'attempts', 'last_error', 'created_at')
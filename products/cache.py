@@ -0,0 +1,118 @@
+# products/cache.py
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .normalizers import normalize_search_text
+
+# 園ごとのキャッシュバージョンのキー
+KINDERGARTEN_VERSION_KEY = 'products:kindergarten_version:{kindergarten_id}'
+
+# 商品一覧キャッシュの有効期間 (秒)。商品の変更時は園ごとのバージョンで無効化される
+LISTING_CACHE_TIMEOUT = 60 * 10
+
+# 商品一覧キャッシュのヒット / ミス件数のキー
+LISTING_STATS_KEYS = {
+    'hits': 'products:listing_cache:hits',
+    'misses': 'products:listing_cache:misses',
+}
+
+
+# --- 園ごとのキャッシュバージョン ---
+def get_kindergarten_version(kindergarten_id):
+    """
+    園ごとのキャッシュバージョンを返す
+    園の商品が変更されるとバージョンが上がり、古いバージョンのキャッシュは参照されなくなる
+    """
+    key = KINDERGARTEN_VERSION_KEY.format(kindergarten_id=kindergarten_id)
+    version = cache.get(key)
+    if version is None:
+        # キャッシュから消えていた場合も過去の値と重複しないよう、現在時刻 (ミリ秒) を初期値にする
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_kindergarten_version(kindergarten_id):
+    """園ごとのキャッシュバージョンを上げる (その園のキャッシュをすべて無効にする)"""
+    key = KINDERGARTEN_VERSION_KEY.format(kindergarten_id=kindergarten_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # キーが存在しない場合は新しいバージョンを作成する
+        get_kindergarten_version(kindergarten_id)
+
+
+def bump_kindergarten_version_on_commit(kindergarten_id, using='default'):
+    """
+    園ごとのキャッシュバージョンを、すぐに上げた上でトランザクションのコミット後にもう一度上げる
+    (コミット前に他のリクエストが古いデータをキャッシュしてしまうのを防ぐ)
+    """
+    bump_kindergarten_version(kindergarten_id)
+    transaction.on_commit(lambda: bump_kindergarten_version(kindergarten_id), using=using)
+
+
+# --- キャッシュキー ---
+def normalize_search_params(cleaned_data):
+    """検索条件 (ProductSearchForm.cleaned_data) をキャッシュキー用に正規化したハッシュ値にする"""
+    categories = cleaned_data.get('category')
+    params = {
+        'keyword': normalize_search_text(cleaned_data.get('keyword')),
+        'category': sorted(c.pk for c in categories) if categories else [],
+        'price_min': cleaned_data.get('price_min'),
+        'price_max': cleaned_data.get('price_max'),
+        'size': sorted(cleaned_data.get('size') or []),
+        'condition': sorted(cleaned_data.get('condition') or []),
+    }
+    return hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def listing_cache_key(kindergarten_id, cleaned_data, page_token=''):
+    """
+    商品一覧キャッシュのキー (園 + バージョン + 検索条件 + ページ)
+    キャッシュする一覧は園の全員で共有する (自分の出品の除外・お気に入り状態は取得後にビューで行う)
+    """
+    version = get_kindergarten_version(kindergarten_id)
+    params = normalize_search_params(cleaned_data)
+    page = hashlib.md5(str(page_token).encode()).hexdigest()
+    return f'products:listing:{kindergarten_id}:{version}:{params}:{page}'
+
+
+# --- 商品一覧キャッシュ ---
+def _incr_stat(name):
+    key = LISTING_STATS_KEYS[name]
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cached_listing(key):
+    """キャッシュ済みの商品一覧ページを返す。なければ None"""
+    listing = cache.get(key)
+    _incr_stat('misses' if listing is None else 'hits')
+    return listing
+
+
+def set_cached_listing(key, listing):
+    cache.set(key, listing, LISTING_CACHE_TIMEOUT)
+
+
+def get_listing_cache_stats():
+    """商品一覧キャッシュのヒット / ミス件数 (キャッシュバックエンドに保存された値)"""
+    hits = cache.get(LISTING_STATS_KEYS['hits']) or 0
+    misses = cache.get(LISTING_STATS_KEYS['misses']) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_listing_cache_stats():
+    cache.delete_many(LISTING_STATS_KEYS.values())
@@ -0,0 +1,183 @@
+# products/cards.py
+from django.core.files.storage import default_storage
+from django.db.models import Case, CharField, Value, When
+from django.db.models.functions import Substr
+
+from .models import Product
+
+# カードに表示する商品説明の最大文字数 (一覧では2行までしか表示しないため先頭だけ取得する)
+CARD_SUMMARY_LENGTH = 100
+
+# 商品ステータスごとのステータスバッジの CSS クラス
+STATUS_CLASSES = {
+    Product.Status.FOR_SALE: 'status-for-sale',
+    Product.Status.IN_TRANSACTION: 'status-in-transaction',
+    Product.Status.SOLD: 'status-sold',
+}
+
+
+def parse_status_filter(value):
+    """クエリパラメータの status (絞り込むステータス) を Product.Status にする。未指定・不正な値は None"""
+    try:
+        return Product.Status(int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_expression(value):
+    """文字列は Value で包み、式 (Concat など) はそのまま返す"""
+    return value if hasattr(value, 'resolve_expression') else Value(value)
+
+
+class CardImage:
+    """カードのメイン画像 (rendition_img で使う ProductImage と同じ名前の属性だけを持つ)"""
+    __slots__ = ('file_name', 'renditions', 'width', 'height', 'lqip')
+
+    def __init__(self, file_name, renditions, width, height, lqip):
+        self.file_name = file_name
+        self.renditions = renditions or {}
+        self.width = width
+        self.height = height
+        self.lqip = lqip or ''
+
+
+class ProductCard:
+    """
+    一覧ページの商品カード表示用の軽量な読み取りモデル
+    Product インスタンスの代わりに .values() の結果から作成し、カードの表示に必要な項目だけを持つ
+    テンプレートでは Product と同じ名前 (pk, name, get_status_display など) で参照できる
+    """
+    __slots__ = (
+        'pk', 'name', 'price', 'size', 'condition', 'status', 'summary',
+        'thumbnail_name', 'thumbnail_renditions', 'thumbnail_width', 'thumbnail_height', 'thumbnail_lqip',
+        'user_id', 'negotiating_user_id', 'created_at',
+        'favorite_count', 'purchase_intent_count', 'comment_count',
+        # ビューで設定する表示用のフラグ・情報
+        'is_favorited_by_current_user', 'is_purchase_intended_by_current_user',
+        'status_class', 'status_message_info',
+    )
+
+    # テンプレートで product.Status.FOR_SALE.value のように参照するため
+    Status = Product.Status
+
+    # .values() で取得するフィールド (キー: ProductCard の属性名, 値: Product のフィールド)
+    FIELDS = {
+        'pk': 'id',
+        'name': 'name',
+        'price': 'price',
+        'size': 'size',
+        'condition': 'condition',
+        'status': 'status',
+        'summary': 'card_summary', # 商品説明の先頭部分 (annotate で作成)
+        'thumbnail_name': 'main_product_image__image',
+        'thumbnail_renditions': 'main_product_image__renditions',
+        'thumbnail_width': 'main_product_image__width',
+        'thumbnail_height': 'main_product_image__height',
+        'thumbnail_lqip': 'main_product_image__lqip',
+        'user_id': 'user_id',
+        'negotiating_user_id': 'negotiating_user_id',
+        'created_at': 'created_at',
+        'favorite_count': 'favorite_count',
+        'purchase_intent_count': 'purchase_intent_count',
+        'comment_count': 'comment_count',
+    }
+    # 表示用の項目 (クエリの注釈として .values() に含めた場合は、その値をそのまま設定する)
+    DISPLAY_FIELDS = (
+        'is_favorited_by_current_user', 'is_purchase_intended_by_current_user',
+        'status_class', 'status_message_info',
+    )
+
+    def __init__(self, **values):
+        for attr in self.__slots__:
+            setattr(self, attr, values.get(attr))
+        self.is_favorited_by_current_user = bool(self.is_favorited_by_current_user)
+        self.is_purchase_intended_by_current_user = bool(self.is_purchase_intended_by_current_user)
+        self.status_class = self.status_class or ''
+        self.status_message_info = self.status_message_info or ''
+
+    def __repr__(self):
+        return f'<ProductCard {self.pk}: {self.name}>'
+
+    # --- 取得 ---
+    @classmethod
+    def value_fields(cls, prefix=''):
+        """.values() に渡すフィールド名のリスト (prefix: 'product__' など関連先から取得する場合)"""
+        fields = []
+        for field in cls.FIELDS.values():
+            fields.append(field if field == 'card_summary' else prefix + field)
+        return fields
+
+    @classmethod
+    def annotate(cls, queryset, prefix=''):
+        """カード用の注釈 (商品説明の先頭部分) を追加する"""
+        return queryset.annotate(card_summary=Substr(f'{prefix}description', 1, CARD_SUMMARY_LENGTH))
+
+    @classmethod
+    def status_annotations(cls, prefix='', party=None, messages=None):
+        """
+        ステータスバッジの CSS クラス (status_class) と補助メッセージ (status_message_info) を
+        Case/When で SQL 側で求める注釈の辞書を返す (queryset.annotate(**...) に渡す)
+        party: 取引相手 (negotiating_user_id) と比較するユーザーID または式 (F('user_id') など)
+        messages: {ステータス: (取引相手が party の場合のメッセージ, 他のユーザーの場合のメッセージ)}
+                  メッセージは文字列または式 (Concat など)。省略した場合は status_class だけを返す
+        """
+        annotations = {
+            'status_class': Case(
+                *[When(**{f'{prefix}status': status}, then=Value(css_class)) for status, css_class in STATUS_CLASSES.items()],
+                default=Value(''), output_field=CharField(),
+            ),
+        }
+        if messages:
+            cases = []
+            for status, (party_message, other_message) in messages.items():
+                cases += [
+                    When(**{f'{prefix}status': status, f'{prefix}negotiating_user_id': party}, then=_as_expression(party_message)),
+                    When(**{f'{prefix}status': status, f'{prefix}negotiating_user_id__isnull': False}, then=_as_expression(other_message)),
+                ]
+            annotations['status_message_info'] = Case(*cases, default=Value(''), output_field=CharField())
+        return annotations
+
+    @classmethod
+    def values(cls, queryset, *extra_fields, prefix=''):
+        """クエリセットをカードに必要なカラムだけの .values() に変換する"""
+        return cls.annotate(queryset, prefix).values(*cls.value_fields(prefix), *extra_fields)
+
+    @classmethod
+    def from_row(cls, row, prefix=''):
+        """.values() の1行 (dict) からカードを作成する"""
+        values = {}
+        for attr, field in cls.FIELDS.items():
+            values[attr] = row[field if field == 'card_summary' else prefix + field]
+        for attr in cls.DISPLAY_FIELDS:
+            if attr in row:
+                values[attr] = row[attr]
+        return cls(**values)
+
+    # --- 表示用 ---
+    @property
+    def description(self):
+        return self.summary or ''
+
+    @property
+    def thumbnail(self):
+        """メイン画像の情報 (テンプレートタグ rendition_img に ProductImage の代わりに渡す)"""
+        if not self.thumbnail_name:
+            return None
+        return CardImage(
+            self.thumbnail_name, self.thumbnail_renditions,
+            self.thumbnail_width, self.thumbnail_height, self.thumbnail_lqip,
+        )
+
+    @property
+    def thumbnail_url(self):
+        """メイン画像の URL (なければ空文字列)"""
+        return default_storage.url(self.thumbnail_name) if self.thumbnail_name else ''
+
+    def get_size_display(self):
+        return Product.Size(self.size).label
+
+    def get_condition_display(self):
+        return Product.Condition(self.condition).label
+
+    def get_status_display(self):
+        return Product.Status(self.status).label
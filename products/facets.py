@@ -0,0 +1,102 @@
+# products/facets.py
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .cache import get_kindergarten_version, normalize_search_params
+from .search import apply_search_filters
+
+# 絞り込み件数のキャッシュ有効期間 (秒)。商品の変更時は園ごとのバージョンで無効化される
+FACET_CACHE_TIMEOUT = 60 * 10
+
+# 価格帯の区分 (キー, 表示ラベル, 下限, 上限)。上限・下限は両端を含む
+PRICE_BANDS = [
+    ('0-499', '〜499円', 0, 499),
+    ('500-999', '500〜999円', 500, 999),
+    ('1000-2999', '1,000〜2,999円', 1000, 2999),
+    ('3000-4999', '3,000〜4,999円', 3000, 4999),
+    ('5000-', '5,000円〜', 5000, None),
+]
+
+
+def _cache_key(cleaned_data, kindergarten_id):
+    """園 + バージョン + 検索条件のキャッシュキー (園の全員で共有する。自分の出品の分は取得後に引く)"""
+    version = get_kindergarten_version(kindergarten_id)
+    params = normalize_search_params(cleaned_data)
+    return f'products:facets:{kindergarten_id}:{version}:{params}'
+
+
+def _count_by(queryset, field):
+    """field の値ごとの件数を1回の GROUP BY クエリで集計する"""
+    rows = queryset.order_by().values(field).annotate(count=Count('pk')).values_list(field, 'count')
+    return dict(rows)
+
+
+def _count_price_bands(queryset):
+    """価格帯ごとの件数を1回のクエリ (条件付き集計) で集計する"""
+    aggregates = {}
+    for key, _label, low, high in PRICE_BANDS:
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lte=high)
+        aggregates[key] = Count('pk', filter=condition)
+    counts = queryset.order_by().aggregate(**aggregates)
+    return [
+        {'key': key, 'label': label, 'price_min': low, 'price_max': high, 'count': counts[key]}
+        for key, label, low, high in PRICE_BANDS
+    ]
+
+
+def _count_facets(base_queryset, cleaned_data):
+    def filtered(exclude):
+        return apply_search_filters(base_queryset, cleaned_data, exclude=(exclude,), ranked=False)
+
+    return {
+        'category': _count_by(filtered('category'), 'product_category'),
+        'size': _count_by(filtered('size'), 'size'),
+        'condition': _count_by(filtered('condition'), 'condition'),
+        'price': _count_price_bands(filtered('price')),
+    }
+
+
+def _subtract(facet_counts, own_counts):
+    """園全体の件数から自分の出品の件数を引く (0件になった値は GROUP BY の結果と同じく含めない)"""
+    result = {}
+    for facet in ('category', 'size', 'condition'):
+        own = own_counts[facet]
+        result[facet] = {
+            value: count - own.get(value, 0) for value, count in facet_counts[facet].items()
+            if count - own.get(value, 0) > 0
+        }
+    result['price'] = [
+        {**band, 'count': band['count'] - own_band['count']}
+        for band, own_band in zip(facet_counts['price'], own_counts['price'])
+    ]
+    return result
+
+
+def get_facet_counts(base_queryset, cleaned_data, kindergarten_id, user_id=None):
+    """
+    商品一覧サイドバーの絞り込み条件ごとの件数を返す
+    各条件の件数は「その条件以外の絞り込み」を適用した結果で数える
+    (例: サイズ 110 にチェック中でも、サイズ 120 を追加したときの件数が分かる)
+    base_queryset は園の販売中の商品 (自分の出品を含む)。園全体の件数をキャッシュし、
+    user_id を指定した場合はそのユーザーの出品の分を引いて返す (出品していなければ確認のクエリ1回だけ。結果はキャッシュする)
+    {'category': {pk: 件数}, 'size': {値: 件数}, 'condition': {値: 件数}, 'price': [価格帯ごとの件数]}
+    """
+    key = _cache_key(cleaned_data, kindergarten_id)
+    facet_counts = cache.get(key)
+    if facet_counts is None:
+        facet_counts = _count_facets(base_queryset, cleaned_data)
+        cache.set(key, facet_counts, FACET_CACHE_TIMEOUT)
+
+    if user_id is not None:
+        # 自分の出品の件数も同じバージョンでキャッシュする (出品していない場合は {} を保存する)
+        own_key = f'{key}:own:{user_id}'
+        own_counts = cache.get(own_key)
+        if own_counts is None:
+            own_queryset = base_queryset.filter(user_id=user_id)
+            own_counts = _count_facets(own_queryset, cleaned_data) if own_queryset.exists() else {}
+            cache.set(own_key, own_counts, FACET_CACHE_TIMEOUT)
+        if own_counts:
+            facet_counts = _subtract(facet_counts, own_counts)
+    return facet_counts
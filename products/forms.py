@@ -2,6 +2,7 @@
 
 from django import forms
 from .models import Product, ProductCategory, ProductImage
+from .uploads import normalize_upload
 
 class ProductForm(forms.ModelForm):
     """商品出品フォーム"""
@@ -141,6 +142,26 @@ class ProductForm(forms.ModelForm):
             self.fields['main_image'].error_messages = {'required': 'メイン画像を登録してください。'}
             self.fields['main_image'].help_text = 'メイン画像の登録は必須です。'
 
+    # --- 画像フィールドのバリデーション ---
+    # アップロードされた画像を縮小・向き補正・メタデータ削除した JPEG に置き換える
+    def _clean_image(self, field_name):
+        image = self.cleaned_data.get(field_name)
+        if not image:
+            return image
+        return normalize_upload(image)
+
+    def clean_main_image(self):
+        return self._clean_image('main_image')
+
+    def clean_sub_image_1(self):
+        return self._clean_image('sub_image_1')
+
+    def clean_sub_image_2(self):
+        return self._clean_image('sub_image_2')
+
+    def clean_sub_image_3(self):
+        return self._clean_image('sub_image_3')
+
     # --- 全体に関わるバリデーション は特にないのでcleanメソッドは定義しない ---
 
 
@@ -0,0 +1,101 @@
+# products/images.py
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from . import renditions
+from .models import ProductImage
+from .storage import product_image_storage, release_product_image_file
+from .uploads import read_image_metadata
+
+# ProductImage の画像に関する項目 (画像を差し替えるときに更新する)
+IMAGE_FIELDS = ['image', 'width', 'height', 'bytes', 'lqip', 'renditions', 'rendition_attempts', 'rendition_error']
+
+
+class StagedImage:
+    """一時領域に書き込んだアップロード画像 (コミット後に確定する)"""
+    __slots__ = ('name', 'staged_name', 'metadata')
+
+    def __init__(self, name, staged_name, metadata):
+        self.name = name
+        self.staged_name = staged_name
+        self.metadata = metadata
+
+
+@contextmanager
+def staged_uploads(files_by_order):
+    """
+    アップロード画像 ({表示順: ファイル}) を一時領域に書き込み、{表示順: StagedImage} を渡す
+    ブロック内で例外が発生した場合 (トランザクションのロールバック) は一時ファイルを削除する
+    使い方:
+        with staged_uploads(files) as staged, transaction.atomic():
+            persist_product_images(product, staged)
+    """
+    upload_to = ProductImage._meta.get_field('image').generate_filename
+    staged = {}
+    try:
+        for order, file in files_by_order.items():
+            if not file:
+                continue
+            metadata = getattr(file, 'image_metadata', None) or read_image_metadata(file)
+            name, staged_name = product_image_storage.stage(upload_to(None, file.name), file)
+            staged[order] = StagedImage(name, staged_name, metadata)
+        yield staged
+    except BaseException:
+        for image in staged.values():
+            product_image_storage.discard(image.staged_name)
+        raise
+
+
+def persist_product_images(product, staged, existing=None):
+    """
+    一時領域の画像を商品の ProductImage としてまとめて保存する (transaction.atomic() の中で呼ぶ)
+    existing ({表示順: ProductImage}) にある表示順は画像を差し替え、ない表示順は bulk_create で作成する
+    ファイルの確定とレンディションの作成はコミット後に行う
+    戻り値: {表示順: 保存した ProductImage}
+    """
+    existing = existing or {}
+    # 同じ内容の画像のレンディションが作成済みなら、作り直さずにそれを使う (1回のクエリでまとめて探す)
+    shared = {}
+    names = {image.name for image in staged.values()}
+    for name, image_renditions in (
+        ProductImage.objects.filter(image__in=names).exclude(renditions={}).values_list('image', 'renditions')
+    ):
+        if image_renditions.get('source') == name:
+            shared.setdefault(name, image_renditions)
+
+    created, replaced, saved = [], [], {}
+    for order, image in sorted(staged.items()):
+        current = existing.get(order)
+        if current is not None:
+            # 差し替え前のファイルへの参照を解放する (最後の参照ならコミット後に削除される)
+            release_product_image_file(current.image.name, current.renditions)
+            current.image = image.name
+            current.renditions = shared.get(image.name, {})
+            current.rendition_attempts, current.rendition_error = 0, ''
+            for field, value in image.metadata.items():
+                setattr(current, field, value)
+            replaced.append(current)
+            saved[order] = current
+        else:
+            saved[order] = ProductImage(
+                product=product, image=image.name, display_order=order,
+                renditions=shared.get(image.name, {}), **image.metadata,
+            )
+            created.append(saved[order])
+
+    if created:
+        ProductImage.objects.bulk_create(created)
+    if replaced:
+        ProductImage.objects.bulk_update(replaced, IMAGE_FIELDS)
+
+    def promote():
+        for image in staged.values():
+            product_image_storage.promote(image.staged_name, image.name)
+        # bulk_create / bulk_update は post_save を送らないので、ここでレンディションの作成を登録する
+        for product_image in saved.values():
+            if not product_image.renditions:
+                renditions.schedule_renditions(product_image)
+
+    transaction.on_commit(promote)
+    return saved
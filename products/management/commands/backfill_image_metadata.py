@@ -0,0 +1,46 @@
+# products/management/commands/backfill_image_metadata.py
+from django.core.management.base import BaseCommand
+
+from products.models import ProductImage
+from products.storage import product_image_storage
+from products.uploads import read_image_metadata
+
+METADATA_FIELDS = ['width', 'height', 'bytes', 'lqip']
+
+
+class Command(BaseCommand):
+    help = '既存の商品画像の 幅・高さ・バイト数・ぼかしプレースホルダー を記録する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='まとめて更新する件数')
+        parser.add_argument('--force', action='store_true', help='記録済みの画像も読み直す')
+
+    def handle(self, *args, **options):
+        queryset = ProductImage.objects.exclude(image='').only('pk', 'image').order_by('pk')
+        if not options['force']:
+            queryset = queryset.filter(width__isnull=True)
+
+        batch, updated, failed = [], 0, 0
+        # 同じ内容のファイルを共有する画像は1回だけ読む
+        cache = {}
+        for image in queryset.iterator(chunk_size=options['batch_size']):
+            name = image.image.name
+            try:
+                if name not in cache:
+                    with product_image_storage.open(name, 'rb') as f:
+                        cache[name] = read_image_metadata(f)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{name} (ID: {image.pk}): {e}')
+                continue
+
+            for field, value in cache[name].items():
+                setattr(image, field, value)
+            batch.append(image)
+            if len(batch) >= options['batch_size']:
+                updated += ProductImage.objects.bulk_update(batch, METADATA_FIELDS)
+                batch, cache = [], {}
+        if batch:
+            updated += ProductImage.objects.bulk_update(batch, METADATA_FIELDS)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} 件の画像の情報を記録しました。(失敗: {failed} 件)'))
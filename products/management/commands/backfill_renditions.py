@@ -0,0 +1,54 @@
+# products/management/commands/backfill_renditions.py
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.core.management.base import BaseCommand
+
+from products.renditions import (
+    MAX_RENDITION_ATTEMPTS, build_renditions, create_executor, iter_pending_renditions, record_rendition_failure,
+    save_renditions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'レンディション (縮小画像) が未作成の商品画像について、並列で作成する '
+        '(待ち行列があふれて登録されなかった画像・作成に失敗した画像の再試行を含む)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='並列に処理するプロセス数')
+        parser.add_argument('--force', action='store_true', help='作成済みの画像・失敗回数が上限の画像も作り直す')
+        parser.add_argument(
+            '--max-attempts', type=int, default=MAX_RENDITION_ATTEMPTS,
+            help='この回数以上作成に失敗した画像は飛ばす',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        done = failed = 0
+        with create_executor(workers) as executor:
+            pending = {}
+            for pk, name in iter_pending_renditions(options['max_attempts'], options['force']):
+                # 待ち行列が大きくなりすぎないよう、プロセス数の2倍までしか登録しない
+                if len(pending) >= workers * 2:
+                    done, failed = self._collect(pending, done, failed)
+                pending[executor.submit(build_renditions, name)] = (pk, name)
+            while pending:
+                done, failed = self._collect(pending, done, failed)
+
+        self.stdout.write(self.style.SUCCESS(f'{done} 件の画像のレンディションを作成しました。(失敗: {failed} 件)'))
+
+    def _collect(self, pending, done, failed):
+        """完了したものを記録する (失敗は失敗回数として記録し、次回の実行で再試行する)"""
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            pk, name = pending.pop(future)
+            try:
+                save_renditions(pk, future.result())
+                done += 1
+            except Exception as e:
+                failed += 1
+                record_rendition_failure(pk, e)
+                self.stderr.write(f'{name} (ID: {pk}): {e}')
+        return done, failed
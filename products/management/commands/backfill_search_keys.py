@@ -0,0 +1,38 @@
+# products/management/commands/backfill_search_keys.py
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.normalizers import build_search_key
+
+
+class Command(BaseCommand):
+    help = '全商品の検索キー (search_key) を商品名・商品説明から作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の更新でまとめる件数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            # pk 順にバッチで取得し、変更があったものだけまとめて更新する
+            batch = list(
+                Product.objects.filter(pk__gt=last_pk).order_by('pk')
+                .only('pk', 'name', 'description', 'search_key')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            changed = []
+            for product in batch:
+                search_key = build_search_key(product.name, product.description)
+                if product.search_key != search_key:
+                    product.search_key = search_key
+                    changed.append(product)
+            if changed:
+                Product.objects.bulk_update(changed, ['search_key'])
+                updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} 件の検索キーを更新しました。'))
@@ -0,0 +1,86 @@
+# products/management/commands/bench_product_cards.py
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import User
+from kindergartens.models import Kindergarten
+from products.cards import ProductCard
+from products.models import Product, ProductCategory
+
+
+class Rollback(Exception):
+    """ベンチマーク用のデータを破棄するための例外"""
+
+
+class Command(BaseCommand):
+    help = '一覧ページ用の ProductCard と Product インスタンスの取得時間・メモリ使用量を比較する (データはロールバック)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='比較に使う商品数')
+        parser.add_argument('--repeat', type=int, default=3, help='計測の繰り返し回数 (最小値を表示)')
+
+    def measure(self, build, repeat):
+        """build() の実行時間 (最小値) とピークメモリを計測する"""
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            build()
+            elapsed.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        objects = build()
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return min(elapsed), peak, len(objects)
+
+    def seed(self, rows):
+        """計測用の商品を作成する"""
+        kindergarten = Kindergarten.objects.create(
+            name='ベンチマーク園', auth_code='bench-product-cards', zip_code='000-0000', address='-'
+        )
+        user = User.objects.create_user(
+            email='bench-product-cards@example.com', password=None, name='bench', kindergarten=kindergarten
+        )
+        category, _created = ProductCategory.objects.get_or_create(name='ベンチマーク')
+        Product.objects.bulk_create(
+            [
+                Product(
+                    user=user, kindergarten=kindergarten, product_category=category,
+                    name=f'商品 {i}', price=i % 5000, description='商品説明' * 100,
+                )
+                for i in range(rows)
+            ],
+            batch_size=1000,
+        )
+        return kindergarten
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        if rows <= 0:
+            raise CommandError('--rows は1以上を指定してください。')
+
+        try:
+            with transaction.atomic():
+                kindergarten = self.seed(rows)
+                queryset = Product.objects.filter(kindergarten=kindergarten).order_by('-created_at', '-id')
+
+                results = {
+                    'Product (select_related)': self.measure(
+                        lambda: list(queryset.select_related('main_product_image', 'product_category')), repeat
+                    ),
+                    'ProductCard (.values)': self.measure(
+                        lambda: [ProductCard.from_row(row) for row in ProductCard.values(queryset)], repeat
+                    ),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'rows: {rows} / repeat: {repeat}')
+        for label, (elapsed, peak, count) in results.items():
+            self.stdout.write(
+                f'{label:<28} time: {elapsed * 1000:8.1f} ms   peak memory: {peak / 1024 / 1024:7.2f} MiB   ({count} 件)'
+            )
@@ -0,0 +1,78 @@
+# products/management/commands/check_query_plans.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from accounts.views import my_listings_paginator
+from interactions.views import (
+    favorite_paginator, received_groups_paginator, received_intents_paginator, sent_intents_paginator,
+)
+from products.views import for_sale_products, listing_paginator
+
+
+class Command(BaseCommand):
+    help = '主要な一覧系クエリに EXPLAIN を実行し、フルテーブルスキャンがあればエラー終了する'
+
+    def get_hot_queries(self):
+        """
+        各ビューで実行される主要クエリ (ビューと同じ関数で作成する。値はダミー、実行計画の確認のみ)
+        カーソルページネーションは先頭ページと、カーソルより後ろのページ (next) の両方を確認する
+        """
+        user_id = 1
+        kindergarten_id = 1
+        paginators = {
+            # products.views.product_list_view
+            'product_list': listing_paginator(for_sale_products(kindergarten_id)),
+            # accounts.views.my_listings
+            'my_listings': my_listings_paginator(user_id),
+            # interactions.views.favorite_list
+            'favorite_list': favorite_paginator(user_id),
+            # interactions.views.sent_purchase_intents_list
+            'sent_purchase_intents': sent_intents_paginator(user_id),
+            # interactions.views.received_purchase_intents_list
+            'received_purchase_intents': received_intents_paginator(user_id),
+            # interactions.views.received_purchase_intents_by_product (商品ごとの集計)
+            'received_purchase_intents_by_product': received_groups_paginator(user_id),
+        }
+        queries = {}
+        for name, paginator in paginators.items():
+            queries[name] = paginator.page_queryset()
+            cursor = paginator.encode_cursor({paginator.field: timezone.now(), 'pk': 1}, 'n')
+            queries[f'{name} (next)'] = paginator.page_queryset(cursor)
+        return queries
+
+    def find_full_scans(self, plan):
+        """実行計画のテキストからフルテーブルスキャンの行を抽出する"""
+        full_scans = []
+        for line in plan.splitlines():
+            if connection.vendor == 'sqlite':
+                # SQLite: インデックスを使わない走査は "SCAN <table>" のみになる
+                # (FTS5 の MATCH は "SCAN <table> VIRTUAL TABLE INDEX ..." と表示されるので除外)
+                if ' SCAN ' in f' {line} ' and 'USING' not in line and 'VIRTUAL TABLE' not in line:
+                    full_scans.append(line.strip())
+            elif connection.vendor == 'postgresql':
+                if 'Seq Scan' in line:
+                    full_scans.append(line.strip())
+        return full_scans
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.stdout.write(self.style.WARNING(
+                f'{connection.vendor} の実行計画チェックには対応していません。スキップします。'
+            ))
+            return
+
+        failed = []
+        for name, queryset in self.get_hot_queries().items():
+            plan = queryset.explain()
+            full_scans = self.find_full_scans(plan)
+            if options['verbosity'] >= 2:
+                self.stdout.write(f'--- {name} ---\n{plan}')
+            if full_scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'[NG] {name}: ' + ' / '.join(full_scans)))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'[OK] {name}'))
+
+        if failed:
+            raise CommandError(f'フルテーブルスキャンが検出されました: {", ".join(failed)}')
@@ -0,0 +1,39 @@
+# products/management/commands/dedupe_product_images.py
+import re
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from products.models import ProductImage
+from products.storage import SHARD_DEPTH, SHARD_WIDTH, product_image_storage, release_product_image_file
+
+# 内容のハッシュで保存済みのファイル名 (例: product_images/ab/cd/abcd....jpg)
+CONTENT_ADDRESSED_RE = re.compile(r'(?:^|/)' + r'[0-9a-f]{%d}/' % SHARD_WIDTH * SHARD_DEPTH + r'[0-9a-f]{64}\.[^/]+$')
+
+
+class Command(BaseCommand):
+    help = '既存の商品画像を内容のハッシュで保存し直し、同じ内容のファイルを1つにまとめる'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-renditions', action='store_true', help='保存し直した画像のレンディションを作成しない')
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        for pk, name, renditions in ProductImage.objects.exclude(image='').values_list('pk', 'image', 'renditions').iterator():
+            if CONTENT_ADDRESSED_RE.search(name):
+                continue
+            if not product_image_storage.exists(name):
+                missing += 1
+                self.stderr.write(f'ファイルが見つかりません: {name} (ID: {pk})')
+                continue
+
+            with product_image_storage.open(name, 'rb') as f:
+                new_name = product_image_storage.save(name, f)
+            # signal を通さずにファイル名だけ差し替え、古いファイルへの参照を解放する
+            ProductImage.objects.filter(pk=pk).update(image=new_name, renditions={})
+            release_product_image_file(name, renditions)
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{moved} 件の画像を保存し直しました。(ファイルなし: {missing} 件)'))
+        if moved and not options['skip_renditions']:
+            call_command('backfill_renditions', stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,27 @@
+# products/management/commands/gc_media_files.py
+from django.core.management.base import BaseCommand
+
+from products.media_gc import DELETE_WORKERS, delete_files, find_orphan_files
+
+
+class Command(BaseCommand):
+    help = 'MEDIA_ROOT の商品画像のうち、どの ProductImage からも参照されていないファイルを削除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600, help='この秒数以内に更新されたファイルは削除しない')
+        parser.add_argument('--staging-age', type=int, default=24 * 3600, help='一時領域のファイルを削除するまでの秒数')
+        parser.add_argument('--workers', type=int, default=DELETE_WORKERS, help='走査・削除を並行して行うスレッド数')
+        parser.add_argument('--dry-run', action='store_true', help='削除せずに対象のファイルを表示する')
+
+    def handle(self, *args, **options):
+        orphans = find_orphan_files(
+            min_age=options['min_age'], staging_age=options['staging_age'], workers=options['workers'],
+        )
+        if options['dry_run']:
+            for name in orphans:
+                self.stdout.write(name)
+            self.stdout.write(self.style.SUCCESS(f'参照されていないファイル: {len(orphans)} 件 (削除していません)'))
+            return
+
+        deleted, failed = delete_files(orphans, workers=options['workers'], min_age=options['min_age'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} 件のファイルを削除しました。(失敗: {failed} 件)'))
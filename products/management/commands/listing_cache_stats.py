@@ -0,0 +1,20 @@
+# products/management/commands/listing_cache_stats.py
+from django.core.management.base import BaseCommand
+
+from products.cache import get_listing_cache_stats, reset_listing_cache_stats
+
+
+class Command(BaseCommand):
+    help = '商品一覧キャッシュのヒット / ミス件数を表示する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='表示後に件数をリセットする')
+
+    def handle(self, *args, **options):
+        stats = get_listing_cache_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']} / misses: {stats['misses']} / hit rate: {stats['hit_rate']:.1%}"
+        )
+        if options['reset']:
+            reset_listing_cache_stats()
+            self.stdout.write(self.style.SUCCESS('件数をリセットしました。'))
@@ -0,0 +1,38 @@
+# products/management/commands/reap_file_tombstones.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.media_gc import DELETE_WORKERS, MAX_ATTEMPTS, reap_file_tombstones
+
+
+class Command(BaseCommand):
+    help = '削除待ちの商品画像ファイル (トゥームストーン) をまとめて削除する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='1回にまとめて処理する件数')
+        parser.add_argument('--workers', type=int, default=DELETE_WORKERS, help='ファイル削除を並行して行うスレッド数')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help='削除を諦めるまでの試行回数')
+        parser.add_argument('--loop', action='store_true', help='終了せずに削除待ちファイルを監視し続ける')
+        parser.add_argument('--interval', type=float, default=30, help='--loop 時、削除待ちがない場合の待機秒数')
+
+    def handle(self, *args, **options):
+        total_deleted = total_kept = total_failed = 0
+        while True:
+            deleted, kept, failed = reap_file_tombstones(
+                batch_size=options['batch_size'], workers=options['workers'], max_attempts=options['max_attempts'],
+            )
+            total_deleted += deleted
+            total_kept += kept
+            total_failed += failed
+
+            # 失敗したものは次のバッチでも先頭に来るため、成功・スキップがあった場合だけ続ける
+            if deleted or kept:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'削除: {total_deleted} 件, 参照ありのため残した: {total_kept} 件, 失敗: {total_failed} 件'
+        ))
@@ -0,0 +1,18 @@
+# products/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = '商品の全文検索インデックス (FTS5) を全件作り直す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の INSERT でまとめる件数')
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        if count is None:
+            self.stdout.write(self.style.WARNING('全文検索テーブルが利用できないため、スキップしました。'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'{count} 件の商品をインデックスに登録しました。'))
@@ -0,0 +1,248 @@
+# products/management/commands/seed_market.py
+import random
+import time
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from PIL import Image, ImageDraw
+
+from accounts.models import User
+from interactions.counters import reconcile_product_counters
+from interactions.models import Comment, Favorite, PurchaseIntent
+from kindergartens.models import Kindergarten
+from products.models import Product, ProductCategory, ProductImage
+from products.normalizers import build_search_key
+from products.renditions import build_renditions
+from products.search import rebuild_index
+from products.storage import product_image_storage
+from products.uploads import read_image_metadata
+
+# カテゴリが1件もない場合に作成するカテゴリ
+DEFAULT_CATEGORIES = ('制服', '体操服', '帽子', '上履き', 'カバン', '食器・水筒', 'その他')
+# 商品名・商品説明の材料
+ITEM_NAMES = ('スモック', '体操服', '通園帽子', '上履き', '通園バッグ', 'お弁当箱', '水筒', '制服ブレザー', 'カラー帽子', '手提げ袋')
+ITEM_COLORS = ('紺', '白', '赤', '黄色', '水色', 'ピンク', '緑')
+DESCRIPTIONS = (
+    '名前の記入はありません。',
+    '年少から1年間使用しました。',
+    '洗濯済みです。目立った汚れはありません。',
+    'サイズアウトのため出品します。',
+    '袖口に少し毛玉があります。',
+    'お下がりでいただいたものです。',
+)
+COMMENTS = ('まだ購入できますか？', 'サイズを教えてください。', 'お受け取りはいつ頃可能ですか？', 'ありがとうございます！')
+# 購入意思表示がある商品のうち、取引中・売却済にする割合
+IN_TRANSACTION_RATE = 0.1
+SOLD_RATE = 0.1
+# 1商品あたりのサブ画像の最大枚数
+MAX_SUB_IMAGES = 2
+
+
+class Command(BaseCommand):
+    help = (
+        '負荷試験用の合成データ (園・ユーザー・商品・画像・お気に入り・購入意思表示・コメント) を bulk_create で一括作成する。'
+        '--seed が同じなら同じ内容のデータになる'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kindergartens', type=int, default=10, help='作成する園の数')
+        parser.add_argument('--users-per-kindergarten', type=int, default=100, help='園ごとのユーザー数')
+        parser.add_argument('--products', type=int, default=10000, help='作成する商品数 (各園に均等に割り振る)')
+        parser.add_argument('--images', type=int, default=12, help='生成するプレースホルダー画像の数 (0: 画像なし)')
+        parser.add_argument('--favorites', type=float, default=3.0, help='1商品あたりの平均お気に入り数 (指数分布)')
+        parser.add_argument('--intents', type=float, default=1.0, help='1商品あたりの平均購入意思表示数 (指数分布)')
+        parser.add_argument('--comments', type=float, default=0.5, help='1商品あたりの平均コメント数 (指数分布)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='1回の bulk_create でまとめる商品数')
+        parser.add_argument('--seed', type=int, default=1, help='乱数のシード')
+        parser.add_argument('--prefix', default='seed', help='園の認証コード・メールアドレスの接頭辞 (既存データとの重複を避ける)')
+        parser.add_argument('--password', default='password', help='作成するユーザー全員のパスワード')
+
+    def handle(self, *args, **options):
+        for name in ('kindergartens', 'users_per_kindergarten', 'batch_size'):
+            if options[name] <= 0:
+                raise CommandError(f'--{name.replace("_", "-")} は1以上を指定してください。')
+        if options['users_per_kindergarten'] < 2:
+            raise CommandError('--users-per-kindergarten は2以上を指定してください (出品者と購入希望者)。')
+        prefix = options['prefix']
+        if Kindergarten.objects.filter(auth_code__startswith=f'{prefix}-').exists():
+            raise CommandError(f'接頭辞「{prefix}」のデータはすでにあります。--prefix を変えてください。')
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            kindergartens, members = self.create_users(prefix)
+            self.categories = list(ProductCategory.objects.order_by('pk').values_list('pk', flat=True))
+            if not self.categories:
+                self.categories = [category.pk for category in ProductCategory.objects.bulk_create(
+                    [ProductCategory(name=name) for name in DEFAULT_CATEGORIES]
+                )]
+        self.log(f'園 {len(kindergartens)} / ユーザー {sum(len(ids) for ids in members)}', started)
+
+        self.image_pool = self.build_image_pool(options['images'])
+        self.log(f'プレースホルダー画像 {len(self.image_pool)}', started)
+
+        # 商品と関連データをバッチごとに作成する (バッチごとにコミットし、メモリ使用量を一定に保つ)
+        totals = {'products': 0, 'images': 0, 'favorites': 0, 'intents': 0, 'comments': 0}
+        remaining = options['products']
+        while remaining > 0:
+            count = min(options['batch_size'], remaining)
+            with transaction.atomic():
+                created = self.create_product_batch(count, kindergartens, members)
+            for key, value in created.items():
+                totals[key] += value
+            remaining -= count
+            self.log(f'商品 {totals["products"]} / {options["products"]}', started)
+
+        # bulk_create ではシグナルが送られず save() も呼ばれないので、後からまとめて作成・集計する
+        # (検索キーは作成時に build_search_key で設定済み)
+        indexed = rebuild_index()
+        self.log('全文検索インデックス: ' + ('FTS5 が使えないためスキップ' if indexed is None else f'{indexed} 件'), started)
+        reconciled = reconcile_product_counters(Product.objects.filter(kindergarten__in=kindergartens))
+        self.log(f'集計用カウンター: {reconciled} 件', started)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'商品 {totals["products"]} 件 (画像 {totals["images"]}, お気に入り {totals["favorites"]}, '
+            f'購入意思表示 {totals["intents"]}, コメント {totals["comments"]}) を作成しました。'
+            f' ({time.perf_counter() - started:.1f} 秒)'
+        ))
+
+    def log(self, message, started):
+        if self.options['verbosity'] >= 1:
+            self.stdout.write(f'[{time.perf_counter() - started:7.1f}s] {message}')
+
+    # --- 園・ユーザー ---
+    def create_users(self, prefix):
+        """園とユーザーを作成し、(園の一覧, 園ごとのユーザーIDのリスト) を返す"""
+        kindergartens = Kindergarten.objects.bulk_create([
+            Kindergarten(
+                name=f'合成データ園 {i}', auth_code=f'{prefix}-{i}', zip_code='100-0001',
+                prefecture='tokyo', address=f'千代田区 {i}',
+            )
+            for i in range(self.options['kindergartens'])
+        ])
+        # パスワードのハッシュ化は1件あたり数百ミリ秒かかるので、1回だけ計算して全員に同じハッシュを設定する
+        password = make_password(self.options['password'])
+        per_kindergarten = self.options['users_per_kindergarten']
+        users = User.objects.bulk_create(
+            [
+                User(
+                    email=f'{prefix}-{k}-{u}@example.com', password=password, kindergarten=kindergarten,
+                    name=f'ユーザー{k}-{u}', display_name=f'ユーザー{k}-{u}' if u % 3 else '',
+                )
+                for k, kindergarten in enumerate(kindergartens)
+                for u in range(per_kindergarten)
+            ],
+            batch_size=self.options['batch_size'],
+        )
+        members = [
+            [user.pk for user in users[k * per_kindergarten:(k + 1) * per_kindergarten]]
+            for k in range(len(kindergartens))
+        ]
+        return kindergartens, members
+
+    # --- プレースホルダー画像 ---
+    def build_image_pool(self, count):
+        """
+        プレースホルダー画像 (JPEG) を count 枚生成して保存し、ProductImage に設定する値のリストを返す
+        商品画像はこの中から選ぶ (内容のハッシュで保存されるので、同じ画像は1ファイルを共有する)
+        """
+        pool = []
+        for i in range(count):
+            image = Image.new('RGB', (800, 600), tuple(self.rng.randrange(256) for _ in range(3)))
+            draw = ImageDraw.Draw(image)
+            for _ in range(6):
+                x, y = self.rng.randrange(700), self.rng.randrange(500)
+                draw.rectangle(
+                    (x, y, x + self.rng.randrange(50, 300), y + self.rng.randrange(50, 300)),
+                    fill=tuple(self.rng.randrange(256) for _ in range(3)),
+                )
+            buffer = BytesIO()
+            image.save(buffer, 'JPEG', quality=80)
+            name = product_image_storage.save(f'product_images/seed-{i}.jpg', ContentFile(buffer.getvalue()))
+            pool.append({
+                'image': name,
+                'renditions': build_renditions(name),
+                **read_image_metadata(buffer),
+            })
+        return pool
+
+    # --- 商品と関連データ ---
+    def pick_users(self, user_ids, exclude, mean):
+        """user_ids から exclude 以外のユーザーを重複なく選ぶ (人数は平均 mean の指数分布。少数の商品に人気が集中する)"""
+        if mean <= 0:
+            return []
+        count = min(int(self.rng.expovariate(1 / mean)), len(user_ids) - 1)
+        picked = self.rng.sample(user_ids, count + 1)
+        return [user_id for user_id in picked if user_id != exclude][:count]
+
+    def create_product_batch(self, count, kindergartens, members):
+        """商品 count 件と、その画像・お気に入り・購入意思表示・コメントを作成し、作成数を返す"""
+        rng, options = self.rng, self.options
+        products, plans = [], []
+        for _ in range(count):
+            k = rng.randrange(len(kindergartens))
+            seller_id = rng.choice(members[k])
+            favorite_user_ids = self.pick_users(members[k], seller_id, options['favorites'])
+            intent_user_ids = self.pick_users(members[k], seller_id, options['intents'])
+            commenter_ids = self.pick_users(members[k], None, options['comments'])
+
+            # 購入意思表示がある商品の一部は、最初の意思表示者と取引中・売却済にする
+            status, negotiating_user_id = Product.Status.FOR_SALE, None
+            if intent_user_ids:
+                roll = rng.random()
+                if roll < IN_TRANSACTION_RATE:
+                    status, negotiating_user_id = Product.Status.IN_TRANSACTION, intent_user_ids[0]
+                elif roll < IN_TRANSACTION_RATE + SOLD_RATE:
+                    status, negotiating_user_id = Product.Status.SOLD, intent_user_ids[0]
+
+            name = f'{rng.choice(ITEM_COLORS)}の{rng.choice(ITEM_NAMES)}'
+            description = ''.join(rng.sample(DESCRIPTIONS, rng.randint(0, 3)))
+            products.append(Product(
+                user_id=seller_id, kindergarten=kindergartens[k], product_category_id=rng.choice(self.categories),
+                name=name, description=description, price=rng.randrange(100, 5000, 50),
+                size=rng.choice(Product.Size.values), condition=rng.choice(Product.Condition.values),
+                status=status, negotiating_user_id=negotiating_user_id,
+                search_key=build_search_key(name, description),
+            ))
+            plans.append((seller_id, favorite_user_ids, intent_user_ids, commenter_ids))
+
+        batch_size = options['batch_size']
+        Product.objects.bulk_create(products, batch_size=batch_size)
+
+        images = []
+        if self.image_pool:
+            for product in products:
+                for order in range(rng.randint(0, MAX_SUB_IMAGES) + 1): # メイン画像 (display_order=0) + サブ画像
+                    images.append(ProductImage(product=product, display_order=order, **rng.choice(self.image_pool)))
+            ProductImage.objects.bulk_create(images, batch_size=batch_size)
+            # メイン画像の設定は商品ごとの UPDATE ではなく、バッチ全体を1回の UPDATE で行う
+            Product.objects.filter(pk__in=[product.pk for product in products]).update(
+                main_product_image=Subquery(
+                    ProductImage.objects.filter(product=OuterRef('pk'), display_order=0).values('pk')[:1]
+                ),
+            )
+
+        favorites, intents, comments = [], [], []
+        for product, (seller_id, favorite_user_ids, intent_user_ids, commenter_ids) in zip(products, plans):
+            favorites += [Favorite(user_id=user_id, product=product) for user_id in favorite_user_ids]
+            # bulk_create では PurchaseIntent.save() が呼ばれないので、出品者 (非正規化) をここで設定する
+            intents += [
+                PurchaseIntent(user_id=user_id, product=product, seller_id=seller_id) for user_id in intent_user_ids
+            ]
+            comments += [
+                Comment(user_id=user_id, product=product, content=rng.choice(COMMENTS)) for user_id in commenter_ids
+            ]
+        Favorite.objects.bulk_create(favorites, batch_size=batch_size)
+        PurchaseIntent.objects.bulk_create(intents, batch_size=batch_size)
+        Comment.objects.bulk_create(comments, batch_size=batch_size)
+
+        return {
+            'products': len(products), 'images': len(images),
+            'favorites': len(favorites), 'intents': len(intents), 'comments': len(comments),
+        }
@@ -0,0 +1,185 @@
+# products/media_gc.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.db.models import F
+
+from .models import FileTombstone, ProductImage
+from .renditions import rendition_file_names
+from .storage import STAGING_DIR, product_image_storage
+
+logger = logging.getLogger(__name__)
+
+# ファイル削除を並行して行うスレッド数 (ディスク・ネットワークストレージの待ち時間を重ねる)
+DELETE_WORKERS = 8
+# この回数失敗した削除待ちファイルは再試行しない (管理画面・ログで確認する)
+MAX_ATTEMPTS = 5
+
+
+def _storage_for(name, source):
+    # 元画像は商品画像のストレージ、レンディションは default_storage に保存されている
+    return product_image_storage if name == source else default_storage
+
+
+def _file_identity(storage, name):
+    """ファイルが書き直されていないかを比べるための (inode, 更新日時)。ファイルがない場合は None"""
+    try:
+        stat = os.stat(storage.path(name))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _delete_file(name, source, identity):
+    """
+    参照の確認前に記録した identity から変わっていなければファイルを削除する
+    確認 → 削除 の間に同じ内容の画像が再アップロードされると promote が同じロックの中でファイルを書き直すので、
+    ロックを取ってから比べ直し、変わっていれば削除しない
+    戻り値: 削除した (すでにない場合も含む) 場合は None、残した場合は False、失敗した場合は例外
+    """
+    storage = _storage_for(name, source)
+    try:
+        with product_image_storage.lock(source):
+            if _file_identity(storage, name) != identity:
+                return False
+            storage.delete(name)
+    except OSError as e:
+        return e
+    return None
+
+
+# --- 削除待ちファイルの削除 ---
+def reap_file_tombstones(batch_size=500, workers=DELETE_WORKERS, max_attempts=MAX_ATTEMPTS):
+    """
+    削除待ちファイル (FileTombstone) を最大 batch_size 件削除する
+    元画像がまた参照されている (同じ内容の画像が再アップロードされた) ものはファイルを残して登録だけ消す
+    戻り値: (削除数, 参照ありで残した数, 失敗数)
+    """
+    tombstones = list(
+        FileTombstone.objects.filter(attempts__lt=max_attempts)
+        .order_by('pk').values_list('pk', 'name', 'source')[:batch_size]
+    )
+    if not tombstones:
+        return 0, 0, 0
+
+    # ファイルの状態は参照の確認より前に記録する (確認の後に書き直されたものを削除時に検出するため)
+    identities = {pk: _file_identity(_storage_for(name, source), name) for pk, name, source in tombstones}
+    # 参照数の確認はバッチ内の元画像ごとに1回のクエリで行う
+    sources = {source for _, _, source in tombstones}
+    referenced = set(ProductImage.objects.filter(image__in=sources).values_list('image', flat=True))
+
+    kept = [pk for pk, _, source in tombstones if source in referenced]
+    targets = [(pk, name, source) for pk, name, source in tombstones if source not in referenced]
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='tombstone-reaper') as executor:
+        results = list(executor.map(
+            lambda target: _delete_file(target[1], target[2], identities[target[0]]), targets,
+        ))
+
+    # 確認の後に書き直されたファイルは、再アップロードした画像が参照しているので残す
+    kept += [pk for (pk, _, _), result in zip(targets, results) if result is False]
+    done = kept + [pk for (pk, _, _), result in zip(targets, results) if result is None]
+    failed = [(pk, name, result) for (pk, name, _), result in zip(targets, results) if isinstance(result, Exception)]
+    FileTombstone.objects.filter(pk__in=done).delete()
+    for pk, name, error in failed:
+        logger.warning(f"Failed to delete file: {name}, Error: {error}")
+        FileTombstone.objects.filter(pk=pk).update(attempts=F('attempts') + 1, last_error=str(error))
+
+    return len(done) - len(kept), len(kept), len(failed)
+
+
+# --- 参照されていないファイルの回収 ---
+def referenced_file_names():
+    """ProductImage から参照されている元画像・レンディションのファイル名の集合"""
+    names = set()
+    for name, renditions in ProductImage.objects.exclude(image='').values_list('image', 'renditions').iterator():
+        names.add(name)
+        names.update(rendition_file_names(renditions))
+    return names
+
+
+def _scan(root, relative_dir):
+    """relative_dir 以下のファイルを (MEDIA_ROOT からの相対パス, 更新日時) で返す"""
+    files = []
+    for directory, _, filenames in os.walk(os.path.join(root, relative_dir)):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            files.append((os.path.relpath(path, root).replace('\\', '/'), mtime))
+    return files
+
+
+def find_orphan_files(directory='product_images', min_age=3600, staging_age=24 * 3600, workers=DELETE_WORKERS):
+    """
+    MEDIA_ROOT/directory 以下で、どの ProductImage からも参照されていないファイル名の一覧を返す
+    直下のディレクトリ (ハッシュの先頭で分けたもの) ごとに並行して走査する
+    作成・アップロード中のファイルを消さないよう、min_age 秒以内に更新されたファイルは対象外にする
+    一時領域 (MEDIA_ROOT/.staging) のファイルは、コミットされずに残ったものとして staging_age 秒を過ぎたら対象にする
+    """
+    root = product_image_storage.location
+    base = os.path.join(root, directory)
+    if not os.path.isdir(base):
+        return []
+
+    top_files, subdirs = [], [STAGING_DIR]
+    with os.scandir(base) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(os.path.join(directory, entry.name))
+            elif entry.is_file():
+                top_files.append((f'{directory}/{entry.name}', entry.stat().st_mtime))
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='media-gc') as executor:
+        scanned = executor.map(lambda subdir: _scan(root, subdir), subdirs)
+        files = top_files + [file for result in scanned for file in result]
+
+    # 走査後に参照を読み込む (走査中に登録された画像を孤立ファイルと誤判定しないため)
+    referenced = referenced_file_names()
+    now = time.time()
+    staging_prefix = f'{STAGING_DIR}/'
+    orphans = []
+    for name, mtime in files:
+        if name.startswith(staging_prefix):
+            if now - mtime > staging_age:
+                orphans.append(name)
+        elif name not in referenced and now - mtime > min_age:
+            orphans.append(name)
+    return sorted(orphans)
+
+
+def _delete_orphan(name, min_age):
+    """
+    走査の後に書き直されていなければ (min_age 秒より古いままなら) ファイルを削除する
+    同じ内容の画像が再アップロードされると promote が同じロックの中でファイルを新しいもので置き換えるため、
+    ロックを取ってから更新日時を確認し直す
+    戻り値: 削除した (すでにない場合も含む) 場合は None、残した場合は False、失敗した場合は例外
+    """
+    try:
+        with product_image_storage.lock(name):
+            try:
+                mtime = os.stat(product_image_storage.path(name)).st_mtime
+            except FileNotFoundError:
+                return None
+            if not name.startswith(f'{STAGING_DIR}/') and time.time() - mtime <= min_age:
+                return False
+            product_image_storage.delete(name)
+    except OSError as e:
+        return e
+    return None
+
+
+def delete_files(names, workers=DELETE_WORKERS, min_age=3600):
+    """ファイルを並行して削除し、(削除数, 失敗数) を返す (走査後に書き直されたファイルは残す)"""
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='media-gc') as executor:
+        results = list(executor.map(lambda name: _delete_orphan(name, min_age), names))
+    for name, result in zip(names, results):
+        if result is False:
+            logger.info(f"Orphan file was rewritten after the scan, kept: {name}")
+        elif result is not None:
+            logger.warning(f"Failed to delete orphan file: {name}, Error: {result}")
+    failed = sum(isinstance(result, Exception) for result in results)
+    return sum(result is None for result in results), failed
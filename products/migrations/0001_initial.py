@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('kindergartens', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='カテゴリ名')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': 'カテゴリ',
+                'verbose_name_plural': 'カテゴリ',
+                'db_table': 'product_categories',
+            },
+        ),
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='商品名')),
+                ('price', models.PositiveIntegerField(verbose_name='価格')),
+                ('size', models.IntegerField(choices=[(0, '選択しない'), (80, '80'), (90, '90'), (100, '100'), (110, '110'), (120, '120'), (130, '130'), (140, '140'), (141, '140以上'), (201, 'S'), (202, 'M'), (203, 'L'), (999, 'Free')], default=0, verbose_name='サイズ')),
+                ('condition', models.IntegerField(choices=[(1, '新品、未使用'), (2, '未使用に近い'), (3, '目立った傷や汚れなし'), (4, 'やや傷や汚れあり'), (5, '全体的に状態が悪い')], default=3, verbose_name='商品の状態')),
+                ('description', models.TextField(blank=True, max_length=500, verbose_name='商品説明')),
+                ('status', models.IntegerField(choices=[(1, '販売中'), (2, '取引中'), (3, '売却済')], default=1, verbose_name='ステータス')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='出品日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('kindergarten', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='products', to='kindergartens.kindergarten', verbose_name='関連園')),
+                ('negotiating_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='negotiating_products', to=settings.AUTH_USER_MODEL, verbose_name='取引相手')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to=settings.AUTH_USER_MODEL, verbose_name='出品者')),
+                ('product_category', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='products', to='products.productcategory', verbose_name='カテゴリ')),
+            ],
+            options={
+                'verbose_name': '商品',
+                'verbose_name_plural': '商品',
+                'db_table': 'products',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='product_images/', verbose_name='画像ファイル')),
+                ('display_order', models.IntegerField(default=0, help_text='数字が小さいほど先に表示されます。', verbose_name='表示順')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '商品画像',
+                'verbose_name_plural': '商品画像',
+                'db_table': 'product_images',
+                'ordering': ['product', 'display_order'],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_product_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productimage', verbose_name='メイン画像'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['kindergarten', 'status', '-created_at', '-id'], name='products_kg_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='products_user_created_idx'),
+        ),
+    ]
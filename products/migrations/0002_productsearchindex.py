@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:59
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+# --- インデックスに格納する文字列 (このマイグレーション作成時点の products.search の固定コピー) ---
+# アプリのコードを import すると、後の変更でこのマイグレーションの結果が変わってしまうため複製している
+# (正規化は 0003 で追加され、0003 がインデックスを作り直す)
+_SEGMENT_RE = re.compile(r'[^\W_]+')
+
+
+def _to_search_document(text):
+    """bi-gram (各セグメントの末尾1文字を含む) を空白区切りにしたもの"""
+    tokens = []
+    for segment in _SEGMENT_RE.findall(text or ''):
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        tokens.append(segment[-1])
+    return ' '.join(tokens)
+
+
+def create_fts_table(apps, schema_editor):
+    """SQLite (FTS5 対応) の場合のみ全文検索用の仮想テーブルを作成し、既存の商品を登録する"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE products_fts USING fts5(name, description, tokenize='unicode61')"
+        )
+    except OperationalError:
+        # FTS5 が組み込まれていない SQLite では icontains 検索にフォールバックする
+        return
+
+    Product = apps.get_model('products', 'Product')
+    for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator():
+        schema_editor.execute(
+            'INSERT INTO products_fts (rowid, name, description) VALUES (%s, %s, %s)',
+            [pk, _to_search_document(name), _to_search_document(description)],
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS products_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='products.product')),
+                ('name', models.TextField(verbose_name='商品名 (n-gram)')),
+                ('description', models.TextField(verbose_name='商品説明 (n-gram)')),
+                ('document', models.TextField(db_column='products_fts', editable=False)),
+            ],
+            options={
+                'db_table': 'products_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
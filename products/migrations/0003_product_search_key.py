@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:00
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# --- 検索用テキストの変換 (このマイグレーション作成時点の products.normalizers / products.search の固定コピー) ---
+# アプリのコードを import すると、後の変更でこのマイグレーションの結果が変わってしまうため複製している
+_KANA_OFFSET = ord('ァ') - ord('ぁ')
+_KATAKANA_TO_HIRAGANA = {code: code - _KANA_OFFSET for code in range(ord('ァ'), ord('ヶ') + 1)}
+_WHITESPACE_RE = re.compile(r'\s+')
+_SEGMENT_RE = re.compile(r'[^\W_]+')
+
+
+def _normalize_search_text(text):
+    """NFKC 正規化・casefold・カタカナをひらがなに統一・空白をまとめる"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = text.translate(_KATAKANA_TO_HIRAGANA)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def _to_search_document(text):
+    """正規化したテキストの bi-gram (各セグメントの末尾1文字を含む) を空白区切りにしたもの"""
+    tokens = []
+    for segment in _SEGMENT_RE.findall(_normalize_search_text(text)):
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        tokens.append(segment[-1])
+    return ' '.join(tokens)
+
+
+def _build_search_key(name, description):
+    """商品名と商品説明から検索キーを作成する"""
+    return _normalize_search_text(f'{name or ""} {description or ""}')
+
+
+def backfill_search_keys(apps, schema_editor):
+    """既存商品の検索キーを作成し、全文検索インデックスも正規化済みのテキストで作り直す"""
+    Product = apps.get_model('products', 'Product')
+    products = list(Product.objects.only('pk', 'name', 'description'))
+    for product in products:
+        product.search_key = _build_search_key(product.name, product.description)
+    Product.objects.bulk_update(products, ['search_key'], batch_size=500)
+
+    connection = schema_editor.connection
+    if 'products_fts' in connection.introspection.table_names():
+        schema_editor.execute('DELETE FROM products_fts')
+        for product in products:
+            schema_editor.execute(
+                'INSERT INTO products_fts (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, _to_search_document(product.name), _to_search_document(product.description)],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_productsearchindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_key',
+            field=models.TextField(blank=True, default='', editable=False, help_text='商品名・商品説明を NFKC 正規化し、カタカナをひらがなに統一したもの', verbose_name='検索キー'),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:05
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_subquery(model):
+    """商品ごとの件数を返す相関サブクエリ (interactions.counters の固定コピー。アプリのコードの変更に影響されないように複製)"""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(product=OuterRef('pk'))
+            .order_by().values('product')
+            .annotate(count=Count('pk')).values('count'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    """既存商品のカウンターを実データから集計する"""
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(
+        favorite_count=_count_subquery(apps.get_model('interactions', 'Favorite')),
+        purchase_intent_count=_count_subquery(apps.get_model('interactions', 'PurchaseIntent')),
+        comment_count=_count_subquery(apps.get_model('interactions', 'Comment')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_key'),
+        ('interactions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='コメント数'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='お気に入り数'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='purchase_intent_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='購入意思表示数'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:13
+
+import products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_productimage_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=products.storage.ContentAddressedStorage(), upload_to='product_images/', verbose_name='画像ファイル'),
+        ),
+    ]
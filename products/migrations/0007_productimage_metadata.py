@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productimage_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='bytes',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='ファイルサイズ (byte)'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='高さ (px)'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='lqip',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='ぼかしプレースホルダー (data URI)'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='幅 (px)'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productimage_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='ファイル名')),
+                ('source', models.CharField(max_length=255, verbose_name='元画像のファイル名')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='削除試行回数')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='最後のエラー')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='登録日時')),
+            ],
+            options={
+                'verbose_name': '削除待ちファイル',
+                'verbose_name_plural': '削除待ちファイル',
+                'db_table': 'product_file_tombstones',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_filetombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='rendition_attempts',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='レンディション作成の失敗回数'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='rendition_error',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='レンディション作成の最後のエラー'),
+        ),
+    ]
@@ -2,6 +2,10 @@ from django.db import models
 from django.conf import settings # AUTH_USER_MODEL を参照するために必要
 from django.utils import timezone
 
+from .normalizers import build_search_key
+from .storage import product_image_storage
+from .uploads import read_image_metadata
+
 # accountsアプリのKindergartenモデルをインポート
 try:
     from accounts.models import Kindergarten
@@ -45,13 +49,25 @@ class ProductImage(models.Model):
     )
     image = models.ImageField(
         '画像ファイル',
-        upload_to='product_images/' # 画像ファイルのアップロード先ディレクトリ
+        upload_to='product_images/', # 画像ファイルのアップロード先ディレクトリ
+        storage=product_image_storage, # 内容のハッシュで保存し、同じ画像は1つのファイルを共有する
+        db_index=True, # ファイルの参照数を数えるため
     )
     display_order = models.IntegerField(
         '表示順',
         default=0,
         help_text='数字が小さいほど先に表示されます。'
     )
+    # 表示サイズごとの縮小画像 (JPEG / WebP) の情報。products.renditions で作成する
+    renditions = models.JSONField('レンディション', default=dict, blank=True, editable=False)
+    # 画像の情報 (アップロード時に記録し、表示時にファイルを開かなくて済むようにする)
+    width = models.PositiveIntegerField('幅 (px)', null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField('高さ (px)', null=True, blank=True, editable=False)
+    bytes = models.PositiveIntegerField('ファイルサイズ (byte)', null=True, blank=True, editable=False)
+    lqip = models.TextField('ぼかしプレースホルダー (data URI)', blank=True, default='', editable=False)
+    # レンディションの作成に失敗した回数と最後のエラー (backfill_renditions が再試行する。成功したら 0 に戻す)
+    rendition_attempts = models.PositiveSmallIntegerField('レンディション作成の失敗回数', default=0, editable=False)
+    rendition_error = models.TextField('レンディション作成の最後のエラー', blank=True, default='', editable=False)
     created_at = models.DateTimeField('登録日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
@@ -62,7 +78,83 @@ class ProductImage(models.Model):
         ordering = ['product','display_order']
 
     def __str__(self):
-        return f'{self.product.name} - 画像{self.id}'
+        # 商品名を参照すると画像ごとに商品を取得するクエリが発行されるので、商品IDで表示する
+        return f'商品{self.product_id} - 画像{self.id}'
+
+    def save(self, *args, **kwargs):
+        # 新しいファイルが設定された場合は、保存前に幅・高さ・バイト数・プレースホルダーを記録する
+        if self.image and not self.image._committed:
+            metadata = getattr(self.image.file, 'image_metadata', None) or read_image_metadata(self.image.file)
+            # 差し替え前の画像のレンディション作成の失敗は引き継がない
+            metadata = {**metadata, 'rendition_attempts': 0, 'rendition_error': ''}
+            for field, value in metadata.items():
+                setattr(self, field, value)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], *metadata}
+        super().save(*args, **kwargs)
+
+    @property
+    def file_name(self):
+        """ストレージ上のファイル名 (テンプレートタグ rendition_img で使う)"""
+        return self.image.name
+
+
+# --- 削除待ちファイル (トゥームストーン) ---
+class FileTombstone(models.Model):
+    """
+    削除待ちの商品画像ファイル
+    リクエスト中はファイルを消さずにここへ登録し、reap_file_tombstones コマンドがまとめて削除する
+    """
+    name = models.CharField('ファイル名', max_length=255)
+    # 削除してよいかを判断する元画像のファイル名 (この画像を参照する ProductImage があれば削除しない)
+    source = models.CharField('元画像のファイル名', max_length=255)
+    attempts = models.PositiveIntegerField('削除試行回数', default=0)
+    last_error = models.TextField('最後のエラー', blank=True, default='')
+    created_at = models.DateTimeField('登録日時', auto_now_add=True)
+
+    class Meta:
+        db_table = 'product_file_tombstones'
+        verbose_name = '削除待ちファイル'
+        verbose_name_plural = '削除待ちファイル'
+
+    def __str__(self):
+        return self.name
+
+# --- 商品クエリセット ---
+class ProductQuerySet(models.QuerySet):
+
+    def adjust_counter(self, pk, field, delta):
+        """
+        集計用カウンター (favorite_count など) を F() 式で増減する (読み込みなしの UPDATE 1回)
+        減算で 0 未満にならないよう、現在値が足りない場合は更新しない。更新件数を返す
+        """
+        queryset = self.filter(pk=pk)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        return queryset.update(**{field: models.F(field) + delta})
+
+    # --- 取引ステータスの遷移 (販売中 → 取引中 → 売却済) ---
+    # 現在のステータスを条件にした UPDATE 1回で遷移させ、更新件数 (0 または 1) を返す
+    # 読み込み → 判定 → 保存 の間に他のリクエストが割り込めないため、同時に押されても1つだけが成功する
+    # queryset.update は post_save を送らないので、呼び出し側で一覧のキャッシュを無効化すること
+
+    def start_transaction(self, pk, buyer_id):
+        """販売中で取引相手がいない商品を、購入意思表示をしているユーザーとの取引中にする"""
+        return self.filter(
+            pk=pk,
+            status=Product.Status.FOR_SALE,
+            negotiating_user__isnull=True,
+            purchase_intended_by__user_id=buyer_id, # 購入意思表示が取り消されていないこと
+        ).update(
+            status=Product.Status.IN_TRANSACTION, negotiating_user_id=buyer_id, updated_at=timezone.now(),
+        )
+
+    def complete_transaction(self, pk, buyer_id):
+        """buyer と取引中の商品を売却済にする (取引相手はそのまま残す)"""
+        return self.filter(
+            pk=pk, status=Product.Status.IN_TRANSACTION, negotiating_user_id=buyer_id,
+        ).update(status=Product.Status.SOLD, updated_at=timezone.now())
+
 
 # --- 商品モデル ---
 class Product(models.Model):
@@ -155,40 +247,98 @@ class Product(models.Model):
         blank=True,                # 空欄許可
         editable=False             # ビューで設定するので編集不可を推奨
     )
+    # --- 集計用カウンター (非正規化) ---
+    # interactions のビューで F() 式により更新し、reconcile_product_counters コマンドで再集計する
+    favorite_count = models.PositiveIntegerField('お気に入り数', default=0, editable=False)
+    purchase_intent_count = models.PositiveIntegerField('購入意思表示数', default=0, editable=False)
+    comment_count = models.PositiveIntegerField('コメント数', default=0, editable=False)
+    # 部分一致 (LIKE '%…%') でしか検索しないので、B-tree のインデックスは作らない (使われず、書き込みが遅くなるだけ)
+    search_key = models.TextField(
+        '検索キー',
+        blank=True,
+        default='',
+        editable=False, # 保存時に商品名・商品説明から自動生成する
+        help_text='商品名・商品説明を NFKC 正規化し、カタカナをひらがなに統一したもの'
+    )
     created_at = models.DateTimeField('出品日時', auto_now_add=True)
     updated_at = models.DateTimeField('更新日時', auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         db_table = 'products'
         verbose_name = '商品'
         verbose_name_plural = '商品'
         ordering = ['-created_at'] # 新しい順に並べるのをデフォルトにする (任意)
+        indexes = [
+            # 商品一覧: 園 + ステータスで絞り込み、新しい順 (id はカーソルページネーションのタイブレーク)
+            models.Index(
+                fields=['kindergarten', 'status', '-created_at', '-id'],
+                name='products_kg_status_created_idx',
+            ),
+            # 出品した商品一覧: ユーザーで絞り込み、新しい順 (id はカーソルページネーションのタイブレーク)
+            models.Index(fields=['user', '-created_at', '-id'], name='products_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} (¥{self.price}) {self.size} / {self.product_category} / {self.condition}'
 
+    def save(self, *args, **kwargs):
+        # 検索キーを商品名・商品説明から生成する
+        self.search_key = build_search_key(self.name, self.description)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'description'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'search_key'}
+        super().save(*args, **kwargs)
+
+    def get_sub_images(self):
+        """
+        サブ画像 (メイン画像以外、display_order が 1 以上) を表示順のリストで取得する
+        prefetch_related('images') 済みの場合はクエリを発行せずにキャッシュから取り出す
+        """
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            # メイン画像は display_order=0 と仮定
+            return sorted(
+                (img for img in self.images.all() if img.display_order > 0),
+                key=lambda img: img.display_order,
+            )
+        return list(self.images.filter(display_order__gt=0).order_by('display_order'))
+
     def get_sub_image_by_display_order(self, order):
         """指定された display_order のサブ画像 (メイン画像以外) を取得する。なければ None を返す。"""
-        try:
-            # メイン画像は display_order=0 と仮定
-            if order == 0: # display_order=0 はメイン画像なので除外
-                return None
-            return self.images.get(display_order=order)
-        except ProductImage.DoesNotExist:
-            return None
+        for img in self.get_sub_images():
+            if img.display_order == order:
+                return img
+        return None
 
     def get_sub_images_as_dict(self):
         """サブ画像を display_order をキーとした辞書として取得する (1, 2, 3)"""
-        sub_images_dict = {}
-        # メイン画像を除外し、display_order が 1, 2, 3 のものを対象とする
-        images = self.images.filter(display_order__in=[1, 2, 3]).order_by('display_order')
-        for img in images:
-            sub_images_dict[img.display_order] = img
-        
         # 存在しない display_order のキーも None で埋めておく (テンプレートでの扱いを容易にするため)
-        for i in range(1, 4): # 1, 2, 3
-            if i not in sub_images_dict:
-                sub_images_dict[i] = None
+        sub_images_dict = {i: None for i in range(1, 4)} # 1, 2, 3
+        for img in self.get_sub_images():
+            if img.display_order in sub_images_dict:
+                sub_images_dict[img.display_order] = img
         return sub_images_dict
 
 
+# --- 商品キーワード検索用インデックス (SQLite FTS5) ---
+class ProductSearchIndex(models.Model):
+    """
+    商品名・商品説明の全文検索用インデックス (FTS5 仮想テーブル)
+    テーブルはマイグレーションで SQLite の場合のみ作成し、内容は products.signals で同期する
+    """
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.DO_NOTHING, # 削除時の同期はシグナルで行う
+        primary_key=True,
+        db_column='rowid', # FTS5 の rowid = 商品ID
+        related_name='search_index',
+    )
+    name = models.TextField('商品名 (n-gram)')
+    description = models.TextField('商品説明 (n-gram)')
+    # FTS5 のテーブル名と同名の隠しカラム (MATCH / bm25() の対象)
+    document = models.TextField(db_column='products_fts', editable=False)
+
+    class Meta:
+        managed = False
+        db_table = 'products_fts'
@@ -0,0 +1,30 @@
+# products/normalizers.py
+import re
+import unicodedata
+
+# カタカナ (ァ〜ヶ) とひらがな (ぁ〜ゖ) のコードポイントの差
+KANA_OFFSET = ord('ァ') - ord('ぁ')
+KATAKANA_TO_HIRAGANA = {code: code - KANA_OFFSET for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_search_text(text):
+    """
+    検索用にテキストを正規化する
+    1. NFKC 正規化 (半角カナ→全角カナ、全角英数字→半角英数字 など)
+    2. 大文字・小文字の統一 (casefold)
+    3. カタカナをひらがなに統一
+    4. 連続する空白を1つにまとめる
+    例: 'ｾｲﾌｸ　１２０' -> 'せいふく 120'
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = text.translate(KATAKANA_TO_HIRAGANA)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+
+def build_search_key(name, description):
+    """商品名と商品説明から検索キー (Product.search_key) を作成する"""
+    return normalize_search_text(f'{name or ""} {description or ""}')
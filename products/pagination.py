@@ -0,0 +1,132 @@
+# products/pagination.py
+from datetime import datetime
+
+from django.core import signing
+from django.db.models import Q
+
+# カーソルトークンの署名に使うソルト (他用途の署名と混ざらないように固定値を指定)
+CURSOR_SALT = 'products.pagination.cursor'
+# マイページの履歴一覧 (お気に入り・購入意思表示・出品した商品) の1ページあたりの件数
+HISTORY_PER_PAGE = 20
+
+
+class InvalidCursor(Exception):
+    """改ざん・破損したカーソルトークンを受け取った場合の例外"""
+
+
+class CursorPage:
+    """カーソルページネーションの1ページ分の結果"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    (日時フィールド, pk) の降順をキーにしたカーソルページネーション
+    OFFSET や COUNT を使わず、WHERE 条件 + LIMIT (per_page + 1件) だけでページを取得する
+    """
+
+    def __init__(self, queryset, per_page, field='created_at', row_factory=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+        # 取得した行をページに載せる前に変換する関数 (例: ProductCard.from_row)
+        self.row_factory = row_factory
+
+    # --- トークンのエンコード / デコード ---
+    def encode_cursor(self, obj, direction):
+        """オブジェクトの (日時, pk) と向き ('n': 次へ, 'p': 前へ) を署名付きの不透明なトークンにする"""
+        if isinstance(obj, dict):
+            # .values() の行
+            value, pk = obj[self.field], obj.get('pk', obj.get('id'))
+        else:
+            value, pk = getattr(obj, self.field), obj.pk
+        return signing.dumps([direction, value.isoformat(), pk], salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, token):
+        try:
+            direction, value, pk = signing.loads(token, salt=CURSOR_SALT)
+            if direction not in ('n', 'p'):
+                raise ValueError(direction)
+            return direction, datetime.fromisoformat(value), int(pk)
+        except (signing.BadSignature, ValueError, TypeError) as e:
+            raise InvalidCursor(token) from e
+
+    def _decode_or_first(self, token):
+        """トークンを (向き, 日時, pk) にする。空・不正の場合は先頭ページ (None, None, None)"""
+        if token:
+            try:
+                return self.decode_cursor(token)
+            except InvalidCursor:
+                pass
+        return None, None, None
+
+    # --- ページ取得 ---
+    def page_queryset(self, token=None):
+        """
+        page(token) が実行するクエリ (1ページ分 + 1件) を返す (check_query_plans で実行計画の確認に使う)
+        トークンが空・不正の場合は先頭ページのクエリを返す
+        """
+        direction, value, pk = self._decode_or_first(token)
+        if direction == 'p':
+            # 前のページ: キーより新しいものを昇順で取得する (表示用の反転は page で行う)
+            return self.queryset.filter(
+                Q(**{f'{self.field}__gt': value}) | Q(**{self.field: value, 'pk__gt': pk})
+            ).order_by(self.field, 'pk')[:self.per_page + 1]
+
+        queryset = self.queryset
+        if direction == 'n':
+            # 次のページ: キーより古いものを降順で取得
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'pk__lt': pk})
+            )
+        return queryset.order_by(f'-{self.field}', '-pk')[:self.per_page + 1]
+
+    def page(self, token=None):
+        """
+        カーソルトークンに対応するページを返す
+        トークンが空・不正の場合は先頭ページを返す
+        """
+        direction = self._decode_or_first(token)[0]
+        rows = list(self.page_queryset(token))
+        if direction == 'p':
+            # 前のページ: 昇順で取得したものを表示用に反転する
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = direction == 'n'
+
+        if not rows:
+            # 範囲外のカーソル (削除などでページが空になった場合)
+            return CursorPage([])
+
+        next_cursor = self.encode_cursor(rows[-1], 'n') if has_next else None
+        previous_cursor = self.encode_cursor(rows[0], 'p') if has_previous else None
+        if self.row_factory is not None:
+            rows = [self.row_factory(row) for row in rows]
+        return CursorPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
@@ -0,0 +1,244 @@
+# products/renditions.py
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import F
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# レンディション (表示サイズごとの縮小画像) の種類と横幅 (px)
+RENDITION_WIDTHS = {
+    'card': 400,    # 一覧のカード
+    'detail': 1000, # 商品詳細
+    'zoom': 2000,   # 拡大表示
+}
+# 出力形式ごとの拡張子と保存オプション
+RENDITION_FORMATS = {
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+}
+# レンディションを置くディレクトリ (元画像のディレクトリからの相対パス)
+RENDITION_DIR = 'renditions'
+# この回数作成に失敗した画像は backfill_renditions で再試行しない (管理画面・ログで確認する)
+MAX_RENDITION_ATTEMPTS = 5
+
+
+# --- 生成 (ワーカープロセスで実行) ---
+def to_rgb(image):
+    """透過画像は白背景に合成し、JPEG / WebP で保存できる RGB に変換する"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def rendition_name(source_name, preset, extension):
+    """元画像のパスからレンディションのパスを作る (例: product_images/renditions/abc_card.webp)"""
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, RENDITION_DIR, f'{stem}_{preset}.{extension}')
+
+
+def build_renditions(source_name):
+    """
+    元画像からすべてのレンディションを作成してストレージに保存し、その情報を返す
+    DB には触れないのでワーカープロセスで実行できる
+    戻り値: {'source': 元画像のパス, 'card': {'width', 'height', 'jpeg', 'webp'}, ...}
+    """
+    from .storage import product_image_storage
+
+    with product_image_storage.open(source_name, 'rb') as f:
+        image = Image.open(f)
+        # JPEG は draft モードで必要な大きさに近い縮小率でデコードする (大きな写真の読み込みが速くなる)
+        largest = max(RENDITION_WIDTHS.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = to_rgb(image)
+
+    renditions = {'source': source_name}
+    # 大きいサイズから順に縮小し、次のサイズは縮小済みの画像から作る
+    for preset, width in sorted(RENDITION_WIDTHS.items(), key=lambda item: -item[1]):
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        entry = {'width': image.width, 'height': image.height}
+        for fmt, (extension, options) in RENDITION_FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, fmt.upper(), **options)
+            name = rendition_name(source_name, preset, extension)
+            # 削除待ちの処理と同時に書き換えないよう、元画像のロックの中で置き換える
+            with product_image_storage.lock(source_name):
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                entry[fmt] = default_storage.save(name, ContentFile(buffer.getvalue()))
+        renditions[preset] = entry
+    return renditions
+
+
+def rendition_file_names(renditions):
+    """レンディション情報に含まれるファイルのパスを返す"""
+    names = set()
+    for preset in RENDITION_WIDTHS:
+        entry = (renditions or {}).get(preset) or {}
+        names.update(entry.get(fmt) for fmt in RENDITION_FORMATS if entry.get(fmt))
+    return names
+
+
+def delete_rendition_files(renditions):
+    """レンディションのファイルを削除する"""
+    for name in rendition_file_names(renditions):
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning(f"Failed to delete rendition file: {name}", exc_info=True)
+
+
+# --- 結果の記録 (親プロセスで実行) ---
+def save_renditions(image_pk, renditions):
+    """
+    作成したレンディションを ProductImage に記録する
+    作成中に画像が差し替え・削除された場合は記録しない
+    (差し替え前の画像のレンディションは storage.release_product_image_file で削除される)
+    """
+    from .cache import bump_kindergarten_version
+    from .models import ProductImage
+
+    source_name = renditions['source']
+    updated = ProductImage.objects.filter(pk=image_pk, image=source_name).update(
+        renditions=renditions, rendition_attempts=0, rendition_error='',
+    )
+    if not updated:
+        # 同じ元画像を使う ProductImage がなければ作成したファイルは不要
+        if not ProductImage.objects.filter(image=source_name).exists():
+            delete_rendition_files(renditions)
+        return False
+    # 一覧キャッシュのカードに新しいレンディションを反映する
+    kindergarten_id = ProductImage.objects.filter(pk=image_pk).values_list('product__kindergarten_id', flat=True).first()
+    bump_kindergarten_version(kindergarten_id)
+    return True
+
+
+def record_rendition_failure(image_pk, error):
+    """レンディションの作成に失敗したことを記録する (backfill_renditions が再試行する)"""
+    from .models import ProductImage
+
+    ProductImage.objects.filter(pk=image_pk).update(
+        rendition_attempts=F('rendition_attempts') + 1, rendition_error=str(error) or type(error).__name__,
+    )
+
+
+def iter_pending_renditions(max_attempts=MAX_RENDITION_ATTEMPTS, force=False):
+    """
+    レンディションが未作成 (元画像と一致しない) の画像を (pk, ファイル名) で返す
+    待ち行列があふれて登録されなかった画像・作成に失敗した画像もここで拾う
+    force: 作成済みのものも含め、すべての画像を返す (失敗回数も無視する)
+    """
+    from .models import ProductImage
+
+    queryset = ProductImage.objects.exclude(image='').order_by('pk')
+    if not force:
+        queryset = queryset.filter(rendition_attempts__lt=max_attempts)
+    for pk, name, renditions in queryset.values_list('pk', 'image', 'renditions').iterator():
+        if force or (renditions or {}).get('source') != name:
+            yield pk, name
+
+
+# --- プロセスプール ---
+_executor = None
+_executor_lock = threading.Lock()
+_pending = None
+
+
+def _init_worker():
+    """ワーカープロセスの初期化 (spawn で起動するため Django の設定を読み込む)"""
+    import django
+    django.setup()
+
+
+def max_workers():
+    return getattr(settings, 'PRODUCT_RENDITION_WORKERS', 2)
+
+
+def create_executor(workers):
+    """
+    レンディション作成用のプロセスプールを作る
+    スレッドを使うサーバーから fork すると安全でないため spawn で起動する
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+    )
+
+
+def _get_executor():
+    global _executor, _pending
+    with _executor_lock:
+        if _executor is None:
+            _executor = create_executor(max_workers())
+        if _pending is None:
+            # 待ち行列の上限 (超えた分は backfill_renditions コマンドで作成する)
+            _pending = threading.BoundedSemaphore(max_workers() * 4)
+        return _executor
+
+
+def _record_failure(image_pk, error):
+    """失敗を記録する (記録にも失敗した場合はログだけ残す。画像は backfill_renditions で拾われる)"""
+    try:
+        record_rendition_failure(image_pk, error)
+    except Exception:
+        logger.error(f"Failed to record rendition failure. ProductImage ID: {image_pk}", exc_info=True)
+
+
+def _on_done(image_pk, future):
+    global _executor
+    _pending.release()
+    try:
+        save_renditions(image_pk, future.result())
+    except BrokenProcessPool as e:
+        # ワーカープロセスが異常終了した場合、次回の登録時にプールを作り直す
+        with _executor_lock:
+            _executor = None
+        logger.error(f"Rendition process pool is broken. ProductImage ID: {image_pk}", exc_info=True)
+        _record_failure(image_pk, e)
+    except Exception as e:
+        logger.error(f"Failed to build renditions. ProductImage ID: {image_pk}", exc_info=True)
+        _record_failure(image_pk, e)
+    finally:
+        # コールバックはプールの管理スレッドで実行され、リクエストの終了処理で接続が閉じられることはない
+        # 接続を残さないよう、このスレッドで開いた接続をここで閉じる
+        connections.close_all()
+
+
+def schedule_renditions(image):
+    """
+    ProductImage のレンディション作成をプロセスプールに登録する
+    PRODUCT_RENDITION_WORKERS = 0 の場合はその場で作成する (開発・テスト用)
+    """
+    image_pk, source_name = image.pk, image.image.name
+    if max_workers() <= 0:
+        try:
+            save_renditions(image_pk, build_renditions(source_name))
+        except Exception as e:
+            logger.error(f"Failed to build renditions. ProductImage ID: {image_pk}", exc_info=True)
+            _record_failure(image_pk, e)
+        return
+
+    executor = _get_executor()
+    if not _pending.acquire(blocking=False):
+        # 登録しなかった画像はレンディション未作成のまま残り、backfill_renditions (iter_pending_renditions) で作成される
+        logger.warning(f"Rendition queue is full, left pending for backfill_renditions. ProductImage ID: {image_pk}")
+        return
+    future = executor.submit(build_renditions, source_name)
+    future.add_done_callback(lambda f: _on_done(image_pk, f))
@@ -0,0 +1,165 @@
+# products/resize_cache.py
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import locks
+from PIL import Image, ImageOps
+
+from .renditions import to_rgb
+from .storage import product_image_storage
+
+logger = logging.getLogger(__name__)
+
+# リサイズを許可する横幅 (任意の幅を受け付けるとキャッシュを溢れさせられるため固定する)
+ALLOWED_WIDTHS = (200, 400, 600, 800, 1000, 1200, 1600, 2000)
+# 出力形式ごとの Content-Type と保存オプション
+OUTPUT_FORMATS = {
+    'webp': ('image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# 単一実行用のロックファイルの数 (キーのハッシュで振り分ける)
+LOCK_STRIPES = 256
+# 追い出しのための容量確認は、前回から予算のこの割合を書き込むごとに行う
+SCAN_INTERVAL_RATIO = 0.05
+# 追い出し後の目標容量 (予算に対する割合)
+EVICT_TARGET_RATIO = 0.9
+
+
+def cache_root():
+    return str(getattr(settings, 'RESIZE_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'var', 'resized')))
+
+
+def cache_max_bytes():
+    return getattr(settings, 'RESIZE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+
+def cache_key(name, width, fmt):
+    """元画像のパス・幅・形式からキャッシュのキーを作る"""
+    return hashlib.sha1(f'{name}|{width}|{fmt}'.encode()).hexdigest()
+
+
+def cache_path(key, fmt):
+    return os.path.join(cache_root(), key[:2], f'{key}.{fmt}')
+
+
+def _render(source_path, width, fmt):
+    """元画像を指定した横幅 (元より大きくはしない) に縮小したバイト列を返す"""
+    with open(source_path, 'rb') as f:
+        image = Image.open(f)
+        image.draft('RGB', (width, width))
+        image = ImageOps.exif_transpose(image)
+        image = to_rgb(image)
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, fmt.upper(), **OUTPUT_FORMATS[fmt][1])
+    return buffer.getvalue()
+
+
+# --- 容量管理 (LRU) ---
+_scan_lock = threading.Lock()
+_written_since_scan = None # None: このプロセスではまだ確認していない
+
+
+def _note_written(size, path):
+    """書き込んだ容量を記録し、一定量ごとに予算を超えていないか確認する (書き込んだファイル path は削除しない)"""
+    global _written_since_scan
+    with _scan_lock:
+        if _written_since_scan is not None:
+            _written_since_scan += size
+            if _written_since_scan < cache_max_bytes() * SCAN_INTERVAL_RATIO:
+                return
+        _written_since_scan = 0
+    evict(keep=(path,))
+
+
+def evict(max_bytes=None, keep=()):
+    """
+    キャッシュの合計容量が予算を超えていれば、最終アクセス (mtime) が古いものから削除する
+    keep のファイルは容量には数えるが削除しない (これから返すファイルを消さないため)
+    削除した容量を返す
+    """
+    max_bytes = cache_max_bytes() if max_bytes is None else max_bytes
+    entries, total = [], 0
+    for directory, _, filenames in os.walk(cache_root()):
+        for filename in filenames:
+            if filename.endswith(('.lock', '.tmp')):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    target = max_bytes * EVICT_TARGET_RATIO
+    for _, size, path in sorted(entries):
+        if total - removed <= target:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+            removed += size
+        except FileNotFoundError:
+            pass
+    logger.info(f"Evicted {removed} bytes from resized image cache (total: {total}, budget: {max_bytes})")
+    return removed
+
+
+# --- 取得 ---
+def get_resized(name, width, fmt):
+    """
+    リサイズ済み画像のキャッシュファイルのパスを返す (なければ作成する)
+    同じキーの作成はロックファイルで直列化し、同時に来たリクエストでも1回だけ作成する
+    """
+    key = cache_key(name, width, fmt)
+    path = cache_path(key, fmt)
+    if os.path.exists(path):
+        # 最終アクセス日時を更新 (LRU の順序に使う)
+        os.utime(path)
+        return path
+
+    source_path = product_image_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_dir = os.path.join(cache_root(), 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, f'{int(key[:8], 16) % LOCK_STRIPES}.lock')
+
+    with open(lock_path, 'a') as lock_file:
+        locks.lock(lock_file, locks.LOCK_EX)
+        try:
+            # ロック待ちの間に他のリクエストが作成していれば、それを使う
+            if os.path.exists(path):
+                return path
+            data = _render(source_path, width, fmt)
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            locks.unlock(lock_file)
+
+    _note_written(len(data), path)
+    return path
+
+
+def nearest_width(width):
+    """指定した幅以上で最も小さい許可済みの幅を返す (超える場合は最大の幅)"""
+    for allowed in ALLOWED_WIDTHS:
+        if allowed >= width:
+            return allowed
+    return ALLOWED_WIDTHS[-1]
+
+
+def etag_for(name, width, fmt, source_mtime):
+    return '"{}"'.format(hashlib.sha1(f'{name}|{width}|{fmt}|{source_mtime}'.encode()).hexdigest())
+
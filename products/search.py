@@ -0,0 +1,197 @@
+# products/search.py
+import re
+
+from django.db import connections, transaction
+from django.db.models import FloatField, Func, Lookup, Q
+
+from .models import Product, ProductSearchIndex
+from .normalizers import normalize_search_text
+
+# 全文検索テーブル名 (ProductSearchIndex.Meta.db_table)
+FTS_TABLE = ProductSearchIndex._meta.db_table
+
+# bm25 の列ごとの重み (name, description の順)。商品名への一致を優先する
+BM25_WEIGHTS = (10.0, 1.0)
+
+# 文字・数字の連続を1セグメントとして扱う (記号・空白・アンダースコアは区切り)
+SEGMENT_RE = re.compile(r'[^\W_]+')
+
+# 接続ごとの FTS テーブル有無のキャッシュ {(alias, NAME): bool}
+_fts_available = {}
+
+
+class Match(Lookup):
+    """FTS5 の MATCH 演算子 (ProductSearchIndex.document に対して使用)"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+# 他の TextField に影響しないよう、隠しカラムのフィールドにだけ登録する
+ProductSearchIndex._meta.get_field('document').register_lookup(Match)
+
+
+class BM25(Func):
+    """FTS5 の bm25() による関連度 (値が小さいほど関連度が高い)"""
+    function = 'bm25'
+    output_field = FloatField()
+
+    def __init__(self, document, weights=BM25_WEIGHTS):
+        super().__init__(document, *[Func(template=str(float(w))) for w in weights])
+
+
+def fts_enabled(using='default'):
+    """全文検索テーブルが利用できるか (SQLite で FTS5 テーブルが作成済みの場合のみ True)"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _fts_available:
+        _fts_available[key] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[key]
+
+
+# --- n-gram 変換 ---
+def to_ngrams(text):
+    """
+    テキストを bi-gram (2文字ずつ) のトークン列に変換する
+    日本語は単語間に空白がないため、分かち書きの代わりに 2-gram で索引を作る
+    1文字のキーワードでも前方一致で検索できるよう、各セグメントの末尾1文字も加える
+    例: '制服 冬' -> ['制服', '服', '冬']
+    """
+    tokens = []
+    for segment in SEGMENT_RE.findall(text or ''):
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        tokens.append(segment[-1])
+    return tokens
+
+
+def to_search_document(text):
+    """インデックスに格納する文字列 (正規化したテキストの n-gram を空白区切りにしたもの)"""
+    return ' '.join(to_ngrams(normalize_search_text(text)))
+
+
+def to_match_query(keyword):
+    """
+    検索キーワードを FTS5 の MATCH クエリに変換する
+    空白区切りの各語を AND で結合し、2文字以上の語は bi-gram のフレーズ、1文字の語は前方一致で検索する
+    検索可能な語がない場合は None を返す
+    """
+    terms = []
+    for segment in SEGMENT_RE.findall(normalize_search_text(keyword)):
+        if len(segment) == 1:
+            terms.append(f'"{segment}"*')
+        else:
+            bigrams = [segment[i:i + 2] for i in range(len(segment) - 1)]
+            terms.append('"' + ' '.join(bigrams) + '"')
+    return ' AND '.join(terms) or None
+
+
+# --- 検索 ---
+def filter_by_keyword(queryset, keyword, ranked=True):
+    """
+    商品名・商品説明のキーワード検索
+    FTS5 が使える場合は全文検索で絞り込み、ranked=True なら関連度 (search_rank) の昇順に並べる
+    使えない場合 (SQLite 以外など) は正規化済みの検索キー (search_key) の部分一致で絞り込む
+    いずれもキーワードは search_key と同じ正規化 (全角/半角・カナの統一) をしてから照合する
+    """
+    match_query = to_match_query(keyword)
+    if match_query and fts_enabled(queryset.db):
+        queryset = queryset.filter(search_index__document__match=match_query)
+        if not ranked:
+            return queryset
+        return queryset.annotate(
+            search_rank=BM25('search_index__document')
+        ).order_by('search_rank', '-created_at', '-id')
+
+    # 空白区切りの各語を AND で検索する
+    condition = Q()
+    for term in normalize_search_text(keyword).split(' '):
+        if term:
+            condition &= Q(search_key__contains=term)
+    return queryset.filter(condition)
+
+
+def apply_search_filters(queryset, cleaned_data, exclude=(), ranked=True):
+    """
+    商品絞り込み検索フォーム (ProductSearchForm) の条件をクエリセットに適用する
+    キーワード、カテゴリ、価格は AND、サイズ・状態はチェックされたもののいずれかに合致 (OR)
+    exclude に指定した条件 ('category', 'size' など) は適用しない (絞り込み件数の集計用)
+    """
+    # --- キーワード検索 ---
+    keyword = cleaned_data.get('keyword')
+    if keyword and 'keyword' not in exclude:
+        queryset = filter_by_keyword(queryset, keyword, ranked=ranked)
+
+    # --- カテゴリ絞り込み ---
+    categories = cleaned_data.get('category')
+    if categories and 'category' not in exclude:
+        queryset = queryset.filter(product_category__in=categories)
+
+    # --- 価格帯絞り込み ---
+    if 'price' not in exclude:
+        price_min = cleaned_data.get('price_min')
+        if price_min is not None: # 0も有効な値なので is not None でチェック
+            queryset = queryset.filter(price__gte=price_min)
+        price_max = cleaned_data.get('price_max')
+        if price_max is not None:
+            queryset = queryset.filter(price__lte=price_max)
+
+    # --- サイズ絞り込み ---
+    sizes = cleaned_data.get('size')
+    if sizes and 'size' not in exclude:
+        queryset = queryset.filter(size__in=sizes)
+
+    # --- 状態絞り込み ---
+    conditions = cleaned_data.get('condition')
+    if conditions and 'condition' not in exclude:
+        queryset = queryset.filter(condition__in=conditions)
+
+    return queryset
+
+
+# --- インデックスの同期 ---
+def update_index(product, using='default', created=False):
+    """商品1件分のインデックスを登録・更新する (created: 新規登録の場合は既存の行の削除を省く)"""
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        if not created:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [product.pk, to_search_document(product.name), to_search_document(product.description)],
+        )
+
+
+def remove_from_index(product_id, using='default'):
+    """商品1件分のインデックスを削除する"""
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index(using='default', batch_size=1000):
+    """全商品のインデックスを作り直す。作成件数を返す (FTS が使えない場合は None)"""
+    if not fts_enabled(using):
+        return None
+    count = 0
+    # 1トランザクションで行う (自動コミットだと1行ごとにコミットされて遅く、作り直し中の空のインデックスも見えてしまう)
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        rows = Product.objects.using(using).order_by('pk').values_list('pk', 'name', 'description')
+        batch = []
+        for pk, name, description in rows.iterator(chunk_size=batch_size):
+            batch.append((pk, to_search_document(name), to_search_document(description)))
+            if len(batch) >= batch_size:
+                cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', batch)
+            count += len(batch)
+    return count
@@ -0,0 +1,70 @@
+# products/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import renditions, search
+from .cache import bump_kindergarten_version_on_commit
+from .models import Product, ProductImage
+from .storage import release_product_image_file
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, using, created=False, update_fields=None, **kwargs):
+    """商品の保存時に全文検索インデックスを更新する"""
+    # 商品名・説明文を含まない部分更新 (例: main_product_image のみ) では更新不要
+    if update_fields is not None and not {'name', 'description'} & set(update_fields):
+        return
+    search.update_index(instance, using=using, created=created)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_search_index(sender, instance, using, **kwargs):
+    """商品の削除時に全文検索インデックスから取り除く"""
+    search.remove_from_index(instance.pk, using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_kindergarten_cache(sender, instance, using, **kwargs):
+    """商品の登録・変更 (ステータス変更を含む)・削除時に、その園のキャッシュ (一覧・絞り込み件数) を無効にする"""
+    bump_kindergarten_version_on_commit(instance.kindergarten_id, using=using)
+
+
+@receiver(pre_save, sender=ProductImage)
+def remember_previous_product_image(sender, instance, using, **kwargs):
+    """画像の差し替えを検出するため、保存前のファイル名とレンディションを覚えておく"""
+    instance._previous_image = None
+    if instance.pk is not None and not instance._state.adding:
+        instance._previous_image = (
+            sender.objects.using(using).filter(pk=instance.pk).values_list('image', 'renditions').first()
+        )
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_product_image_renditions(sender, instance, using, **kwargs):
+    """画像の登録・差し替え時に、コミット後にレンディションの作成を登録する"""
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous[0] != instance.image.name:
+        # 差し替え前のファイルへの参照を解放する
+        release_product_image_file(previous[0], previous[1], using=using)
+
+    if not instance.image or instance.renditions.get('source') == instance.image.name:
+        return
+
+    # 同じ内容の画像のレンディションが作成済みなら、作り直さずにそれを使う
+    shared = (
+        sender.objects.using(using).filter(image=instance.image.name).exclude(pk=instance.pk)
+        .exclude(renditions={}).values_list('renditions', flat=True).first()
+    )
+    if shared and shared.get('source') == instance.image.name:
+        sender.objects.using(using).filter(pk=instance.pk).update(renditions=shared)
+        instance.renditions = shared
+        return
+    transaction.on_commit(lambda: renditions.schedule_renditions(instance), using=using)
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_deleted_product_image(sender, instance, using, **kwargs):
+    """画像の削除時に、ファイルへの参照を解放する (最後の参照ならコミット後にファイルとレンディションを削除)"""
+    release_product_image_file(instance.image.name, instance.renditions, using=using)
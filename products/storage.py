@@ -0,0 +1,125 @@
+# products/storage.py
+import hashlib
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.core.files import File, locks
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+# ハッシュの先頭から何文字ずつ・何階層でディレクトリを分けるか (例: product_images/ab/cd/abcd...jpg)
+SHARD_WIDTH = 2
+SHARD_DEPTH = 2
+# コミット前のファイルを置く一時領域 (MEDIA_ROOT からの相対パス)
+STAGING_DIR = '.staging'
+# 確定・削除を排他するためのロックファイルの置き場と数 (ファイル名のハッシュで振り分ける)
+LOCK_DIR = '.locks'
+LOCK_STRIPES = 256
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    ファイル内容の SHA-256 をファイル名にするストレージ
+    同じ内容のファイルは1つだけ保存され、ハッシュの先頭でディレクトリを分けるため1つのディレクトリに集中しない
+    ファイルの削除は release_product_image_file で参照がなくなった場合だけ行う
+    """
+
+    def content_name(self, name, content):
+        """ファイル内容から保存先のパスを作る (元のディレクトリと拡張子は引き継ぐ)"""
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        shards = [hexdigest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+        return os.path.join(directory, *shards, hexdigest + extension).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name, staged_name = self.stage(name, content)
+        self.promote(staged_name, name)
+        return name
+
+    # --- 一時領域を使った保存 (トランザクションのコミット後にファイルを確定する) ---
+    def stage(self, name, content):
+        """
+        ファイルを一時領域に書き込み、(確定後のパス, 一時ファイルのパス) を返す
+        確定は promote、取り消しは discard で行う
+        """
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        final_name = self.content_name(name, content)
+        staged_name = self._save(f'{STAGING_DIR}/{uuid.uuid4().hex}.tmp', content)
+        return final_name, staged_name
+
+    def promote(self, staged_name, final_name):
+        """
+        一時ファイルを確定後のパスに移す
+        同じ内容のファイルがすでにあっても置き換える (削除待ちの処理がそのファイルを消そうとしている場合があるため、
+        捨てずに書き直して、削除側がロックの中で「参照を確認した後に書き直された」ことを検出できるようにする)
+        """
+        os.makedirs(os.path.dirname(self.path(final_name)), exist_ok=True)
+        with self.lock(final_name):
+            # 同じディレクトリツリー内の rename なので、途中まで書かれたファイルが見えることはない
+            os.replace(self.path(staged_name), self.path(final_name))
+
+    @contextmanager
+    def lock(self, name):
+        """
+        name のファイルの確定 (promote) と削除 (media_gc) を排他するロック
+        別のプロセス (ワーカー・管理コマンド) とも共有できるよう、ロックファイルで行う
+        """
+        lock_dir = self.path(LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        stripe = int(hashlib.sha1(name.encode()).hexdigest()[:8], 16) % LOCK_STRIPES
+        with open(os.path.join(lock_dir, f'{stripe}.lock'), 'a') as lock_file:
+            locks.lock(lock_file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock_file)
+
+    def discard(self, staged_name):
+        try:
+            self.delete(staged_name)
+        except OSError:
+            logger.warning(f"Failed to discard staged file: {staged_name}", exc_info=True)
+
+    def get_available_name(self, name, max_length=None):
+        # 内容が同じなら同じ名前になるので、連番を付けずにそのまま使う
+        return name
+
+
+product_image_storage = ContentAddressedStorage()
+
+
+def release_product_image_file(name, renditions=None, using=None):
+    """
+    商品画像のファイルへの参照が1つ減ったことを通知する
+    コミット後にファイル (とレンディション) を削除待ち (FileTombstone) に登録する
+    実際の削除は reap_file_tombstones コマンドが、どの ProductImage からも参照されていないことを確認してから行う
+    """
+    if not name:
+        return
+
+    def release():
+        from .models import FileTombstone
+        from .renditions import rendition_file_names
+
+        names = [name, *sorted(rendition_file_names(renditions))]
+        FileTombstone.objects.using(using).bulk_create(
+            [FileTombstone(name=file_name, source=name) for file_name in names]
+        )
+
+    transaction.on_commit(release, using=using)
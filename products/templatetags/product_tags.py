@@ -0,0 +1,103 @@
+# products/templatetags/product_tags.py
+from django import template
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.html import format_html
+
+from products.renditions import RENDITION_WIDTHS
+from products.resize_cache import nearest_width
+
+register = template.Library()
+
+
+@register.filter
+def facet_count(counts, value):
+    """
+    絞り込み件数の辞書から選択肢の値に対応する件数を返す
+    使い方: {{ facet_counts.size|facet_count:checkbox.data.value }}
+    """
+    if not counts:
+        return 0
+    # ModelMultipleChoiceField の選択肢は ModelChoiceIteratorValue なので実際の値を取り出す
+    value = getattr(value, 'value', value)
+    return counts.get(value, 0)
+
+
+# レンディションの種類ごとの表示幅 (img の sizes 属性)
+RENDITION_SIZES = {
+    'card': '(max-width: 576px) 50vw, 200px',
+    'detail': '(max-width: 768px) 100vw, 600px',
+    'zoom': '100vw',
+}
+
+
+@register.filter
+def resized_url(image_name, width):
+    """
+    商品画像を指定した横幅に縮小して返す URL (/media/r/<width>/<path>)
+    使い方: {{ product.main_product_image.image.name|resized_url:200 }}
+    """
+    if not image_name:
+        return ''
+    return reverse('resized_image', args=[nearest_width(int(width)), image_name])
+
+
+def _scaled_size(width, height, max_width):
+    """幅が max_width を超えないように縦横比を保って縮めた大きさ"""
+    if not width or not height:
+        return None, None
+    if width <= max_width:
+        return width, height
+    return max_width, round(height * max_width / width)
+
+
+@register.simple_tag
+def rendition_img(image, preset='card', alt='', css_class=''):
+    """
+    商品画像 (ProductImage または ProductCard.thumbnail) の <img> を出力する
+    レンディションがあれば WebP / JPEG の srcset を持つ <picture>、未作成ならリサイズ画像 (/media/r/...) を使う
+    幅・高さで表示領域を確保し、読み込みまでぼかしプレースホルダーを背景に表示する
+    使い方: {% rendition_img product.thumbnail 'card' alt=product.name css_class='img-fluid' %}
+    """
+    if image is None or not image.file_name:
+        return ''
+    renditions = image.renditions or {}
+    entry = renditions.get(preset)
+    placeholder_style = (
+        format_html('background: url({}) center / cover no-repeat;', image.lqip) if image.lqip else ''
+    )
+
+    if not entry:
+        # 形式 (WebP / JPEG) はリサイズ画像のエンドポイントが Accept ヘッダーで選ぶ
+        fallback_srcset = ', '.join(
+            f"{resized_url(image.file_name, width)} {width}w" for width in sorted(set(RENDITION_WIDTHS.values()))
+        )
+        width, height = _scaled_size(image.width, image.height, RENDITION_WIDTHS[preset])
+        return format_html(
+            '<img src="{}" srcset="{}" sizes="{}"{} class="{}" alt="{}" style="{}" loading="lazy" decoding="async">',
+            resized_url(image.file_name, RENDITION_WIDTHS[preset]), fallback_srcset, RENDITION_SIZES[preset],
+            format_html(' width="{}" height="{}"', width, height) if width else '',
+            css_class, alt, placeholder_style,
+        )
+
+    # 横幅の異なるレンディションをすべて候補にし、ブラウザに表示幅に合ったものを選ばせる
+    candidates = {}
+    for name in RENDITION_WIDTHS:
+        candidate = renditions.get(name)
+        if candidate:
+            candidates.setdefault(candidate['width'], candidate)
+
+    def srcset(fmt):
+        return ', '.join(
+            f"{default_storage.url(candidate[fmt])} {width}w" for width, candidate in sorted(candidates.items())
+        )
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" alt="{}" style="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        srcset('webp'), RENDITION_SIZES[preset],
+        default_storage.url(entry['jpeg']), srcset('jpeg'), RENDITION_SIZES[preset],
+        entry['width'], entry['height'], css_class, alt, placeholder_style,
+    )
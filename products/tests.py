@@ -1,3 +1,1271 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from accounts.models import User
+from interactions.models import Comment, Favorite, PurchaseIntent
+from kindergartens.models import Kindergarten
+
+from . import media_gc, renditions, resize_cache, search, uploads
+from .cache import (
+    KINDERGARTEN_VERSION_KEY, bump_kindergarten_version, get_kindergarten_version, get_listing_cache_stats,
+    listing_cache_key,
+)
+from .cards import CARD_SUMMARY_LENGTH, ProductCard, parse_status_filter
+from .facets import get_facet_counts
+from .forms import ProductForm, ProductSearchForm
+from .models import FileTombstone, Product, ProductCategory, ProductImage
+from .normalizers import build_search_key, normalize_search_text
+from .pagination import CursorPaginator, InvalidCursor
+from .storage import STAGING_DIR, product_image_storage
+
+
+class ProductImageFixtureMixin:
+    """出品者・商品・画像 (メイン + サブ2枚) のテスト用データ"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        cls.seller = User.objects.create_user(
+            email='seller@example.com', password='pw', name='出品者', kindergarten=cls.kindergarten,
+        )
+        cls.category = ProductCategory.objects.create(name='制服')
+        cls.product = Product.objects.create(
+            user=cls.seller, kindergarten=cls.kindergarten, product_category=cls.category, name='スモック', price=500,
+        )
+        # ファイル名だけを指定する (保存済みのファイルとして扱われ、画像の読み込みは行われない)
+        main_image = ProductImage.objects.create(
+            product=cls.product, image='product_images/main.jpg', display_order=0, width=800, height=600,
+        )
+        for order in (2, 1):
+            ProductImage.objects.create(
+                product=cls.product, image=f'product_images/sub{order}.jpg', display_order=order, width=800, height=600,
+            )
+        cls.product.main_product_image = main_image
+        cls.product.save(update_fields=['main_product_image'])
+
+
+def make_image(width, height, mode='RGB', fmt='JPEG', color='red', orientation=None):
+    """テスト用の画像のバイト列を作る (orientation: EXIF の向き)"""
+    image = Image.new(mode, (width, height), color)
+    buffer = BytesIO()
+    options = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        options['exif'] = exif
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+class TempMediaMixin:
+    """メディアファイル・リサイズ画像のキャッシュを一時ディレクトリに置く (レンディションはその場で作成する)"""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.media_root = os.path.join(root, 'media')
+        media_settings = override_settings(
+            MEDIA_ROOT=self.media_root, RESIZE_CACHE_ROOT=os.path.join(root, 'resized'), PRODUCT_RENDITION_WORKERS=0,
+        )
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def add_image(self, product, data, name='photo.jpg', display_order=3):
+        """画像ファイル付きの ProductImage を保存する (コミット後の処理も実行する)"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(
+                product=product, image=ContentFile(data, name=name), display_order=display_order,
+            )
+
+
+class SubImageAccessorTests(ProductImageFixtureMixin, TestCase):
+    """Product のサブ画像取得メソッド"""
+
+    def test_uses_prefetch_cache(self):
+        product = Product.objects.prefetch_related('images').get(pk=self.product.pk)
+        with self.assertNumQueries(0):
+            sub_images = product.get_sub_images_as_dict()
+            sub_image_2 = product.get_sub_image_by_display_order(2)
+            missing = product.get_sub_image_by_display_order(3)
+        self.assertEqual([img and img.display_order for img in sub_images.values()], [1, 2, None])
+        self.assertEqual(sub_image_2.display_order, 2)
+        self.assertIsNone(missing)
+
+    def test_falls_back_to_single_query(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with self.assertNumQueries(1):
+            sub_images = product.get_sub_images()
+        self.assertEqual([img.display_order for img in sub_images], [1, 2])
+
+
+class ProductPageQueryCountTests(ProductImageFixtureMixin, TestCase):
+    """商品詳細・編集ページのクエリ数 (画像の枚数によって増えないこと)"""
+
+    def setUp(self):
+        self.client.force_login(self.seller)
+
+    def test_detail_query_count(self):
+        Comment.objects.create(user=self.seller, product=self.product, content='サイズは110です')
+        url = reverse('products:product_detail', kwargs={'pk': self.product.pk})
+        # セッション, ユーザー, 商品 (+出品者・園・カテゴリ・メイン画像), 画像, コメント, コメントの投稿者, お気に入り, 購入意思表示
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([img.display_order for img in response.context['sub_images']], [1, 2])
+
+    def test_edit_query_count(self):
+        url = reverse('products:product_edit', kwargs={'pk': self.product.pk})
+        # セッション, ユーザー, 商品 (+メイン画像), 画像, 出品者 (権限確認), カテゴリの選択肢
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['sub_images_map'][2].display_order, 2)
+
+
+class ProductEditErrorTests(ProductImageFixtureMixin, TestCase):
+    """商品編集中の予期せぬエラー"""
+
+    def test_error_is_logged_and_rolled_back(self):
+        self.client.force_login(self.seller)
+        url = reverse('products:product_edit', kwargs={'pk': self.product.pk})
+        data = {
+            'name': '名前を変更', 'price': 800, 'product_category': self.category.pk,
+            'size': Product.Size.choices[0][0], 'condition': Product.Condition.choices[0][0], 'description': '',
+        }
+        with mock.patch('products.views.persist_product_images', side_effect=RuntimeError('boom')), \
+                self.assertLogs('products.views', level='ERROR') as logs:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        # トレースバック付きで記録される
+        self.assertIsNotNone(logs.records[0].exc_info)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'スモック')
+
+
+class ListingCacheInvalidationTests(ProductImageFixtureMixin, TestCase):
+    """商品の変更・削除で園のキャッシュ (商品一覧) が無効になること"""
+
+    def setUp(self):
+        # 共有キャッシュと同じファイルベースのバックエンドを、テスト用のディレクトリで使う
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir,
+        }})
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.buyer = User.objects.create_user(
+            email='buyer@example.com', password='pw', name='購入者', kindergarten=self.kindergarten,
+        )
+        self.client.force_login(self.buyer)
+
+    def get_top(self):
+        return self.client.get(reverse('products:top'))
+
+    def test_save_invalidates_listing(self):
+        self.assertContains(self.get_top(), 'スモック')
+        self.assertContains(self.get_top(), 'スモック')
+        self.assertEqual(get_listing_cache_stats()['hits'], 1)
+        version = get_kindergarten_version(self.kindergarten.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = '体操服'
+            self.product.save()
+        self.assertGreater(get_kindergarten_version(self.kindergarten.pk), version)
+        response = self.get_top()
+        self.assertContains(response, '体操服')
+        self.assertNotContains(response, 'スモック')
+
+    def test_listing_is_shared_and_own_products_are_excluded(self):
+        self.assertContains(self.get_top(), 'スモック')
+        # 出品者は購入者がキャッシュした一覧を使い、自分の出品は表示しない
+        self.client.force_login(self.seller)
+        self.assertNotContains(self.get_top(), 'スモック')
+        self.assertEqual(get_listing_cache_stats()['hits'], 1)
+
+    def test_delete_invalidates_listing(self):
+        self.assertContains(self.get_top(), 'スモック')
+        version = get_kindergarten_version(self.kindergarten.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertGreater(get_kindergarten_version(self.kindergarten.pk), version)
+        self.assertNotContains(self.get_top(), 'スモック')
+
+    def test_other_kindergarten_is_not_invalidated(self):
+        other = Kindergarten.objects.create(
+            name='別の園', auth_code='other', zip_code='1000002', prefecture='tokyo', address='港区',
+        )
+        version = get_kindergarten_version(other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(get_kindergarten_version(other.pk), version)
+
+
+class ListingCacheKeyTests(TestCase):
+    """商品一覧キャッシュのキーとバージョン"""
+
+    def setUp(self):
+        cache.clear()
+
+    def key(self, data, page_token='', kindergarten_id=1):
+        form = ProductSearchForm(data)
+        self.assertTrue(form.is_valid())
+        return listing_cache_key(kindergarten_id, form.cleaned_data, page_token)
+
+    def test_equivalent_conditions_share_a_key(self):
+        self.assertEqual(
+            self.key({'keyword': 'ｾｲﾌｸ', 'size': ['120', '110']}),
+            self.key({'keyword': 'せいふく', 'size': ['110', '120']}),
+        )
+
+    def test_key_depends_on_page_and_conditions(self):
+        # ユーザーは含めない (園の全員で共有し、自分の出品は取得後に除外する)
+        base = self.key({'keyword': 'せいふく'})
+        self.assertNotEqual(base, self.key({'keyword': 'せいふく'}, page_token='page:2'))
+        self.assertNotEqual(base, self.key({'keyword': 'かばん'}))
+        self.assertNotEqual(base, self.key({'keyword': 'せいふく'}, kindergarten_id=2))
+
+    def test_bump_changes_only_that_kindergarten(self):
+        before = self.key({})
+        other = self.key({}, kindergarten_id=2)
+        bump_kindergarten_version(1)
+        self.assertNotEqual(self.key({}), before)
+        self.assertEqual(self.key({}, kindergarten_id=2), other)
+
+    def test_bump_after_eviction_does_not_reuse_versions(self):
+        # キャッシュから消えた後は現在時刻 (ミリ秒) から作り直すので、以前のバージョンに戻らない
+        with mock.patch('products.cache.time.time', return_value=1000.0):
+            get_kindergarten_version(1)
+            bump_kindergarten_version(1)
+        cache.delete(KINDERGARTEN_VERSION_KEY.format(kindergarten_id=1))
+        with mock.patch('products.cache.time.time', return_value=1000.5):
+            bump_kindergarten_version(1)
+            self.assertEqual(get_kindergarten_version(1), 1000500)
+
+    def test_listing_cache_stats_command(self):
+        cache.set('products:listing_cache:hits', 3)
+        cache.set('products:listing_cache:misses', 1)
+        out = io.StringIO()
+        call_command('listing_cache_stats', reset=True, stdout=out)
+        self.assertIn('hits: 3 / misses: 1 / hit rate: 75.0%', out.getvalue())
+        self.assertEqual(get_listing_cache_stats()['hits'], 0)
+
+
+class RenditionFailureTests(ProductImageFixtureMixin, TransactionTestCase):
+    """レンディション作成の失敗・待ち行列あふれの記録"""
+
+    def setUp(self):
+        with mock.patch.object(renditions, 'schedule_renditions'): # 画像ファイルはないので作成を登録しない
+            self.setUpTestData()
+        self.image = ProductImage.objects.get(display_order=1)
+
+    def run_callback(self, future):
+        """
+        プールの管理スレッドと同じように、別スレッドで完了コールバックを実行し、接続を閉じたかを返す
+        (テスト用のインメモリの SQLite は close しても閉じないので、close_all の呼び出しで確認する)
+        """
+        with mock.patch.object(renditions, '_pending', threading.BoundedSemaphore(1)) as pending, \
+                mock.patch.object(renditions.connections, 'close_all') as close_all:
+            pending.acquire()
+            thread = threading.Thread(target=renditions._on_done, args=(self.image.pk, future))
+            thread.start()
+            thread.join()
+        return close_all.called
+
+    def test_failure_is_recorded_and_connection_closed(self):
+        future = Future()
+        future.set_exception(OSError('broken image'))
+        self.assertTrue(self.run_callback(future))
+        self.image.refresh_from_db()
+        self.assertEqual((self.image.rendition_attempts, self.image.rendition_error), (1, 'broken image'))
+        self.assertIn((self.image.pk, self.image.image.name), list(renditions.iter_pending_renditions()))
+
+    def test_success_resets_failures(self):
+        ProductImage.objects.filter(pk=self.image.pk).update(rendition_attempts=2, rendition_error='broken image')
+        future = Future()
+        future.set_result({'source': self.image.image.name, 'card': {}})
+        self.assertTrue(self.run_callback(future))
+        self.image.refresh_from_db()
+        self.assertEqual((self.image.rendition_attempts, self.image.rendition_error), (0, ''))
+        self.assertNotIn(self.image.pk, [pk for pk, _ in renditions.iter_pending_renditions()])
+
+    def test_too_many_failures_are_skipped(self):
+        ProductImage.objects.filter(pk=self.image.pk).update(rendition_attempts=renditions.MAX_RENDITION_ATTEMPTS)
+        self.assertNotIn(self.image.pk, [pk for pk, _ in renditions.iter_pending_renditions()])
+        self.assertIn(self.image.pk, [pk for pk, _ in renditions.iter_pending_renditions(force=True)])
+
+    @override_settings(PRODUCT_RENDITION_WORKERS=1)
+    def test_queue_full_leaves_image_pending(self):
+        executor = mock.Mock()
+        with mock.patch.object(renditions, '_executor', executor), \
+                mock.patch.object(renditions, '_pending', threading.BoundedSemaphore(1)) as pending:
+            pending.acquire() # 待ち行列がいっぱい
+            renditions.schedule_renditions(self.image)
+        executor.submit.assert_not_called()
+        self.assertIn((self.image.pk, self.image.image.name), list(renditions.iter_pending_renditions()))
+
+
+class SeedMarketCommandTests(TestCase):
+    """seed_market コマンド (負荷試験用の合成データ)"""
+
+    def seed(self, **options):
+        call_command(
+            'seed_market', kindergartens=2, users_per_kindergarten=5, products=30, images=0, batch_size=7,
+            favorites=2, intents=2, comments=1, verbosity=0, **options,
+        )
+
+    def test_creates_consistent_data(self):
+        self.seed()
+        self.assertEqual(Product.objects.count(), 30)
+        # 出品者 (非正規化) ・集計用カウンター・取引相手が実データと一致する
+        self.assertFalse(PurchaseIntent.objects.exclude(seller_id=F('product__user_id')).exists())
+        self.assertFalse(
+            Product.objects.annotate(count=Count('purchase_intended_by'))
+            .exclude(count=F('purchase_intent_count')).exists()
+        )
+        self.assertFalse(
+            Product.objects.exclude(status=Product.Status.FOR_SALE)
+            .exclude(purchase_intended_by__user_id=F('negotiating_user_id')).exists()
+        )
+        self.assertFalse(Product.objects.filter(search_key='').exists())
+
+    def test_same_seed_same_data(self):
+        self.seed(prefix='a')
+        self.seed(prefix='b')
+        rows = [
+            list(Product.objects.filter(kindergarten__auth_code__startswith=f'{prefix}-')
+                 .order_by('pk').values_list('name', 'price', 'status', 'purchase_intent_count'))
+            for prefix in ('a', 'b')
+        ]
+        self.assertEqual(rows[0], rows[1])
+
+    def test_rejects_existing_prefix(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class CursorPaginationTests(TestCase):
+    """(created_at, id) をキーにしたカーソルページネーション"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        cls.seller = User.objects.create_user(
+            email='seller@example.com', password='pw', name='出品者', kindergarten=cls.kindergarten,
+        )
+        cls.buyer = User.objects.create_user(
+            email='buyer@example.com', password='pw', name='購入者', kindergarten=cls.kindergarten,
+        )
+        category = ProductCategory.objects.create(name='制服')
+        cls.products = [
+            Product.objects.create(
+                user=cls.seller, kindergarten=cls.kindergarten, product_category=category, name=f'商品{i}', price=100,
+            )
+            for i in range(7)
+        ]
+        # 登録日時が同じ商品は id で順序を決める (ページの境目で重複・欠落しないこと)
+        same_time = timezone.now()
+        Product.objects.filter(pk__in=[p.pk for p in cls.products[2:5]]).update(created_at=same_time)
+        cls.expected = list(Product.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+    def walk(self, paginator):
+        """先頭から次のページをたどり、ページごとの pk のリストを返す"""
+        pages = []
+        page = paginator.page()
+        while True:
+            pages.append([p.pk for p in page])
+            if not page.has_next():
+                return pages, page
+            page = paginator.page(page.next_cursor)
+
+    def test_forward_pages_cover_all_rows_once(self):
+        pages, last_page = self.walk(CursorPaginator(Product.objects.all(), 3))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertFalse(last_page.has_next())
+        self.assertTrue(last_page.has_previous())
+
+    def test_previous_cursor_returns_previous_page(self):
+        paginator = CursorPaginator(Product.objects.all(), 3)
+        first = paginator.page()
+        self.assertFalse(first.has_previous())
+        second = paginator.page(first.next_cursor)
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual([p.pk for p in back], [p.pk for p in first])
+        self.assertFalse(back.has_previous())
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        paginator = CursorPaginator(Product.objects.all(), 3)
+        token = paginator.page().next_cursor
+        tampered = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+        with self.assertRaises(InvalidCursor):
+            paginator.decode_cursor(tampered)
+        self.assertEqual([p.pk for p in paginator.page(tampered)], self.expected[:3])
+        # 別の用途の署名 (ソルト違い) も受け付けない
+        with self.assertRaises(InvalidCursor):
+            paginator.decode_cursor(signing.dumps(['n', timezone.now().isoformat(), 1]))
+
+    def test_values_rows_and_row_factory(self):
+        paginator = CursorPaginator(
+            Product.objects.values('pk', 'name', 'created_at'), 5, row_factory=lambda row: row['name'],
+        )
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        names = dict(Product.objects.values_list('pk', 'name'))
+        self.assertEqual(list(first) + list(second), [names[pk] for pk in self.expected])
+
+    def test_product_list_uses_cursor(self):
+        cache.clear()
+        self.client.force_login(self.buyer)
+        url = reverse('products:top')
+        with mock.patch('products.views.PRODUCTS_PER_PAGE', 3):
+            response = self.client.get(url)
+            page = response.context['products']
+            self.assertTrue(response.context['is_cursor_pagination'])
+            seen = [p.pk for p in page]
+            while page.has_next():
+                page = self.client.get(url, {'cursor': page.next_cursor}).context['products']
+                seen += [p.pk for p in page]
+        self.assertEqual(seen, self.expected)
+
+
+class QueryPlanTests(TestCase):
+    """一覧系クエリのインデックスとマイグレーション"""
+
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertNotIn('[NG]', out.getvalue())
+
+    def test_migrations_match_models(self):
+        # インデックスの定義を変更したらマイグレーションも作成されていること
+        call_command('makemigrations', check=True, dry_run=True, verbosity=0)
+
+
+class FullTextSearchTests(TestCase):
+    """FTS5 (bi-gram) による商品のキーワード検索"""
+
+    @classmethod
+    def setUpTestData(cls):
+        kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        seller = User.objects.create_user(
+            email='seller@example.com', password='pw', name='出品者', kindergarten=kindergarten,
+        )
+        category = ProductCategory.objects.create(name='制服')
+
+        def create(name, description=''):
+            return Product.objects.create(
+                user=seller, kindergarten=kindergarten, product_category=category,
+                name=name, description=description, price=100,
+            )
+        # 商品説明に一致する商品の方が新しい (関連度順でなければ先に並ぶ)
+        cls.in_name = create('スモック')
+        cls.in_description = create('エプロン', 'スモックと一緒に使えます')
+        cls.gym_wear = create('体操服 上下', '冬用')
+        cls.bottle = create('水筒')
+
+    def search(self, keyword):
+        return list(search.filter_by_keyword(Product.objects.all(), keyword).values_list('pk', flat=True))
+
+    def test_to_ngrams(self):
+        self.assertEqual(search.to_ngrams('制服 冬'), ['制服', '服', '冬'])
+        self.assertEqual(search.to_ngrams('!?'), [])
+
+    def test_to_match_query(self):
+        self.assertEqual(search.to_match_query('体操服 冬'), '"体操 操服" AND "冬"*')
+        self.assertIsNone(search.to_match_query('!? '))
+
+    def test_name_match_ranks_first(self):
+        self.assertTrue(search.fts_enabled())
+        # 商品名への一致 (bm25 の重みが大きい) が商品説明への一致より先に並ぶ
+        self.assertEqual(self.search('スモック'), [self.in_name.pk, self.in_description.pk])
+
+    def test_keywords_are_anded_across_columns(self):
+        self.assertEqual(self.search('体操 冬'), [self.gym_wear.pk])
+        self.assertEqual(self.search('体操 夏'), [])
+
+    def test_single_character_and_partial_keyword(self):
+        self.assertEqual(self.search('服'), [self.gym_wear.pk])
+        self.assertEqual(self.search('プロ'), [self.in_description.pk])
+
+    def test_symbols_only_falls_back_to_search_key(self):
+        self.assertEqual(self.search('%'), [])
+
+    def test_index_follows_save_and_delete(self):
+        self.bottle.name = '水筒カバー'
+        self.bottle.save()
+        self.assertEqual(self.search('カバー'), [self.bottle.pk])
+        self.bottle.delete()
+        self.assertEqual(self.search('カバー'), [])
+
+    def test_rebuild_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        self.assertEqual(self.search('水筒'), [])
+        self.assertEqual(search.rebuild_index(batch_size=3), 4)
+        self.assertEqual(self.search('水筒'), [self.bottle.pk])
+
+
+class SearchKeyNormalizationTests(TestCase):
+    """検索キー (全角/半角・カナの統一) による日本語キーワードの照合"""
+
+    @classmethod
+    def setUpTestData(cls):
+        kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        seller = User.objects.create_user(
+            email='seller@example.com', password='pw', name='出品者', kindergarten=kindergarten,
+        )
+        category = ProductCategory.objects.create(name='制服')
+        cls.product = Product.objects.create(
+            user=seller, kindergarten=kindergarten, product_category=category,
+            name='セイフク　１２０', description='ＳＭＯＣＫ付き', price=100,
+        )
+
+    def search(self, keyword):
+        return list(search.filter_by_keyword(Product.objects.all(), keyword).values_list('pk', flat=True))
+
+    def test_normalize_search_text(self):
+        self.assertEqual(normalize_search_text('ｾｲﾌｸ　１２０'), 'せいふく 120')
+        self.assertEqual(normalize_search_text('  ＳＭＯＣＫ\tスモック '), 'smock すもっく')
+        self.assertEqual(normalize_search_text('ヴァ'), 'ゔぁ')
+        self.assertEqual(normalize_search_text(None), '')
+
+    def test_search_key_is_updated_on_save(self):
+        self.assertEqual(self.product.search_key, 'せいふく 120 smock付き')
+        self.product.description = 'ボタン'
+        # update_fields を指定した保存でも検索キーが更新される
+        self.product.save(update_fields=['description'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.search_key, build_search_key('セイフク　１２０', 'ボタン'))
+
+    def test_width_and_kana_variants_match(self):
+        for keyword in ('ｾｲﾌｸ', 'せいふく', 'セイフク 120', 'smock', 'Ｓｍｏｃｋ'):
+            with self.subTest(keyword=keyword):
+                self.assertEqual(self.search(keyword), [self.product.pk])
+
+    def test_fallback_without_fts(self):
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            self.assertEqual(self.search('ｾｲﾌｸ 120'), [self.product.pk])
+            self.assertEqual(self.search('せいふく 130'), [])
+
+    def test_backfill_search_keys(self):
+        Product.objects.filter(pk=self.product.pk).update(search_key='')
+        out = io.StringIO()
+        call_command('backfill_search_keys', batch_size=1, stdout=out)
+        self.assertIn('1 件', out.getvalue())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.search_key, 'せいふく 120 smock付き')
+
+
+class FacetCountTests(TestCase):
+    """商品一覧サイドバーの絞り込み条件ごとの件数"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        cls.seller = User.objects.create_user(
+            email='seller@example.com', password='pw', name='出品者', kindergarten=cls.kindergarten,
+        )
+        cls.uniform = ProductCategory.objects.create(name='制服')
+        cls.bag = ProductCategory.objects.create(name='かばん')
+        Size, Condition = Product.Size, Product.Condition
+        for category, size, condition, price in [
+            (cls.uniform, Size.SIZE_110, Condition.NEW, 300),
+            (cls.uniform, Size.SIZE_110, Condition.BAD, 800),
+            (cls.uniform, Size.SIZE_120, Condition.NEW, 1500),
+            (cls.bag, Size.NO_SIZE, Condition.NEW, 5000),
+        ]:
+            Product.objects.create(
+                user=cls.seller, kindergarten=cls.kindergarten, product_category=category,
+                name='商品', size=size, condition=condition, price=price,
+            )
+        # 販売中でない商品は数えない
+        Product.objects.create(
+            user=cls.seller, kindergarten=cls.kindergarten, product_category=cls.bag,
+            name='売却済', size=Size.SIZE_110, condition=Condition.NEW, price=100, status=Product.Status.SOLD,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def facet_counts(self, data=None, user_id=None):
+        form = ProductSearchForm(data or {})
+        self.assertTrue(form.is_valid())
+        base_queryset = Product.objects.filter(status=Product.Status.FOR_SALE, kindergarten=self.kindergarten)
+        return get_facet_counts(base_queryset, form.cleaned_data, self.kindergarten.pk, user_id=user_id)
+
+    def test_counts_without_filters(self):
+        # カテゴリ・サイズ・状態は GROUP BY 1回ずつ、価格帯は条件付き集計1回
+        with self.assertNumQueries(4):
+            counts = self.facet_counts()
+        self.assertEqual(counts['category'], {self.uniform.pk: 3, self.bag.pk: 1})
+        self.assertEqual(counts['size'], {110: 2, 120: 1, 0: 1})
+        self.assertEqual(counts['condition'], {Product.Condition.NEW: 3, Product.Condition.BAD: 1})
+        self.assertEqual([band['count'] for band in counts['price']], [1, 1, 1, 0, 1])
+
+    def test_each_facet_ignores_its_own_filter(self):
+        counts = self.facet_counts({'size': ['110'], 'condition': [str(Product.Condition.NEW)]})
+        # サイズの件数は状態の条件だけ、状態の件数はサイズの条件だけで数える
+        self.assertEqual(counts['size'], {110: 1, 120: 1, 0: 1})
+        self.assertEqual(counts['condition'], {Product.Condition.NEW: 1, Product.Condition.BAD: 1})
+        # その他はサイズ・状態の両方で絞り込んだ件数
+        self.assertEqual(counts['category'], {self.uniform.pk: 1})
+
+    def test_counts_are_cached_until_products_change(self):
+        self.facet_counts()
+        with self.assertNumQueries(0):
+            self.facet_counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.filter(product_category=self.bag, status=Product.Status.FOR_SALE).get()
+            product.status = Product.Status.SOLD
+            product.save()
+        self.assertEqual(self.facet_counts()['category'], {self.uniform.pk: 3})
+
+    def test_own_products_are_subtracted_from_shared_counts(self):
+        self.facet_counts()
+        # 園全体の件数はキャッシュを共有し、出品していないユーザーは確認のクエリだけ
+        with self.assertNumQueries(1):
+            self.assertEqual(self.facet_counts(user_id=0)['category'], {self.uniform.pk: 3, self.bag.pk: 1})
+        with self.assertNumQueries(0):
+            self.facet_counts(user_id=0)
+        # 出品者自身には自分の出品を除いた件数を返す
+        counts = self.facet_counts(user_id=self.seller.pk)
+        self.assertEqual((counts['category'], counts['size']), ({}, {}))
+        self.assertEqual([band['count'] for band in counts['price']], [0] * 5)
+
+
+class ProductCardTests(ProductImageFixtureMixin, TestCase):
+    """一覧ページ用の軽量な読み取りモデル (ProductCard)"""
+
+    def test_from_values_row(self):
+        Product.objects.filter(pk=self.product.pk).update(description='あ' * (CARD_SUMMARY_LENGTH + 20))
+        with self.assertNumQueries(1):
+            cards = [ProductCard.from_row(row) for row in ProductCard.values(Product.objects.all())]
+        card = cards[0]
+        self.assertEqual((card.pk, card.name, card.price), (self.product.pk, 'スモック', 500))
+        # 商品説明は先頭だけを取得する
+        self.assertEqual(len(card.description), CARD_SUMMARY_LENGTH)
+        self.assertEqual(card.get_status_display(), '販売中')
+        self.assertEqual(card.get_size_display(), Product.Size(self.product.size).label)
+        self.assertEqual(card.thumbnail.file_name, 'product_images/main.jpg')
+        self.assertEqual((card.thumbnail.width, card.thumbnail.height), (800, 600))
+        self.assertFalse(card.is_favorited_by_current_user)
+        self.assertFalse(hasattr(card, '__dict__'))
+
+    def test_related_rows_with_prefix_and_display_fields(self):
+        buyer = User.objects.create_user(
+            email='buyer@example.com', password='pw', name='購入者', kindergarten=self.kindergarten,
+        )
+        Favorite.objects.create(user=buyer, product=self.product)
+        PurchaseIntent.objects.create(user=buyer, product=self.product)
+        self.assertEqual(Product.objects.start_transaction(self.product.pk, buyer.pk), 1)
+        messages = {Product.Status.IN_TRANSACTION: ('あなたと取引中', '他の方と取引中')}
+        queryset = Favorite.objects.annotate(**ProductCard.status_annotations('product__', buyer.pk, messages))
+        row = ProductCard.values(queryset, 'status_class', 'status_message_info', prefix='product__').get()
+        card = ProductCard.from_row(row, prefix='product__')
+        self.assertEqual(card.pk, self.product.pk)
+        self.assertEqual((card.status_class, card.status_message_info), ('status-in-transaction', 'あなたと取引中'))
+
+        queryset = Favorite.objects.annotate(**ProductCard.status_annotations('product__', 0, messages))
+        row = ProductCard.values(queryset, 'status_message_info', prefix='product__').get()
+        self.assertEqual(ProductCard.from_row(row, prefix='product__').status_message_info, '他の方と取引中')
+
+    def test_card_without_main_image(self):
+        Product.objects.filter(pk=self.product.pk).update(main_product_image=None)
+        card = ProductCard.from_row(ProductCard.values(Product.objects.all()).get())
+        self.assertIsNone(card.thumbnail)
+        self.assertEqual(card.thumbnail_url, '')
+
+    def test_parse_status_filter(self):
+        self.assertEqual(parse_status_filter('2'), Product.Status.IN_TRANSACTION)
+        for value in (None, '', 'x', '9'):
+            self.assertIsNone(parse_status_filter(value))
+
+    def test_bench_product_cards_rolls_back(self):
+        count = Product.objects.count()
+        out = io.StringIO()
+        call_command('bench_product_cards', rows=20, repeat=1, stdout=out)
+        self.assertIn('ProductCard', out.getvalue())
+        self.assertEqual(Product.objects.count(), count)
+
+
+class RenditionPipelineTests(TempMediaMixin, ProductImageFixtureMixin, TestCase):
+    """表示サイズごとのレンディション (JPEG / WebP) の作成"""
+
+    def test_builds_every_preset_and_format(self):
+        image = self.add_image(self.product, make_image(2400, 1200))
+        image.refresh_from_db()
+        self.assertEqual(image.renditions['source'], image.image.name)
+        sizes = {preset: (entry['width'], entry['height']) for preset, entry in image.renditions.items() if preset != 'source'}
+        self.assertEqual(sizes, {'card': (400, 200), 'detail': (1000, 500), 'zoom': (2000, 1000)})
+        for fmt, expected in (('jpeg', 'JPEG'), ('webp', 'WEBP')):
+            with default_storage.open(image.renditions['card'][fmt]) as f:
+                self.assertEqual(Image.open(f).format, expected)
+
+    def test_small_image_is_not_upscaled(self):
+        image = self.add_image(self.product, make_image(300, 150))
+        image.refresh_from_db()
+        self.assertEqual({image.renditions[p]['width'] for p in renditions.RENDITION_WIDTHS}, {300})
+
+    def test_transparent_image_gets_white_background(self):
+        image = self.add_image(self.product, make_image(500, 500, 'RGBA', 'PNG', (0, 0, 0, 0)), name='clear.png')
+        image.refresh_from_db()
+        with default_storage.open(image.renditions['card']['jpeg']) as f:
+            self.assertGreater(min(Image.open(f).convert('RGB').getpixel((10, 10))), 240)
+
+    def test_result_for_replaced_image_is_discarded(self):
+        image = self.add_image(self.product, make_image(800, 600))
+        built = renditions.build_renditions(image.image.name)
+        ProductImage.objects.filter(pk=image.pk).update(image='product_images/other.jpg')
+        self.assertFalse(renditions.save_renditions(image.pk, built))
+        # 元画像を参照する ProductImage がないので、作成したファイルも削除する
+        self.assertFalse(default_storage.exists(built['card']['webp']))
+
+    def test_rendition_img_tag(self):
+        image = self.add_image(self.product, make_image(800, 600))
+        image.refresh_from_db()
+        template = Template("{% load product_tags %}{% rendition_img image 'card' alt='スモック' %}")
+        html = template.render(Context({'image': image}))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn(default_storage.url(image.renditions['card']['jpeg']), html)
+        self.assertIn('width="400" height="300"', html)
+        # 未作成の場合はリサイズ画像のエンドポイントを使う
+        image.renditions = {}
+        self.assertIn('/media/r/400/', template.render(Context({'image': image})))
+
+    def test_backfill_renditions(self):
+        image = self.add_image(self.product, make_image(800, 600))
+        ProductImage.objects.filter(pk=image.pk).update(renditions={})
+        out, err = io.StringIO(), io.StringIO()
+        # プロセスプールの代わりにスレッドで作成する (テスト用 DB・一時ディレクトリの設定を引き継ぐため)
+        with mock.patch(
+            'products.management.commands.backfill_renditions.create_executor', lambda workers: ThreadPoolExecutor(workers),
+        ):
+            call_command('backfill_renditions', workers=2, stdout=out, stderr=err)
+        # ファイルのない画像 (テスト用データの3枚) は失敗として記録され、次回再試行される
+        self.assertIn('1 件の画像のレンディションを作成しました。(失敗: 3 件)', out.getvalue())
+        image.refresh_from_db()
+        self.assertEqual(image.renditions['source'], image.image.name)
+        self.assertEqual(
+            set(ProductImage.objects.exclude(pk=image.pk).values_list('rendition_attempts', flat=True)), {1},
+        )
+
+
+class UploadNormalizationTests(TestCase):
+    """アップロード画像の縮小・向き補正・メタデータ削除"""
+
+    def normalize(self, data, name='photo.jpg'):
+        return uploads.normalize_upload(SimpleUploadedFile(name, data))
+
+    def open(self, content):
+        content.seek(0)
+        return Image.open(BytesIO(content.read()))
+
+    def test_large_image_is_downscaled(self):
+        content = self.normalize(make_image(6000, 3000))
+        image = self.open(content)
+        self.assertEqual((image.format, image.size), ('JPEG', (uploads.MAX_LONG_EDGE, uploads.MAX_LONG_EDGE // 2)))
+        metadata = content.image_metadata
+        self.assertEqual((metadata['width'], metadata['height'], metadata['bytes']), (*image.size, content.size))
+        self.assertTrue(metadata['lqip'].startswith('data:image/webp;base64,'))
+        self.assertLess(content.size, content.original_size)
+
+    def test_exif_orientation_is_applied_and_stripped(self):
+        # 縦向き (90度回転) で撮影した横長の画像
+        content = self.normalize(make_image(400, 200, orientation=6))
+        image = self.open(content)
+        self.assertEqual(image.size, (200, 400))
+        self.assertNotIn(0x0112, image.getexif())
+
+    def test_png_is_converted_to_jpeg_when_smaller(self):
+        buffer = BytesIO()
+        Image.effect_noise((200, 200), 60).convert('RGB').save(buffer, 'PNG') # 写真のように JPEG の方が小さくなる画像
+        content = self.normalize(buffer.getvalue(), name='photo.png')
+        self.assertEqual(content.name, 'photo.jpg')
+        self.assertEqual(self.open(content).format, 'JPEG')
+        self.assertLess(content.size, content.original_size)
+
+    def test_small_original_is_kept(self):
+        # 上限以内・メタデータなしで、JPEG にすると大きくなる画像 (単色の図など) は元のファイルのまま保存する
+        data = make_image(100, 100, 'RGBA', 'PNG', (0, 0, 255, 128))
+        content = self.normalize(data, name='icon.png')
+        self.assertEqual(content.name, 'icon.png')
+        content.seek(0)
+        self.assertEqual(content.read(), data)
+        self.assertEqual(content.image_metadata['bytes'], len(data))
+
+    def test_original_with_exif_is_reencoded(self):
+        content = self.normalize(make_image(100, 100, orientation=1))
+        self.assertNotEqual(content.size, content.original_size)
+        self.assertNotIn(0x0112, self.open(content).getexif())
+
+    def test_too_many_pixels_is_rejected(self):
+        # 処理を待つのをやめてもスレッドは止まらないので、大きすぎる画像はスレッドに渡す前に弾く
+        with mock.patch.object(uploads, 'MAX_PIXELS', 100 * 100 - 1), \
+                mock.patch.object(uploads._executor, 'submit') as submit:
+            with self.assertRaises(ValidationError) as cm:
+                self.normalize(make_image(100, 100))
+        self.assertEqual(cm.exception.code, 'too_many_pixels')
+        submit.assert_not_called()
+
+    def test_broken_image_is_rejected(self):
+        with self.assertLogs('products.uploads', level='WARNING'), self.assertRaises(ValidationError) as cm:
+            self.normalize(b'not an image')
+        self.assertEqual(cm.exception.code, 'invalid_image')
+
+    def test_form_replaces_uploads(self):
+        category = ProductCategory.objects.create(name='制服')
+        form = ProductForm({
+            'name': 'スモック', 'price': 500, 'product_category': category.pk,
+            'size': Product.Size.NO_SIZE, 'condition': Product.Condition.NEW, 'description': '',
+        }, {'main_image': SimpleUploadedFile('main.png', make_image(3000, 3000, fmt='PNG'))})
+        self.assertTrue(form.is_valid(), form.errors)
+        main_image = form.cleaned_data['main_image']
+        self.assertEqual((main_image.name, main_image.image_metadata['width']), ('main.jpg', uploads.MAX_LONG_EDGE))
+
+
+class ContentAddressedStorageTests(TempMediaMixin, ProductImageFixtureMixin, TestCase):
+    """内容のハッシュをファイル名にした商品画像の保存 (一時領域 → 確定)"""
+
+    def test_stage_then_promote(self):
+        data = make_image(100, 100)
+        digest = hashlib.sha256(data).hexdigest()
+        name, staged_name = product_image_storage.stage('product_images/photo.JPG', ContentFile(data))
+        self.assertEqual(name, f'product_images/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertTrue(staged_name.startswith(f'{STAGING_DIR}/'))
+        # 確定するまでは一時領域にだけ存在する
+        self.assertFalse(product_image_storage.exists(name))
+        product_image_storage.promote(staged_name, name)
+        self.assertTrue(product_image_storage.exists(name))
+        self.assertFalse(product_image_storage.exists(staged_name))
+
+    def test_same_content_is_stored_once(self):
+        data = make_image(100, 100)
+        first = product_image_storage.save('product_images/a.jpg', ContentFile(data))
+        name, staged_name = product_image_storage.stage('product_images/b.jpg', ContentFile(data))
+        self.assertEqual(name, first)
+        product_image_storage.promote(staged_name, name)
+        self.assertFalse(product_image_storage.exists(staged_name))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, STAGING_DIR)), [])
+
+    def test_promote_rewrites_existing_file(self):
+        # 同じ内容のファイルがあっても置き換える (削除待ちの処理に書き直されたことが分かるように)
+        data = make_image(100, 100)
+        first = product_image_storage.save('product_images/a.jpg', ContentFile(data))
+        before = os.stat(product_image_storage.path(first)).st_ino
+        name, staged_name = product_image_storage.stage('product_images/b.jpg', ContentFile(data))
+        product_image_storage.promote(staged_name, name)
+        self.assertNotEqual(os.stat(product_image_storage.path(name)).st_ino, before)
+
+    def test_discard(self):
+        _, staged_name = product_image_storage.stage('product_images/a.jpg', ContentFile(make_image(10, 10)))
+        product_image_storage.discard(staged_name)
+        self.assertFalse(product_image_storage.exists(staged_name))
+
+    def test_duplicate_image_shares_file_and_renditions(self):
+        data = make_image(800, 600)
+        first = self.add_image(self.product, data)
+        first.refresh_from_db()
+        with mock.patch.object(renditions, 'schedule_renditions') as schedule:
+            second = self.add_image(self.product, data, name='copy.jpg', display_order=4)
+        schedule.assert_not_called()
+        second.refresh_from_db()
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.renditions, first.renditions)
+
+    def test_dedupe_product_images(self):
+        data = make_image(100, 100)
+        os.makedirs(os.path.join(self.media_root, 'product_images'))
+        with open(os.path.join(self.media_root, 'product_images', 'old.jpg'), 'wb') as f:
+            f.write(data)
+        image = ProductImage.objects.get(display_order=1)
+        ProductImage.objects.filter(pk=image.pk).update(image='product_images/old.jpg')
+
+        out, err = io.StringIO(), io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_product_images', skip_renditions=True, stdout=out, stderr=err)
+        # ファイルのない画像 (テスト用データの2枚) は飛ばす
+        self.assertIn('1 件の画像を保存し直しました。(ファイルなし: 2 件)', out.getvalue())
+        image.refresh_from_db()
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertTrue(image.image.name.endswith(f'/{digest}.jpg'))
+        self.assertTrue(product_image_storage.exists(image.image.name))
+        # 古いファイルは削除待ちに登録される
+        self.assertTrue(FileTombstone.objects.filter(name='product_images/old.jpg').exists())
+
+
+class ResizedImageEndpointTests(TempMediaMixin, ProductImageFixtureMixin, TestCase):
+    """リサイズ画像のエンドポイント (/media/r/<width>/<path>) とディスクの LRU キャッシュ"""
+
+    def setUp(self):
+        super().setUp()
+        with mock.patch.object(renditions, 'schedule_renditions'):
+            self.image = self.add_image(self.product, make_image(1200, 600))
+        self.url = reverse('resized_image', args=[400, self.image.image.name])
+
+    def test_resizes_and_negotiates_format(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (400, 200))
+        self.assertIn('Accept', response['Vary'].split(', '))
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(self.url, headers={'Accept': 'image/webp,*/*'})
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).format, 'WEBP')
+
+    def test_conditional_request(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_only_allowed_widths(self):
+        self.assertEqual(self.client.get(reverse('resized_image', args=[401, self.image.image.name])).status_code, 404)
+        self.assertEqual(resize_cache.nearest_width(401), 600)
+        self.assertEqual(resize_cache.nearest_width(5000), resize_cache.ALLOWED_WIDTHS[-1])
+
+    def test_only_registered_images(self):
+        for path in ('product_images/unknown.jpg', '../../en_freamarket/settings.py', f'{STAGING_DIR}/x.tmp'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(f'/media/r/400/{path}').status_code, 404)
+        # 登録済みでもファイルがない場合
+        self.assertEqual(self.client.get(reverse('resized_image', args=[400, 'product_images/main.jpg'])).status_code, 404)
+
+    def test_cached_file_is_reused(self):
+        self.client.get(self.url)
+        with mock.patch.object(resize_cache, '_render') as render:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        render.assert_not_called()
+
+    def write_cache_file(self, name, size, mtime):
+        path = os.path.join(resize_cache.cache_root(), 'ab', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_evicts_least_recently_used(self):
+        paths = [self.write_cache_file(f'{i}.webp', 100, 1_000_000 + i) for i in range(5)]
+        self.assertEqual(resize_cache.evict(max_bytes=1000), 0)
+        # 予算の 90% (360 byte) 以下になるまで古いものから削除する
+        self.assertEqual(resize_cache.evict(max_bytes=400), 200)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, False, True, True, True])
+        # keep のファイルは古くても削除しない
+        self.assertEqual(resize_cache.evict(max_bytes=200, keep=(paths[2],)), 200)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, False, True, False, False])
+
+    def test_access_refreshes_lru_order(self):
+        self.client.get(self.url)
+        key = resize_cache.cache_key(self.image.image.name, 400, 'jpeg')
+        path = resize_cache.cache_path(key, 'jpeg')
+        os.utime(path, (1_000_000, 1_000_000))
+        newer = self.write_cache_file('newer.webp', os.path.getsize(path), 2_000_000)
+        # 最近アクセスした画像は残り、アクセスのないものが削除される
+        self.client.get(self.url)
+        resize_cache.evict(max_bytes=os.path.getsize(path) * 1.5)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(newer))
+
+    @override_settings(RESIZE_CACHE_MAX_BYTES=1)
+    def test_writes_trigger_eviction(self):
+        with mock.patch.object(resize_cache, '_written_since_scan', None):
+            old = self.write_cache_file('old.webp', 100, 1_000_000)
+            # 予算より大きい画像でも、作成した画像は削除せずに返す
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (400, 200))
+        self.assertFalse(os.path.exists(old))
+
+
+class ImageMetadataTests(TempMediaMixin, ProductImageFixtureMixin, TestCase):
+    """画像の幅・高さ・バイト数・ぼかしプレースホルダーの記録"""
+
+    def setUp(self):
+        super().setUp()
+        schedule = mock.patch.object(renditions, 'schedule_renditions')
+        schedule.start()
+        self.addCleanup(schedule.stop)
+
+    def test_recorded_on_save(self):
+        data = make_image(640, 480)
+        image = self.add_image(self.product, data)
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height, image.bytes), (640, 480, len(data)))
+        self.assertTrue(image.lqip.startswith('data:image/webp;base64,'))
+
+    def test_rotated_exif_swaps_width_and_height(self):
+        metadata = uploads.read_image_metadata(ContentFile(make_image(640, 480, orientation=8)))
+        self.assertEqual((metadata['width'], metadata['height']), (480, 640))
+
+    def test_pages_do_not_open_image_files(self):
+        self.client.force_login(self.seller)
+        with mock.patch.object(product_image_storage, 'open', side_effect=AssertionError('file opened')), \
+                mock.patch.object(default_storage, 'open', side_effect=AssertionError('file opened')):
+            response = self.client.get(reverse('products:product_detail', kwargs={'pk': self.product.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'width="800" height="600"')
+
+    def test_backfill_image_metadata(self):
+        data = make_image(320, 240)
+        first = self.add_image(self.product, data)
+        second = self.add_image(self.product, data, name='copy.jpg', display_order=4)
+        ProductImage.objects.update(width=None, height=None, bytes=None, lqip='')
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch(
+            'products.management.commands.backfill_image_metadata.read_image_metadata',
+            wraps=uploads.read_image_metadata,
+        ) as read:
+            call_command('backfill_image_metadata', stdout=out, stderr=err)
+        # 同じファイルを共有する画像は1回だけ読む
+        self.assertEqual(read.call_count, 1)
+        # ファイルのない画像 (テスト用データの3枚) は失敗として数える
+        self.assertIn('2 件の画像の情報を記録しました。(失敗: 3 件)', out.getvalue())
+        for image in (first, second):
+            image.refresh_from_db()
+            self.assertEqual((image.width, image.height, image.bytes), (320, 240, len(data)))
+
+
+class ListingImagePersistenceTests(TempMediaMixin, TestCase):
+    """出品・編集時の画像の保存 (1トランザクション・bulk_create・コミット後のファイル確定)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        kindergarten = Kindergarten.objects.create(
+            name='テスト園', auth_code='code', zip_code='1000001', prefecture='tokyo', address='千代田区',
+        )
+        cls.seller = User.objects.create_user(
+            email='seller@example.com', password='pw', name='出品者', kindergarten=kindergarten,
+        )
+        cls.category = ProductCategory.objects.create(name='制服')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.seller)
+
+    def form_data(self, **files):
+        data = {
+            'name': 'スモック', 'price': 500, 'product_category': self.category.pk,
+            'size': Product.Size.NO_SIZE, 'condition': Product.Condition.NEW, 'description': '',
+        }
+        for field, color in files.items():
+            data[field] = SimpleUploadedFile(f'{field}.jpg', make_image(300, 200, color=color))
+        return data
+
+    def staged_files(self):
+        staging = os.path.join(self.media_root, STAGING_DIR)
+        return os.listdir(staging) if os.path.isdir(staging) else []
+
+    def sell(self, data):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('products:sell'), data)
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "product_images"')]
+        return response, inserts
+
+    def test_sell_saves_images_in_one_insert(self):
+        response, inserts = self.sell(self.form_data(main_image='red', sub_image_1='blue', sub_image_2='green'))
+        self.assertRedirects(response, reverse('accounts:my_listings'), fetch_redirect_response=False)
+        product = Product.objects.get()
+        images = list(product.images.order_by('display_order'))
+        self.assertEqual([image.display_order for image in images], [0, 1, 2])
+        self.assertEqual(product.main_product_image, images[0])
+        self.assertEqual(len(inserts), 1)
+        # コミット後にファイルが確定し、一時ファイルは残らない
+        for image in images:
+            self.assertTrue(product_image_storage.exists(image.image.name))
+            self.assertEqual(image.width, 300)
+        self.assertEqual(self.staged_files(), [])
+
+    def test_duplicate_upload_reuses_renditions(self):
+        self.sell(self.form_data(main_image='red'))
+        first = ProductImage.objects.get()
+        self.assertTrue(first.renditions)
+        # 同じ内容の画像を別の商品として出品しても、レンディションは作り直さない
+        with mock.patch.object(renditions, 'schedule_renditions') as schedule:
+            self.sell(self.form_data(main_image='red', sub_image_1='blue'))
+        second = ProductImage.objects.exclude(pk=first.pk).get(image=first.image.name)
+        self.assertEqual(second.renditions, first.renditions)
+        self.assertEqual([call.args[0].image.name for call in schedule.call_args_list],
+                         [ProductImage.objects.get(display_order=1).image.name])
+
+    def test_failed_sell_saves_nothing(self):
+        with mock.patch('products.views.persist_product_images', side_effect=RuntimeError('boom')), \
+                self.assertLogs('products.views', level='ERROR'):
+            response, _ = self.sell(self.form_data(main_image='red', sub_image_1='blue'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(ProductImage.objects.exists())
+        self.assertEqual(self.staged_files(), [])
+
+    def test_edit_replaces_and_adds_images(self):
+        self.sell(self.form_data(main_image='red', sub_image_1='blue'))
+        product = Product.objects.get()
+        main_image = product.main_product_image
+        old_name = main_image.image.name
+
+        data = self.form_data(main_image='yellow', sub_image_3='white')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('products:product_edit', kwargs={'pk': product.pk}), data)
+        self.assertRedirects(response, reverse('accounts:my_listings'), fetch_redirect_response=False)
+
+        # メイン画像は同じ ProductImage のままファイルを差し替え、表示順 3 は新しく作成する
+        main_image.refresh_from_db()
+        self.assertNotEqual(main_image.image.name, old_name)
+        self.assertTrue(product_image_storage.exists(main_image.image.name))
+        self.assertEqual(list(product.images.order_by('display_order').values_list('display_order', flat=True)), [0, 1, 3])
+        # 差し替え前のファイルは削除待ちに登録される
+        self.assertTrue(FileTombstone.objects.filter(name=old_name).exists())
+        self.assertEqual(self.staged_files(), [])
+
+
+class MediaFileDeletionTests(TempMediaMixin, ProductImageFixtureMixin, TestCase):
+    """コミット後の削除待ち登録 (トゥームストーン) とまとめての削除、参照されていないファイルの回収"""
+
+    def setUp(self):
+        super().setUp()
+        self.image = self.add_image(self.product, make_image(400, 300))
+        self.image.refresh_from_db()
+        self.files = [self.image.image.name, *renditions.rendition_file_names(self.image.renditions)]
+
+    def delete_image(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+    def test_delete_is_deferred_until_reaped(self):
+        self.delete_image(self.image)
+        # 削除はリクエスト中に行わず、コミット後に削除待ちとして登録する
+        self.assertTrue(all(default_storage.exists(name) for name in self.files))
+        self.assertEqual(sorted(FileTombstone.objects.values_list('name', flat=True)), sorted(self.files))
+
+        self.assertEqual(media_gc.reap_file_tombstones(batch_size=2), (2, 0, 0))
+        out = io.StringIO()
+        call_command('reap_file_tombstones', stdout=out)
+        self.assertIn(f'削除: {len(self.files) - 2} 件, 参照ありのため残した: 0 件, 失敗: 0 件', out.getvalue())
+        self.assertFalse(any(default_storage.exists(name) for name in self.files))
+        self.assertFalse(FileTombstone.objects.exists())
+
+    def test_rolled_back_delete_registers_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError), transaction.atomic():
+            self.image.delete()
+            raise RuntimeError
+        self.assertFalse(FileTombstone.objects.exists())
+
+    def test_shared_file_is_kept(self):
+        self.add_image(self.product, make_image(400, 300), name='copy.jpg', display_order=4)
+        self.delete_image(self.image)
+        self.assertEqual(media_gc.reap_file_tombstones(), (0, len(self.files), 0))
+        self.assertTrue(all(default_storage.exists(name) for name in self.files))
+        self.assertFalse(FileTombstone.objects.exists())
+
+    def test_failed_delete_is_retried_then_given_up(self):
+        self.delete_image(self.image)
+        with mock.patch.object(product_image_storage, 'delete', side_effect=PermissionError('denied')), \
+                self.assertLogs('products.media_gc', level='WARNING'):
+            self.assertEqual(media_gc.reap_file_tombstones(max_attempts=1), (len(self.files) - 1, 0, 1))
+        tombstone = FileTombstone.objects.get()
+        self.assertEqual((tombstone.name, tombstone.attempts, tombstone.last_error), (self.image.image.name, 1, 'denied'))
+        # 試行回数が上限に達したものは再試行しない
+        self.assertEqual(media_gc.reap_file_tombstones(max_attempts=1), (0, 0, 0))
+
+    def test_reupload_during_reap_is_kept(self):
+        # 参照を確認した後、削除する前に同じ内容の画像が再アップロードされた場合は元画像を残す
+        name = self.image.image.name
+        with product_image_storage.open(name, 'rb') as f:
+            data = f.read()
+        self.delete_image(self.image)
+
+        lock = product_image_storage.lock
+        reuploaded = []
+
+        def reupload_then_lock(lock_name):
+            if not reuploaded:
+                reuploaded.append(lock_name)
+                product_image_storage.promote(product_image_storage.stage(name, ContentFile(data))[1], name)
+            return lock(lock_name)
+
+        with mock.patch.object(product_image_storage, 'lock', side_effect=reupload_then_lock):
+            self.assertEqual(media_gc.reap_file_tombstones(), (len(self.files) - 1, 1, 0))
+        self.assertTrue(product_image_storage.exists(name))
+        self.assertFalse(FileTombstone.objects.exists())
+
+    def test_product_delete_view(self):
+        self.client.force_login(self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('products:product_delete', kwargs={'pk': self.product.pk}))
+        self.assertFalse(ProductImage.objects.exists())
+        self.assertTrue(set(self.files) <= set(FileTombstone.objects.values_list('name', flat=True)))
+
+    def write_file(self, name, age):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return name
+
+    def test_gc_media_files(self):
+        old_orphan = self.write_file('product_images/ab/cd/orphan.jpg', age=7200)
+        new_orphan = self.write_file('product_images/ab/cd/uploading.jpg', age=10)
+        flat_orphan = self.write_file('product_images/flat.jpg', age=7200)
+        old_staged = self.write_file(f'{STAGING_DIR}/old.tmp', age=2 * 24 * 3600)
+        self.write_file(f'{STAGING_DIR}/new.tmp', age=10)
+
+        self.assertEqual(media_gc.find_orphan_files(), sorted([old_orphan, flat_orphan, old_staged]))
+        out = io.StringIO()
+        call_command('gc_media_files', dry_run=True, stdout=out)
+        self.assertTrue(default_storage.exists(old_orphan))
+
+        call_command('gc_media_files', stdout=out)
+        self.assertIn('3 件のファイルを削除しました。(失敗: 0 件)', out.getvalue())
+        self.assertFalse(default_storage.exists(old_orphan))
+        # 参照されているファイル・作成直後のファイルは残す
+        self.assertTrue(default_storage.exists(new_orphan))
+        self.assertTrue(all(default_storage.exists(name) for name in self.files))
+
+    def test_gc_keeps_file_rewritten_after_scan(self):
+        orphan = self.write_file('product_images/ab/cd/orphan.jpg', age=7200)
+        self.assertEqual(media_gc.find_orphan_files(), [orphan])
+        # 走査の後に同じ内容の画像が再アップロードされた
+        _, staged_name = product_image_storage.stage(orphan, ContentFile(b'x'))
+        product_image_storage.promote(staged_name, orphan)
+        with self.assertLogs('products.media_gc', level='INFO'):
+            self.assertEqual(media_gc.delete_files([orphan]), (0, 0))
+        self.assertTrue(default_storage.exists(orphan))
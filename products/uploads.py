@@ -0,0 +1,154 @@
+# products/uploads.py
+import base64
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from io import BytesIO
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .renditions import to_rgb
+
+logger = logging.getLogger(__name__)
+
+# 保存する画像の長辺の上限 (px)。拡大表示用のレンディション (2000px) を作れる大きさにしておく
+MAX_LONG_EDGE = 2560
+# 再エンコード時の JPEG 品質
+JPEG_QUALITY = 85
+# 処理できる画像の画素数の上限 (解凍爆弾対策)。スマートフォンの写真 (~50M px) は許可する
+MAX_PIXELS = 64_000_000
+# ぼかしプレースホルダー (LQIP) の長辺 (px)
+LQIP_SIZE = 16
+# EXIF の向き (Orientation) のタグ番号
+ORIENTATION_TAG = 0x0112
+# 1枚の処理を待つ時間 (秒)。超えた場合はリクエストをエラーにする (処理中のスレッドは止められないので最後まで動く)
+PROCESS_TIMEOUT = 15
+# 元のファイルのまま保存してよい形式と拡張子 (条件は _normalize を参照)
+KEEP_ORIGINAL_FORMATS = {'JPEG': 'jpg', 'PNG': 'png'}
+
+# Pillow のデコード・縮小は GIL を解放するため、スレッドでリクエストと並行して処理できる
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='upload-normalize')
+
+
+def build_lqip(image):
+    """画像を長辺 LQIP_SIZE px に縮小した、ぼかしプレースホルダー用の data URI を返す"""
+    small = to_rgb(image.copy())
+    small.thumbnail((LQIP_SIZE, LQIP_SIZE))
+    buffer = BytesIO()
+    small.save(buffer, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def read_image_metadata(file):
+    """
+    保存済み・保存前の画像ファイルから 幅・高さ・バイト数・プレースホルダー を読み取る
+    (アップロード時の正規化を通らなかった画像用)
+    """
+    file.seek(0)
+    data = file.read()
+    file.seek(0)
+    image = Image.open(BytesIO(data))
+    # draft で縮小してデコードする前の大きさを記録する (EXIF で90度回転する場合は幅と高さを入れ替える)
+    width, height = image.size
+    if image.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+        width, height = height, width
+    image.draft('RGB', (LQIP_SIZE * 8, LQIP_SIZE * 8))
+    image = ImageOps.exif_transpose(image)
+    return {'width': width, 'height': height, 'bytes': len(data), 'lqip': build_lqip(image)}
+
+
+def _check_pixels(image):
+    """ピクセルを展開する前にヘッダーの大きさで判定する"""
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise ValidationError(
+            f'画像のサイズが大きすぎます ({width}×{height})。小さい画像を選択してください。',
+            code='too_many_pixels',
+        )
+
+
+def _has_metadata(image):
+    """位置情報などが入りうるメタデータ (EXIF・XMP・PNG のテキスト) があるか"""
+    return bool(image.getexif() or image.info.get('xmp') or getattr(image, 'text', None))
+
+
+def _normalize(data):
+    """
+    画像のバイト列を縮小・向き補正・メタデータ削除した JPEG に変換する
+    元のファイルが JPEG / PNG で、大きさが上限以内・メタデータなしの場合は、JPEG にした結果と比べて小さい方を使う
+    戻り値: (バイト列, 拡張子, 幅・高さ・バイト数・プレースホルダーの辞書)
+    """
+    image = Image.open(BytesIO(data))
+    _check_pixels(image)
+    keep_extension = KEEP_ORIGINAL_FORMATS.get(image.format)
+    if keep_extension and (max(image.size) > MAX_LONG_EDGE or _has_metadata(image)):
+        keep_extension = None
+
+    # JPEG は draft モードで 1/2, 1/4, 1/8 に縮小しながらデコードする (メモリと時間の節約)
+    image.draft('RGB', (MAX_LONG_EDGE, MAX_LONG_EDGE))
+    # EXIF の向きを反映してからメタデータを付けずに保存する (位置情報などを残さない)
+    image = ImageOps.exif_transpose(image)
+    image = to_rgb(image)
+
+    # 上限の2倍以上ある場合は整数倍の縮小 (reduce) で大まかに縮めてから、高品質な縮小をかける
+    factor = max(image.size) // (MAX_LONG_EDGE * 2)
+    if factor >= 2:
+        image = image.reduce(factor)
+    image.thumbnail((MAX_LONG_EDGE, MAX_LONG_EDGE), Image.LANCZOS)
+
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    normalized, extension = buffer.getvalue(), 'jpg'
+    # 図やイラストの PNG などは JPEG にすると大きくなるので、元のファイルの方が小さければそのまま使う
+    if keep_extension and len(data) <= len(normalized):
+        normalized, extension = data, keep_extension
+    metadata = {'width': image.width, 'height': image.height, 'bytes': len(normalized), 'lqip': build_lqip(image)}
+    return normalized, extension, metadata
+
+
+def _invalid_image(uploaded_file, error):
+    logger.warning(f"Failed to normalize uploaded image: {uploaded_file.name}, Error: {error}", exc_info=True)
+    return ValidationError('画像を読み込めませんでした。別の画像を選択してください。', code='invalid_image')
+
+
+def normalize_upload(uploaded_file):
+    """
+    アップロードされた画像を保存用に正規化した ContentFile を返す (基本は JPEG。条件は _normalize を参照)
+    処理はリクエストのスレッドとは別のスレッドで行い、PROCESS_TIMEOUT 秒待っても終わらない場合はバリデーションエラーにする
+    (待つのをやめるだけで処理は止まらないため、大きすぎる画像はスレッドに渡す前にヘッダーで弾く)
+    """
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+
+    try:
+        header = Image.open(BytesIO(data))
+    except Exception as e:
+        raise _invalid_image(uploaded_file, e)
+    _check_pixels(header)
+
+    future = _executor.submit(_normalize, data)
+    try:
+        normalized, extension, metadata = future.result(timeout=PROCESS_TIMEOUT)
+    except TimeoutError:
+        logger.warning(f"Normalizing uploaded image timed out (still running): {uploaded_file.name}")
+        raise ValidationError('画像の処理に時間がかかりすぎました。別の画像を選択してください。', code='timeout')
+    except ValidationError:
+        raise
+    except Exception as e:
+        raise _invalid_image(uploaded_file, e)
+
+    original_size, size = len(data), len(normalized)
+    logger.info(
+        f"Normalized uploaded image. File: {uploaded_file.name}, Size: {metadata['width']}x{metadata['height']}, "
+        f"Bytes: {original_size} -> {size} (saved {original_size - size} bytes, "
+        f"{(1 - size / original_size) * 100 if original_size else 0:.1f}%)"
+    )
+
+    stem = os.path.splitext(os.path.basename(uploaded_file.name))[0] or 'image'
+    content = ContentFile(normalized, name=f'{stem}.{extension}')
+    # 呼び出し側で削減量・画像の情報を参照できるようにする (ProductImage の保存時に使う)
+    content.original_size = original_size
+    content.image_metadata = metadata
+    return content
@@ -1,22 +1,47 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.db import transaction
-from django.db.models import Q
 from .forms import ProductForm, ProductSearchForm
 from .models import Product, ProductImage
+from .pagination import CursorPaginator
+from .cards import ProductCard
+from .images import persist_product_images, staged_uploads
+from .search import apply_search_filters
+from .facets import get_facet_counts
+from .cache import listing_cache_key, get_cached_listing, set_cached_listing
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.exceptions import PermissionDenied
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from interactions.models import Comment, Favorite, PurchaseIntent
+from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
+from interactions.models import Favorite, PurchaseIntent
 from interactions.forms import CommentForm
+from interactions.outbox import enqueue_email
 from django.urls import reverse
-from django.template.loader import render_to_string
-from django.conf import settings
-from django.core.mail import send_mail
+from django.http import FileResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from . import resize_cache
+from .storage import product_image_storage
+import os
 
 import logging
 logger = logging.getLogger(__name__)
 
+# 商品一覧の1ページあたりの表示件数
+PRODUCTS_PER_PAGE = 10
+
+def for_sale_products(kindergarten_id):
+    """商品一覧に表示する商品 (園の販売中の商品)"""
+    return Product.objects.filter(status=Product.Status.FOR_SALE, kindergarten_id=kindergarten_id)
+
+
+def listing_paginator(queryset):
+    """
+    商品一覧のカーソルページネーション (check_query_plans でも同じクエリの実行計画を確認する)
+    商品カードの表示に必要なカラムだけを (created_at, id) をキーにして1ページ分 (+1件) だけ取得する
+    """
+    return CursorPaginator(ProductCard.values(queryset), PRODUCTS_PER_PAGE, row_factory=ProductCard.from_row)
+
+
 @login_required
 def product_list_view(request):
     """トップページ (商品一覧) ビュー"""
@@ -29,15 +54,14 @@ def product_list_view(request):
         messages.error(request, "所属園の情報が取得できませんでした。ログインし直してください。")
         return redirect('accounts:login')
 
-    queryset = Product.objects.filter(status=Product.Status.FOR_SALE, kindergarten=user_kindergarten)
+    # 一覧・件数は園の全員で共有してキャッシュするため、自分が出品したものはここでは除外しない
+    # (キャッシュから取得した後に除外する。件数は get_facet_counts で自分の出品の分を引く)
+    queryset = for_sale_products(user_kindergarten.pk)
 
-    if request.user.is_authenticated:
-        queryset = queryset.exclude(user=request.user) # 自分が出品したものを除外
+    # 絞り込み条件ごとの件数の集計に使う
+    base_queryset = queryset
 
-    queryset = queryset.select_related(
-        'main_product_image',
-        'product_category'
-    ).order_by('-created_at')
+    queryset = queryset.order_by('-created_at')
 
     # 検索結果を表示しない時用に変数の初期化
     selected_category_for_breadcrumb_obj = None
@@ -46,87 +70,97 @@ def product_list_view(request):
     search_form = ProductSearchForm(request.GET or None)
 
     if search_form.is_valid():
-        # 検索ルール
+        # 検索ルール (詳細は products.search.apply_search_filters)
         # キーワード、カテゴリ、価格、の絞り込みは AND 検索で行う
         # サイズ、状態の絞り込みは OR 検索で行う　（チェックされたサイズ（状態）のいずれかに合致する）
-        
-        # --- キーワード検索 ---
-        keyword = search_form.cleaned_data.get('keyword')
-        if keyword:
-            # 商品名 (name) または 商品説明 (description) にキーワードが含まれるものをOR検索
-            # 大文字・小文字を区別しない部分一致 (icontains)
-            queryset = queryset.filter(
-                Q(name__icontains=keyword) | Q(description__icontains=keyword)
-            )
-
-        # --- カテゴリ絞り込み ---
+        # キーワード検索は全文検索 (FTS5) が使える場合は関連度順、使えない場合は検索キーの部分一致 (新しい順)
+        queryset = apply_search_filters(queryset, search_form.cleaned_data)
+
         categories = search_form.cleaned_data.get('category') # ModelMultipleChoiceFieldはクエリセットを返す
         if categories: # 何かカテゴリが選択されていれば
-            queryset = queryset.filter(product_category__in=categories)
-            if categories.exists(): # 選択されたカテゴリが1つ以上あれば
-                selected_category_for_breadcrumb_obj = categories.first() # 最初のカテゴリオブジェクト
-
-        # --- 価格帯絞り込み ---
-        price_min = search_form.cleaned_data.get('price_min')
-        if price_min is not None: # 0も有効な値なので is not None でチェック
-            queryset = queryset.filter(price__gte=price_min)
-
-        price_max = search_form.cleaned_data.get('price_max')
-        if price_max is not None:
-            queryset = queryset.filter(price__lte=price_max)
-
-        # --- サイズ絞り込み ---
-        sizes = search_form.cleaned_data.get('size')
-        if sizes:
-            query_size = Q()
-            for s in sizes:
-                query_size |= Q(size=s) # 各サイズに対してOR条件でつなぐ
-            if query_size: # 何かサイズが選択されていれば
-                 queryset = queryset.filter(query_size)
-
-        # --- 状態絞り込み ---
-        conditions = search_form.cleaned_data.get('condition')
-        if conditions:
-            query_condition = Q()
-            for c in conditions:
-                query_condition |= Q(condition=c)
-            if query_condition:
-                 queryset = queryset.filter(query_condition)
-
-    # ページ上の商品に対し、お気に入り状態を追加
-    products_for_page = list(queryset.select_related('main_product_image', 'product_category').order_by('-created_at'))
+            selected_category_for_breadcrumb_obj = categories.first() # パンくずリスト用に最初のカテゴリオブジェクト
 
-    if request.user.is_authenticated:
-        # 現在のログインユーザーがお気に入り登録している全ての商品IDのセット
-        # 1. お気に入り登録済みの商品IDを取得, flat=True で値（product_id）が直接入ったリストを返す
-        # 2. set() で重複を取り除く
-        favorited_product_ids = set(
-            Favorite.objects.filter(user=request.user).values_list('product_id', flat=True)
+        # 絞り込み条件ごとの件数 (サイドバーに表示)
+        facet_counts = get_facet_counts(
+            base_queryset, search_form.cleaned_data, user_kindergarten.pk, request.user.pk
         )
-        # 3.現在の商品のID (product.pk) が、取得したお気に入り商品IDのセット (favorited_product_ids) の中に含まれているかどうかを判定
-        # 含まれていれば True, 含まれていなければ False
-        for product in products_for_page:
-            product.is_favorited_by_current_user = product.pk in favorited_product_ids
     else:
-        for product in products_for_page:
-            product.is_favorited_by_current_user = False
+        facet_counts = get_facet_counts(base_queryset, {}, user_kindergarten.pk, request.user.pk)
 
     # 3. ページネーション処理
-    paginator = Paginator(products_for_page, 10) # 1ページあたり10件表示
-    page_number = request.GET.get('page')
+    # 'page' パラメータ付きのリクエストと、関連度順のキーワード検索結果は従来の番号付きページネーション
+    # それ以外は (created_at, id) をキーにしたカーソルページネーションで、1ページ分 (+1件) だけ取得する
+    is_ranked = 'search_rank' in queryset.query.annotations
+    is_cursor_pagination = 'page' not in request.GET and not is_ranked
+    if is_cursor_pagination:
+        page_token = 'cursor:' + request.GET.get('cursor', '')
+    else:
+        page_token = 'page:' + request.GET.get('page', '')
 
-    try:
-        products_on_page = paginator.page(page_number)
-    except PageNotAnInteger:
-        # 'page' パラメータが整数でない場合、最初のページを表示
-        products_on_page = paginator.page(1)
-    except EmptyPage:
-        # 'page' パラメータが範囲外の場合 (例: 9999ページ目)、最後のページを表示
-        products_on_page = paginator.page(paginator.num_pages)
+    # 園 + 検索条件 + ページごとにキャッシュする (園の商品が変更されるとバージョンが上がり無効になる)
+    cache_key = listing_cache_key(
+        user_kindergarten.pk,
+        search_form.cleaned_data if search_form.is_valid() else {},
+        page_token,
+    )
+    cached_listing = get_cached_listing(cache_key)
+
+    if is_cursor_pagination:
+        if cached_listing is not None:
+            products_on_page = cached_listing
+        else:
+            products_on_page = listing_paginator(queryset).page(request.GET.get('cursor'))
+            set_cached_listing(cache_key, products_on_page)
+    else:
+        # 商品カードの表示に必要なカラムだけを取得する (ProductCard)
+        card_queryset = ProductCard.values(queryset)
+        if not is_ranked:
+            card_queryset = card_queryset.order_by('-created_at', '-id')
+        # クエリセットのまま渡すことで COUNT + LIMIT/OFFSET のみ実行される
+        paginator = Paginator(card_queryset, PRODUCTS_PER_PAGE)
+
+        if cached_listing is not None:
+            # キャッシュ済みの件数と商品リストからページを復元する
+            paginator.count = cached_listing['count']
+            products_on_page = Page(cached_listing['object_list'], cached_listing['number'], paginator)
+        else:
+            page_number = request.GET.get('page')
+
+            try:
+                products_on_page = paginator.page(page_number)
+            except PageNotAnInteger:
+                # 'page' パラメータが整数でない場合、最初のページを表示
+                products_on_page = paginator.page(1)
+            except EmptyPage:
+                # 'page' パラメータが範囲外の場合 (例: 9999ページ目)、最後のページを表示
+                products_on_page = paginator.page(paginator.num_pages)
+
+            products_on_page.object_list = [ProductCard.from_row(row) for row in products_on_page.object_list]
+            set_cached_listing(cache_key, {
+                'object_list': products_on_page.object_list,
+                'number': products_on_page.number,
+                'count': paginator.count,
+            })
+
+    # 自分が出品したものを除外する (キャッシュは園で共有しているため、取得後に行う)
+    # ページの区切りは園全体で決まるので、自分の出品があるページは表示件数が少なくなる
+    products_on_page.object_list = [
+        product for product in products_on_page.object_list if product.user_id != request.user.pk
+    ]
+
+    # ページ上の商品に対し、お気に入り状態を追加
+    # 表示中のページの商品IDだけを問い合わせる (お気に入りの総数に関係なくページサイズ分のコスト)
+    favorited_product_ids = Favorite.objects.product_ids_for(
+        request.user, [product.pk for product in products_on_page]
+    )
+    for product in products_on_page:
+        product.is_favorited_by_current_user = product.pk in favorited_product_ids
 
     context = {
         'products': products_on_page, # 現在のページの商品リスト
+        'is_cursor_pagination': is_cursor_pagination, # テンプレートで表示するページャーの切り替えに使用
         'search_form': search_form,   # 絞り込み検索フォーム (後で追加)
+        'facet_counts': facet_counts, # 絞り込み条件ごとの件数
         'selected_category_for_breadcrumb_obj': selected_category_for_breadcrumb_obj, # パンクズリストのカテゴリ表示で使用
     }
     return render(request, 'products/product_list.html', context)
@@ -155,53 +189,27 @@ def sell(request):
                 # 3. ステータスを「販売中」に設定
                 product.status = Product.Status.FOR_SALE
 
-                # 4. Product オブジェクトをDBに保存 (ここで初めてIDが割り振られる)
-                product.save()
-
                 # --- 画像処理 ---
-                # 5. メイン画像を ProductImage として保存し、Product に紐付ける
-                main_image_saved = False # メイン画像が保存されたか追跡するフラグ
-                main_image_file = form.cleaned_data.get('main_image')
-                if main_image_file:
-                    main_pi = ProductImage.objects.create(
-                        product=product,
-                        image=main_image_file,
-                        display_order=0 # メイン画像は display_order=0
-                    )
-                    # 作成した ProductImage を Product の main_product_image フィールドに設定
-                    product.main_product_image = main_pi
-                    # main_product_image フィールドのみを更新
-                    product.save(update_fields=['main_product_image'])
-                    main_image_saved = True
-
-                if not main_image_saved:
-                    raise ValueError("メイン画像の保存に失敗しました。")
-
-                # 6. サブ画像を ProductImage として保存
-                uploaded_sub_image_1 = form.cleaned_data.get('sub_image_1')
-                if uploaded_sub_image_1:
-                    ProductImage.objects.create(
-                        product=product,
-                        image=uploaded_sub_image_1,
-                        display_order=1
-                    )
-
-                uploaded_sub_image_2 = form.cleaned_data.get('sub_image_2')
-                if uploaded_sub_image_2:
-                    ProductImage.objects.create(
-                        product=product,
-                        image=uploaded_sub_image_2,
-                        display_order=2
-                    )
+                # 4. 画像ファイルを一時領域に書き込み、商品と画像をまとめて1つのトランザクションで保存する
+                #    (途中で失敗した場合は商品・画像とも保存されず、一時ファイルも削除される)
+                image_files = {
+                    0: form.cleaned_data.get('main_image'), # メイン画像は display_order=0
+                    1: form.cleaned_data.get('sub_image_1'),
+                    2: form.cleaned_data.get('sub_image_2'),
+                    3: form.cleaned_data.get('sub_image_3'),
+                }
+                with staged_uploads(image_files) as staged_images, transaction.atomic():
+                    if 0 not in staged_images:
+                        raise ValueError("メイン画像の保存に失敗しました。")
 
-                uploaded_sub_image_3 = form.cleaned_data.get('sub_image_3')
-                if uploaded_sub_image_3:
-                    ProductImage.objects.create(
-                        product=product,
-                        image=uploaded_sub_image_3,
-                        display_order=3
-                    )
+                    # 5. Product オブジェクトをDBに保存 (ここで初めてIDが割り振られる)
+                    product.save()
 
+                    # 6. ProductImage を bulk_create でまとめて作成し、メイン画像を Product に紐付ける
+                    product_images = persist_product_images(product, staged_images)
+                    product.main_product_image = product_images[0]
+                    # main_product_image フィールドのみを更新
+                    product.save(update_fields=['main_product_image'])
 
                 # 7. 成功メッセージを設定
                 messages.success(request, '商品を出品しました。')
@@ -212,8 +220,8 @@ def sell(request):
             except ValueError as e:
                 form.add_error(None, f"登録エラーが発生しました: {e}") # フォーム全体のエラーとして表示
 
-            except Exception as e:
-                print(f"予期せぬエラー: {e}")
+            except Exception:
+                logger.exception(f"Unexpected error during product registration. User ID: {request.user.id}")
                 form.add_error(None, '登録中に予期せぬエラーが発生しました。しばらくしてから再度お試しください。')
 
         else:
@@ -245,18 +253,16 @@ def detail(request, pk):
         ),
         pk=pk
     )
-    sub_images = product.images.filter(display_order__gt=0).order_by('display_order')
+    # prefetch 済みの images からサブ画像を取り出す (追加のクエリなし)
+    sub_images = product.get_sub_images()
 
-    
     # ログインユーザーが出品者かどうかを判定するフラグ
     is_owner = False
     if request.user.is_authenticated and product.user == request.user:
         is_owner = True
 
     # ログインユーザーがお気に入りしたかどうかを判定するフラグ
-    is_favorited = False
-    if request.user.is_authenticated:
-        is_favorited = Favorite.objects.filter(user=request.user, product=product).exists()
+    is_favorited = product.pk in Favorite.objects.product_ids_for(request.user, [product.pk])
 
     # 購入意思表示状態の判定
     is_purchase_intended = False
@@ -264,7 +270,8 @@ def detail(request, pk):
         is_purchase_intended = PurchaseIntent.objects.filter(user=request.user, product=product).exists()
 
     # 関連するコメントを取得
-    comments = product.comments.all().order_by('created_at') # 関連するコメントを取得し、古い順に並べる
+    # prefetch 済みのコメントを使う (Comment.Meta.ordering で古い順に並んでいる。order_by を付けると再クエリになる)
+    comments = product.comments.all()
  
     # コメントフォーム処理
     if request.method == 'POST':
@@ -274,13 +281,13 @@ def detail(request, pk):
             comment = comment_form_data.save(commit=False)
             comment.product = product
             comment.user = request.user
-            comment.save()
-            messages.success(request, 'コメントを投稿しました。')
+            with transaction.atomic():
+                comment.save()
+                # コメント数を加算 (F() 式で UPDATE)
+                Product.objects.adjust_counter(product.pk, 'comment_count', 1)
 
-            # メール通知処理
-            if product.user != request.user:
-                try:
-                    subject = f'【園フリマ】「{product.name}」に新しいコメントがありました'
+                # 出品者への通知メールを送信待ちに登録 (送信は send_outbound_emails コマンドが行う)
+                if product.user != request.user:
                     mail_context = {
                         'product_owner_display_name': product.user.display_name or product.user.get_username(),
                         'product_name': product.name,
@@ -290,39 +297,13 @@ def detail(request, pk):
                             reverse('products:product_detail', kwargs={'pk': product.pk})
                         ),
                     }
-                    message_body = render_to_string('emails/new_comment_notification_email.txt', mail_context)
-                    recipient_list = [product.user.email]
-
-                    send_mail(
-                        subject,
-                        message_body,
-                        settings.DEFAULT_FROM_EMAIL,
-                        recipient_list,
-                        fail_silently=False
-                    )
-                    logger.info(
-                        f"Successfully new comment notification email. "
-                        f"Product: {product.name} (ID: {product.pk}), "
-                        f"Send to: {product.user.email},"
-                        f"Comment: {comment.content},"
-                        # 出品者情報
-                        f"Product Owner: {product.user.display_name} ({product.user.email}), "
-                        # コメント者情報
-                        f"Commenter: {request.user.display_name} ({request.user.email}), "
+                    enqueue_email(
+                        f'【園フリマ】「{product.name}」に新しいコメントがありました',
+                        'emails/new_comment_notification_email.txt',
+                        mail_context,
+                        [product.user.email],
                     )
-                except Exception as e:
-                    print(f"Error sending new comment notification email: {e}")
-                    logger.error(
-                        f"[[MAIL ERROR]] Failed to send new comment notification email. "
-                        f"Product: {product.name} (ID: {product.pk}), "
-                        f"Send to: {product.user.email}"
-                        f"Comment: {comment.content},"
-                        f"Product Owner: {product.user.display_name} ({product.user.email}), "
-                        f"Commenter: {request.user.display_name} ({request.user.email}), "
-                        f"Error: {e}",
-                        exc_info=True
-                    )
-                    messages.warning(request, "コメントは投稿しましたが、出品者への通知メールの送信に失敗しました。")
+            messages.success(request, 'コメントを投稿しました。')
 
             return redirect('products:product_detail', pk=product.pk) # 成功時はリダイレクト
         else:
@@ -348,7 +329,12 @@ def detail(request, pk):
 @login_required
 def edit(request, pk):
     """商品編集ビュー (一旦画像編集機能を除く)"""
-    product = get_object_or_404(Product, pk=pk)
+    # サブ画像は prefetch した images から取り出す (get_sub_images_as_dict で追加のクエリを発行しない)
+    product = get_object_or_404(
+        Product.objects.select_related('main_product_image').prefetch_related('images'),
+        pk=pk
+    )
+    sub_images_map = product.get_sub_images_as_dict()
 
     if product.user != request.user:
         messages.error(request, "この商品を編集する権限がありません。ログインし直してください。")
@@ -360,61 +346,36 @@ def edit(request, pk):
 
         if form.is_valid():
             try:
-                with transaction.atomic():
+                # アップロードされた画像を一時領域に書き込み、商品と画像をまとめて1つのトランザクションで保存する
+                image_files = {
+                    0: form.cleaned_data.get('main_image'),
+                    1: form.cleaned_data.get('sub_image_1'),
+                    2: form.cleaned_data.get('sub_image_2'),
+                    3: form.cleaned_data.get('sub_image_3'),
+                }
+                with staged_uploads(image_files) as staged_images, transaction.atomic():
                     # テキストベースのフィールドを保存
                     updated_product = form.save(commit=False) # まだDBには保存しない
 
-                    # メイン画像の更新処理
-                    new_main_image_file = form.cleaned_data.get('main_image') # フォームから新しい画像ファイルを取得
-
-                    if new_main_image_file: # 新しい画像がアップロードされた場合
-                        # 1. 既存のメイン画像を削除
-                        if product.main_product_image:
-                            print(f"Debug: Existing main image (ID: {product.main_product_image.pk}) will be deleted.")
-                            # まずファイルシステムから画像ファイルを削除
-                            product.main_product_image.image.delete(save=False) # save=False でDB更新はしない
-                            # 次に ProductImage レコードを削除
-                            product.main_product_image.delete()
-                            updated_product.main_product_image = None # 一旦Noneにしておく
-
-                        # 2. 新しい ProductImage を作成して紐付ける
-                        new_pi = ProductImage.objects.create(
-                            product=updated_product, # この時点ではまだ updated_product は保存されていないが、後で保存される
-                            image=new_main_image_file,
-                            display_order=0
-                        )
-                        updated_product.main_product_image = new_pi
-
-                    # サブ画像の更新処理
-                    existing_sub_images_map = product.get_sub_images_as_dict()
-                    for i in range(1, 4): # 1, 2, 3
-                        new_sub_image_file = form.cleaned_data.get(f'sub_image_{i}') # フォームから新しい画像ファイルを取得 (1, 2, 3)
-                        current_sub_image_instance = existing_sub_images_map.get(i)
-
-                        if new_sub_image_file: # 新しい画像がアップロードされた場合
-                            if current_sub_image_instance:
-                                # 既存のサブ画像を削除
-                                current_sub_image_instance.image.delete(save=False)
-                                # 既存のサブ画像を更新
-                                current_sub_image_instance.image = new_sub_image_file
-                                current_sub_image_instance.save()
-                            else:
-                                # 新しいサブ画像を作成
-                                ProductImage.objects.create(
-                                    product=updated_product, # この時点ではまだ updated_product は保存されていないが、後で保存される
-                                    image=new_sub_image_file,
-                                    display_order=i
-                                )    
-
-                    # 全ての変更をDBに保存
-                    updated_product.save()
+                    # 既存の画像 (表示順: ProductImage)。新しい画像がアップロードされた表示順は差し替え、ない表示順は作成する
+                    # (古いファイルは他から参照されていなければコミット後に削除される)
+                    existing_images = {0: product.main_product_image, **sub_images_map}
+                    product_images = persist_product_images(updated_product, staged_images, existing_images)
+                    if 0 in product_images:
+                        updated_product.main_product_image = product_images[0]
+
+                    # フォームの項目とメイン画像だけを保存する
+                    # (ステータス・取引相手・カウンターは他のリクエストが条件付き UPDATE で更新するため上書きしない)
+                    updated_product.save(update_fields=[*form._meta.fields, 'main_product_image', 'updated_at'])
 
                 messages.success(request, '商品情報を更新しました。')
                 return redirect('accounts:my_listings')
 
-            except Exception as e:
-                print(f"Error during product update (text fields only): {e}")
+            except Exception:
+                logger.exception(f"Error during product update. Product ID: {product.id}")
                 messages.error(request, '商品情報の更新中にエラーが発生しました。')
+                # ロールバックされたので、差し替えかけた画像を DB から読み直す (refresh_from_db で prefetch も破棄される)
+                product.refresh_from_db()
                 # エラー発生時もフォームを再表示 (編集中のデータを保持)
                 context = {
                     'form': form,
@@ -424,13 +385,12 @@ def edit(request, pk):
                 return render(request, 'products/edit.html', context)
 
         else:
-            print(form.errors)
             messages.error(request, '入力内容に誤りがあります。ご確認ください。')
             # エラーメッセージ付きのフォームを再表示
             context = {
                 'form': form,
                 'product': product,
-                'sub_images_map': product.get_sub_images_as_dict(),
+                'sub_images_map': sub_images_map,
             }
             return render(request, 'products/edit.html', context)
 
@@ -441,7 +401,7 @@ def edit(request, pk):
     context = {
         'form': form,
         'product': product,
-        'sub_images_map': product.get_sub_images_as_dict(),
+        'sub_images_map': sub_images_map,
     }
     return render(request, 'products/edit.html', context)
 
@@ -460,14 +420,12 @@ def delete(request, pk):
 
     if request.method == 'POST':
         try:
-            # 既存のメイン画像を削除
+            # 既存のメイン画像を削除 (ファイルは他から参照されていなければコミット後に削除される)
             if product.main_product_image:
-                product.main_product_image.image.delete(save=False) # ファイル削除
                 product.main_product_image.delete() # ProductImageレコード削除
 
-            # 既存のサブ画像を削除 とファイル)
+            # 既存のサブ画像を削除
             for sub_image in sub_images:
-                sub_image.image.delete(save=False)
                 sub_image.delete()
 
             product.delete() # 商品オブジェクト自体を削除
@@ -482,4 +440,39 @@ def delete(request, pk):
     context = {
         'product': product
     }
-    return render(request, 'products/delete_confirm.html', context)
\ No newline at end of file
+    return render(request, 'products/delete_confirm.html', context)
+
+# リサイズ画像 (/media/r/<width>/<path>)
+@require_safe
+def resized_image(request, width, path):
+    """商品画像を指定した横幅に縮小して返す (初回アクセス時に作成し、ディスクにキャッシュする)"""
+    if width not in resize_cache.ALLOWED_WIDTHS:
+        raise Http404('許可されていない横幅です。')
+    # ProductImage に登録されている画像だけを対象にする (image カラムのインデックスで確認)
+    if not ProductImage.objects.filter(image=path).exists():
+        raise Http404('画像が見つかりません。')
+    try:
+        source_mtime = int(os.path.getmtime(product_image_storage.path(path)))
+    except OSError:
+        raise Http404('画像が見つかりません。')
+
+    # WebP に対応したブラウザには WebP を返す
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    etag = resize_cache.etag_for(path, width, fmt, source_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=source_mtime)
+    if response is None:
+        try:
+            cached_path = resize_cache.get_resized(path, width, fmt)
+            response = FileResponse(open(cached_path, 'rb'), content_type=resize_cache.OUTPUT_FORMATS[fmt][0])
+        except FileNotFoundError:
+            # 取得の直後に容量管理で削除された場合は作り直す
+            cached_path = resize_cache.get_resized(path, width, fmt)
+            response = FileResponse(open(cached_path, 'rb'), content_type=resize_cache.OUTPUT_FORMATS[fmt][0])
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(source_mtime)
+    # 同じ URL の内容は変わらない (元画像は内容のハッシュで保存される) ので長期間キャッシュさせる
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response['Vary'] = 'Accept'
+    return response
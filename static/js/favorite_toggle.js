@@ -0,0 +1,47 @@
+/* static/js/favorite_toggle.js */
+/* お気に入りボタン: ページを再読み込みせずに登録/解除し、ハートのアイコンだけを切り替える */
+/* (JavaScript が無効な場合は通常のフォーム送信 + リダイレクトで動作する) */
+document.addEventListener('submit', function (event) {
+    var form = event.target;
+    if (!form.classList || !form.classList.contains('js-favorite-toggle')) {
+        return;
+    }
+    event.preventDefault();
+
+    var button = form.querySelector('button[type="submit"]');
+    if (button.disabled) {
+        return; // 送信中の連打は無視する
+    }
+    button.disabled = true;
+
+    fetch(form.action, {
+        method: 'POST',
+        body: new FormData(form),
+        headers: {
+            'Accept': 'application/json',
+            'X-CSRFToken': form.querySelector('[name="csrfmiddlewaretoken"]').value,
+        },
+        credentials: 'same-origin',
+    })
+        .then(function (response) {
+            if (!response.ok || response.headers.get('Content-Type').indexOf('application/json') === -1) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        })
+        .then(function (data) {
+            var icon = button.querySelector('i');
+            icon.classList.toggle('fas', data.favorited);
+            icon.classList.toggle('text-muted', data.favorited);
+            icon.classList.toggle('far', !data.favorited);
+            icon.classList.toggle('text-secondary', !data.favorited);
+            button.title = data.favorited ? 'お気に入り解除' : 'お気に入りに追加';
+        })
+        .catch(function () {
+            // ログイン切れなど JSON が返らない場合は通常の送信に切り替える
+            form.submit();
+        })
+        .finally(function () {
+            button.disabled = false;
+        });
+});